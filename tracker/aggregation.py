@@ -0,0 +1,115 @@
+from decimal import Decimal
+
+from django.db.models import Sum, F, Value, Case, When, DecimalField
+from django.db.models.functions import Coalesce
+
+from .models import Transaction, MonthlyRollup
+from .rollups import CREDIT_CATEGORY_Q, INCOME_CATEGORY_Q, rollups_between
+
+ZERO = Decimal('0')
+
+
+def _kind_total(kind):
+    """Conditional SUM of amount + reimbursement over rollup rows of one kind."""
+    return Coalesce(
+        Sum(Case(
+            When(kind=kind, then=F('amount') + F('reimbursement')),
+            default=Value(0),
+            output_field=DecimalField(),
+        )),
+        Value(0, output_field=DecimalField()),
+    )
+
+
+def period_totals(buckets):
+    """Aggregate income, spend and savings for a list of (year, month) buckets in one grouped query.
+
+    Returns a dict with:
+      'months': one entry per bucket, in the order given, with income, spend (net, negative
+                for outflows) and savings = income + spend.
+      'spending_by_category': per reporting category spend over all buckets, as a positive
+                total, shaped like annotate_reporting_category() rows.
+      'income_by_category': the same for income.
+    """
+    buckets = list(buckets)
+    months = {bucket: {'year': bucket[0], 'month': bucket[1], 'income': ZERO, 'spend': ZERO} for bucket in buckets}
+    spending = {}
+    income = {}
+    if buckets:
+        (start_year, start_month), (end_year, end_month) = min(buckets), max(buckets)
+        rows = (
+            rollups_between(start_year, start_month, end_year, end_month)
+            .values(
+                'year', 'month', 'reporting_category_id',
+                reporting_category_name=F('reporting_category__name'),
+                reporting_category_budget=F('reporting_category__budget'),
+            )
+            .annotate(
+                income_total=_kind_total(MonthlyRollup.KIND_INCOME),
+                spend_total=_kind_total(MonthlyRollup.KIND_SPEND),
+            )
+            .order_by()
+        )
+        for row in rows:
+            bucket = months.get((row['year'], row['month']))
+            if bucket is None:
+                continue
+            bucket['income'] += row['income_total']
+            bucket['spend'] += row['spend_total']
+            for totals, value, sign in ((income, row['income_total'], 1), (spending, row['spend_total'], -1)):
+                if not value:
+                    continue
+                entry = totals.setdefault(row['reporting_category_id'], {
+                    'reporting_category_id': row['reporting_category_id'],
+                    'reporting_category_name': row['reporting_category_name'],
+                    'reporting_category_budget': row['reporting_category_budget'],
+                    'total': ZERO,
+                })
+                entry['total'] += value * sign
+
+    month_rows = [months[bucket] for bucket in buckets]
+    for row in month_rows:
+        row['savings'] = row['income'] + row['spend']
+    return {
+        'months': month_rows,
+        'spending_by_category': list(spending.values()),
+        'income_by_category': list(income.values()),
+    }
+
+
+def running_average(values, window=3):
+    """Trailing mean over up to `window` values ending at each position."""
+    averages = []
+    for i in range(len(values)):
+        recent = values[max(0, i - window + 1):i + 1]
+        averages.append(sum(recent) / len(recent))
+    return averages
+
+
+def daily_totals(start, end):
+    """Income and spend per day over [start, end) from one GROUP BY date on Transaction.
+    Returns {date: {'income': Decimal, 'spend': Decimal}}; spend is net and negative for outflows.
+    Credits are excluded, matching the rollup kinds.
+    """
+    net_amount = F('amount') + Coalesce('reimbursement', Value(0, output_field=DecimalField()))
+    zero = Value(0, output_field=DecimalField())
+    rows = (
+        Transaction.objects.filter(date__gte=start, date__lt=end)
+        .values('date')
+        .annotate(
+            income=Coalesce(Sum(Case(
+                When(CREDIT_CATEGORY_Q, then=zero),
+                When(INCOME_CATEGORY_Q, then=net_amount),
+                default=zero,
+                output_field=DecimalField(),
+            )), zero),
+            spend=Coalesce(Sum(Case(
+                When(CREDIT_CATEGORY_Q, then=zero),
+                When(INCOME_CATEGORY_Q, then=zero),
+                default=net_amount,
+                output_field=DecimalField(),
+            )), zero),
+        )
+        .order_by('date')
+    )
+    return {row['date']: {'income': row['income'], 'spend': row['spend']} for row in rows}
@@ -0,0 +1,39 @@
+import uuid
+
+from django.db import IntegrityError, transaction as db_transaction
+
+from .models import CacheVersion
+
+
+def bump_version(name):
+    """Give `name` a new version token and return (replaced token, new token). Call it inside
+    the transaction that changes the data: a rollback restores the previous token, and tokens
+    are random, so a result built from rolled-back data never matches a later token.
+
+    The row is locked while it is replaced, so a process holding a result tagged with the
+    replaced token knows no other write came in between and may patch that result with its
+    own write's delta rather than drop it.
+    """
+    token = uuid.uuid4().hex
+    with db_transaction.atomic():
+        replaced = (
+            CacheVersion.objects.select_for_update().filter(name=name).values_list('version', flat=True).first()
+        )
+        if replaced is None:
+            replaced = current_version(name)
+        CacheVersion.objects.filter(name=name).update(version=token)
+    return replaced, token
+
+
+def current_version(name):
+    """The committed (or, inside a write, pending) token for `name`. The first read creates
+    the row, so every state of the data has a token of its own."""
+    version = CacheVersion.objects.filter(name=name).values_list('version', flat=True).first()
+    if version is None:
+        try:
+            with db_transaction.atomic():
+                version = CacheVersion.objects.create(name=name, version=uuid.uuid4().hex).version
+        except IntegrityError:
+            # Another process created it first.
+            version = CacheVersion.objects.get(name=name).version
+    return version
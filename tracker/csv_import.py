@@ -0,0 +1,291 @@
+import csv
+import os
+import tempfile
+import time
+import uuid
+from datetime import date, datetime
+from functools import lru_cache
+from decimal import Decimal, InvalidOperation
+from io import TextIOWrapper
+
+from django.db import transaction as db_transaction
+
+from .models import Transaction, Category, Source
+from .duplicates import NearDuplicateIndex
+from .recurring_detector import invalidate_suggestions
+from . import month_cache
+from .insights import invalidate_spend_matrix
+from .range_ledger import apply_daily_deltas, daily_deltas, invalidate_daily_ledger
+from .reward_rates import invalidate_reward_rates
+from .rollups import rebuild_rollups
+from .spend_index import apply_spend_deltas, spend_deltas
+
+COLUMN_ALIASES = {
+    "description": ["description", "desc", "details"],
+    "amount": ["amount", "amt", "value"],
+    "date": ["date", "transaction date", "timestamp"],
+    "category": ["category", "type", "label"],
+    "source": ["source", "payment method", "account", "wallet", "account/card from"],
+}
+
+PREVIEW_ROWS = 10
+DESCRIPTION_MAX_LENGTH = Transaction._meta.get_field("description").max_length
+MAX_AMOUNT = Decimal(10) ** (
+    Transaction._meta.get_field("amount").max_digits - Transaction._meta.get_field("amount").decimal_places
+)
+BATCH_SIZE = 1000
+STAGING_PREFIX = "tracker-import-"
+# Staging files older than this belong to previews that were never confirmed or cancelled
+# (typically because the session expired); stage_upload() removes them.
+STAGING_MAX_AGE = 24 * 60 * 60
+
+
+def map_columns(fieldnames):
+    """Map our column keys to the upload's headers using COLUMN_ALIASES."""
+    header_map = {header.lower().strip(): header for header in fieldnames or []}
+    column_map = {}
+    for key, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in header_map:
+                column_map[key] = header_map[alias]
+                break
+    return column_map
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    # Bank exports repeat the same few hundred dates; strptime dominates the parse otherwise.
+    try:
+        return datetime.strptime(value, "%m/%d/%y").date()
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_amount(value):
+    try:
+        return Decimal(value.replace("$", "").replace(",", "").strip())
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {value!r}")
+
+
+def validate_row(row, amount):
+    """Reject values the database would refuse, so one bad row cannot fail a whole batch."""
+    if len(row.get("description", "")) > DESCRIPTION_MAX_LENGTH:
+        raise ValueError(f"description longer than {DESCRIPTION_MAX_LENGTH} characters")
+    if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f"amount {row['amount']!r} out of range")
+    for key, model in (("category", Category), ("source", Source)):
+        max_length = model._meta.get_field("name").max_length
+        if len(row.get(key, "").strip()) > max_length:
+            raise ValueError(f"{key} name longer than {max_length} characters")
+
+
+def _staging_path(token):
+    # Tokens come from the session; never let one point outside the temp directory.
+    return os.path.join(tempfile.gettempdir(), STAGING_PREFIX + os.path.basename(str(token)) + ".csv")
+
+
+def stage_upload(uploaded_file):
+    """Stream an uploaded CSV into a staging file of parsed rows.
+
+    Only a token is meant to be kept in the session. Returns a dict with the token, the
+    column map, the first PREVIEW_ROWS raw rows (each with the description of any likely
+    duplicate), the staged row and duplicate counts, the staged date range and a list of
+    {'line', 'error'} for rows that could not be parsed.
+    """
+    discard_expired_staged()
+    reader = csv.DictReader(TextIOWrapper(uploaded_file.file, encoding="utf-8-sig", newline=""))
+    column_map = map_columns(reader.fieldnames)
+    token = uuid.uuid4().hex
+    preview_rows = []
+    errors = []
+    row_count = 0
+    first_date = last_date = None
+
+    # Staged columns: line, description, amount, ISO date, category name, source name,
+    # and the description of a likely duplicate, filled in by flag_duplicates().
+    with open(_staging_path(token), "w", newline="", encoding="utf-8") as staging:
+        writer = csv.writer(staging)
+        # Line 1 is the header row.
+        for line, raw in enumerate(reader, start=2):
+            row = {key: (raw.get(header) or "") for key, header in column_map.items()}
+            if len(preview_rows) < PREVIEW_ROWS:
+                preview_rows.append(dict(row, line=line))
+            try:
+                if not row.get("date"):
+                    raise ValueError("missing date")
+                if not row.get("amount"):
+                    raise ValueError("missing amount")
+                txn_date = parse_date(row["date"].strip())
+                amount = parse_amount(row["amount"])
+                validate_row(row, amount)
+            except ValueError as e:
+                errors.append({"line": line, "error": str(e)})
+                continue
+            writer.writerow([
+                line, row.get("description", ""), amount, txn_date.isoformat(),
+                row.get("category", "").strip(), row.get("source", "").strip(), "",
+            ])
+            row_count += 1
+            first_date = txn_date if first_date is None else min(first_date, txn_date)
+            last_date = txn_date if last_date is None else max(last_date, txn_date)
+
+    duplicates = flag_duplicates(token, (first_date, last_date))
+    for row in preview_rows:
+        row["duplicate"] = duplicates.get(row["line"])
+
+    return {
+        "token": token,
+        "column_map": column_map,
+        "preview_rows": preview_rows,
+        "row_count": row_count,
+        "duplicate_count": len(duplicates),
+        "date_range": (first_date, last_date),
+        "errors": errors,
+    }
+
+
+def flag_duplicates(token, date_range):
+    """Mark staged rows that look like transactions already in the ledger.
+
+    One query loads the transactions around the file's date range into a
+    NearDuplicateIndex; every staged row is probed against it in memory and the staging
+    file is rewritten with the matched transaction's description in the duplicate column.
+    Returns {line: matched description} for the flagged rows.
+    """
+    first_date, last_date = date_range
+    if not first_date:
+        return {}
+    index = NearDuplicateIndex.for_range(first_date, last_date)
+
+    duplicates = {}
+    path = _staging_path(token)
+    with open(path + ".flagged", "w", newline="", encoding="utf-8") as flagged:
+        writer = csv.writer(flagged)
+        for row in staged_rows(token):
+            matches = index.matches(row["description"], row["date"], row["amount"])
+            if matches:
+                duplicates[row["line"]] = matches[0]["description"]
+            writer.writerow([
+                row["line"], row["description"], row["amount"], row["date"].isoformat(),
+                row["category"], row["source"], duplicates.get(row["line"], ""),
+            ])
+    os.replace(path + ".flagged", path)
+    return duplicates
+
+
+def staged_rows(token):
+    """Iterate the parsed rows of a staged import."""
+    with open(_staging_path(token), newline="", encoding="utf-8") as staging:
+        for line, description, amount, txn_date, category, source, duplicate in csv.reader(staging):
+            yield {
+                "line": int(line),
+                "description": description,
+                "amount": Decimal(amount),
+                "date": date.fromisoformat(txn_date),
+                "category": category,
+                "source": source,
+                "duplicate": duplicate,
+            }
+
+
+def discard_staged(token):
+    try:
+        os.remove(_staging_path(token))
+    except OSError:
+        pass
+
+
+def discard_expired_staged(max_age=STAGING_MAX_AGE):
+    """Remove abandoned staging files last written more than max_age seconds ago."""
+    cutoff = time.time() - max_age
+    with os.scandir(tempfile.gettempdir()) as entries:
+        for entry in entries:
+            if not entry.name.startswith(STAGING_PREFIX):
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _name_map(model, names):
+    """name -> id for every name, creating the missing rows in one bulk insert."""
+    names = {name for name in names if name}
+    ids = dict(model.objects.filter(name__in=names).values_list("name", "id"))
+    missing = names - ids.keys()
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in sorted(missing)])
+        ids.update(model.objects.filter(name__in=missing).values_list("name", "id"))
+        # bulk_create skips the post_save receivers that drop these caches.
+        invalidate_reward_rates()
+        invalidate_suggestions()
+    return ids
+
+
+def import_staged(token, date_range, batch_size=BATCH_SIZE):
+    """Insert a staged import with batched bulk_create inside one transaction.
+
+    The staging file is read twice: once to resolve every category and source name to an
+    id, then again to insert. Rows identical to an existing transaction (or to an earlier
+    row of the same file) on description, amount, date, category and source are skipped,
+    as get_or_create did. Returns {'created', 'skipped'} and removes the staging file.
+    Raises OSError if the staging file no longer exists.
+    """
+    names = {"category": set(), "source": set()}
+    for row in staged_rows(token):
+        names["category"].add(row["category"])
+        names["source"].add(row["source"])
+
+    created = skipped = 0
+    months = set()
+    bonus_spend = {}
+    ledger_deltas = {}
+    with db_transaction.atomic():
+        category_ids = _name_map(Category, names["category"])
+        source_map = _name_map(Source, names["source"])
+
+        first_date, last_date = date_range
+        seen = set()
+        if first_date and last_date:
+            seen = set(
+                Transaction.objects.filter(date__gte=first_date, date__lte=last_date)
+                .values_list("description", "amount", "date", "category_id", "source_id")
+            )
+
+        batch = []
+        for row in staged_rows(token):
+            key = (row["description"], row["amount"], row["date"],
+                   category_ids.get(row["category"]), source_map.get(row["source"]))
+            if key in seen:
+                skipped += 1
+                continue
+            seen.add(key)
+            batch.append(Transaction(
+                description=key[0], amount=key[1], date=key[2], category_id=key[3], source_id=key[4],
+            ))
+            months.add((row["date"].year, row["date"].month))
+            if len(batch) >= batch_size:
+                Transaction.objects.bulk_create(batch)
+                spend_deltas(batch, bonus_spend)
+                daily_deltas(batch, ledger_deltas)
+                created += len(batch)
+                batch = []
+        if batch:
+            Transaction.objects.bulk_create(batch)
+            spend_deltas(batch, bonus_spend)
+            daily_deltas(batch, ledger_deltas)
+            created += len(batch)
+
+        # bulk_create skips the Transaction signals; refresh derived tables for what changed.
+        rebuild_rollups(months)
+        month_cache.invalidate_months(months)
+        apply_spend_deltas(bonus_spend)
+        apply_daily_deltas(ledger_deltas)
+        invalidate_suggestions()
+        invalidate_spend_matrix()
+        invalidate_daily_ledger()
+
+    discard_staged(token)
+    return {"created": created, "skipped": skipped}
@@ -0,0 +1,167 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from .models import Transaction
+
+# A transaction is a near duplicate of another when it falls within NEAR_DUPLICATE_DAYS,
+# its amount is within NEAR_DUPLICATE_AMOUNT_TOLERANCE, and either the descriptions name the
+# same merchant and score at least NEAR_DUPLICATE_SIMILARITY or the date and amount match exactly.
+NEAR_DUPLICATE_DAYS = 3
+NEAR_DUPLICATE_AMOUNT_TOLERANCE = Decimal('1.00')
+NEAR_DUPLICATE_SIMILARITY = 0.4
+NGRAM_SIZE = 3
+
+WORD_RE = re.compile(r'[a-z]+')
+VOWELS_RE = re.compile(r'(?<=.)[aeiou]')
+# Domain suffixes, company forms and card-processor or bank prefixes that many unrelated
+# merchants share ('Netflix.com' / 'Amazon.com', 'SQ *BLUE BOTTLE' / 'SQ *SWEETGREEN').
+GENERIC_TOKENS = frozenset({
+    'com', 'net', 'org', 'www', 'inc', 'llc', 'ltd', 'co',
+    'sq', 'tst', 'pos', 'debit', 'checkcard', 'purchase', 'ach',
+})
+MIN_TOKEN_LENGTH = 3
+
+
+def description_tokens(description):
+    """Lowercased alphabetic words; digits and punctuation (store numbers, '*', '.com') dropped."""
+    return WORD_RE.findall((description or '').lower())
+
+
+def _skeleton(token):
+    return VOWELS_RE.sub('', token)
+
+
+def description_profile(description):
+    """Character n-grams of each word, plus each word's consonant skeleton so bank
+    abbreviations line up with the full name ('amzn' and 'amazon' both give '~amzn').
+    GENERIC_TOKENS and words shorter than MIN_TOKEN_LENGTH (country codes and fragments of
+    reference numbers such as 'us' or 'mk') are left out, and the first remaining word's
+    skeleton is kept as the merchant marker ('^amzn')."""
+    grams = set()
+    tokens = [
+        token for token in description_tokens(description)
+        if len(token) >= MIN_TOKEN_LENGTH and token not in GENERIC_TOKENS
+    ]
+    for token in tokens:
+        padded = f" {token} "
+        grams.update(padded[i:i + NGRAM_SIZE] for i in range(max(len(padded) - NGRAM_SIZE + 1, 1)))
+        grams.add('~' + _skeleton(token))
+    if tokens:
+        grams.add('^' + _skeleton(tokens[0]))
+    return frozenset(grams)
+
+
+def _merchant(profile):
+    return next((gram[1:] for gram in profile if gram[0] == '^'), '')
+
+
+def same_merchant(a, b):
+    """Whether two profiles lead with the same merchant word, allowing one skeleton to
+    abbreviate the other ('whlfds' / 'whl')."""
+    merchant_a, merchant_b = _merchant(a), _merchant(b)
+    if not merchant_a or not merchant_b:
+        return False
+    return merchant_a.startswith(merchant_b) or merchant_b.startswith(merchant_a)
+
+
+def profile_similarity(a, b):
+    """Dice coefficient of two n-gram profiles, or the share of the smaller profile's
+    skeletons found in the larger one, whichever is higher. Profiles that do not lead with
+    the same merchant score 0, however many other words they share."""
+    if not a or not b or not same_merchant(a, b):
+        return 0.0
+    shared = a & b
+    dice = 2 * len(shared) / (len(a) + len(b))
+    skeletons_a = {g for g in a if g[0] == '~'}
+    skeletons_b = {g for g in b if g[0] == '~'}
+    smaller = min(len(skeletons_a), len(skeletons_b))
+    skeleton_share = len(skeletons_a & skeletons_b) / smaller if smaller else 0.0
+    return max(dice, skeleton_share)
+
+
+def _cents(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+class NearDuplicateIndex:
+    """In-memory index of ledger rows for near-duplicate lookups.
+
+    Rows are bucketed by day ordinal and kept sorted by amount in cents within each day,
+    so probes compare plain integers; a row's n-gram
+    profile is computed the first time it is compared and then reused. A lookup touches
+    only the days inside the window and, within each, only the amounts inside the
+    tolerance (by bisection), so its cost depends on how busy those few days are, not on
+    the size of the ledger.
+    """
+
+    def __init__(self, rows, days=NEAR_DUPLICATE_DAYS, tolerance=NEAR_DUPLICATE_AMOUNT_TOLERANCE,
+                 threshold=NEAR_DUPLICATE_SIMILARITY):
+        self.days = days
+        self.tolerance = _cents(tolerance)
+        self.threshold = threshold
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[row['date'].toordinal()].append((_cents(row['amount']), row['id'], row['date'], row['amount'], row['description']))
+        self.by_day = {}
+        for day, entries in by_day.items():
+            entries.sort(key=lambda entry: (entry[0], entry[1]))
+            self.by_day[day] = ([entry[0] for entry in entries], entries)
+        self.profiles = {}
+
+    def profile(self, row_id, description):
+        profile = self.profiles.get(row_id)
+        if profile is None:
+            profile = self.profiles[row_id] = description_profile(description)
+        return profile
+
+    @classmethod
+    def for_range(cls, start, end, days=NEAR_DUPLICATE_DAYS, **kwargs):
+        """Index every transaction dated within `days` of [start, end], in one query."""
+        rows = Transaction.objects.filter(
+            date__gte=start - timedelta(days=days), date__lte=end + timedelta(days=days),
+        ).values('id', 'date', 'amount', 'description')
+        return cls(rows, days=days, **kwargs)
+
+    def matches(self, description, txn_date, amount, exclude_id=None):
+        """Near duplicates of one transaction, best first, as dicts with id, date, amount,
+        description and score (1.0 for an exact date and amount match)."""
+        profile = None
+        cents = _cents(amount)
+        ordinal = txn_date.toordinal()
+        results = []
+        for day in range(ordinal - self.days, ordinal + self.days + 1):
+            bucket = self.by_day.get(day)
+            if bucket is None:
+                continue
+            amounts, entries = bucket
+            lo = bisect_left(amounts, cents - self.tolerance)
+            hi = bisect_right(amounts, cents + self.tolerance)
+            for other_cents, other_id, other_date, other_amount, other_description in entries[lo:hi]:
+                if other_id == exclude_id:
+                    continue
+                if day == ordinal and other_cents == cents:
+                    score = 1.0
+                else:
+                    if profile is None:
+                        profile = description_profile(description)
+                    score = profile_similarity(profile, self.profile(other_id, other_description))
+                    if score < self.threshold:
+                        continue
+                results.append({
+                    'id': other_id,
+                    'date': other_date,
+                    'amount': other_amount,
+                    'description': other_description,
+                    'score': score,
+                })
+        results.sort(key=lambda match: (-match['score'], abs((match['date'] - txn_date).days)))
+        return results
+
+
+def find_near_duplicates(description, txn_date, amount, exclude_id=None, **kwargs):
+    """Near duplicates of a single transaction, loading only the surrounding days."""
+    index = NearDuplicateIndex.for_range(txn_date, txn_date, **kwargs)
+    return index.matches(description, txn_date, amount, exclude_id=exclude_id)
@@ -0,0 +1,139 @@
+import calendar
+from datetime import date
+
+import numpy as np
+from django.core.cache import cache
+
+from .cache_versions import bump_version, current_version
+from .models import Category, MonthlyRollup
+from .rollups import SPEND_TREND_LOOKBACK_MONTHS, net_total, rollup_key, rollups_between
+
+# Cache key holding the SpendMatrix, and the CacheVersion it is built against. Transaction
+# and category writes and the bulk paths bump the version (see tracker/signals.py). A
+# transaction write patches the writing process's matrix with its delta; every other
+# process sees the new version and rebuilds on next use.
+MATRIX_CACHE_KEY = 'tracker:insights:spend_matrix'
+MATRIX_VERSION = 'spend_matrix'
+
+# A category is called out when its month-to-date pace is this many standard deviations
+# above its trailing mean and at least this much higher in relative terms.
+ANOMALY_Z_SCORE = 1.5
+ANOMALY_MIN_INCREASE = 0.2
+# Early in the month the pace is extrapolated from at most 1 / MIN_MONTH_FRACTION times
+# the spend so far, so a single purchase on the 1st does not look like a spike.
+MIN_MONTH_FRACTION = 0.25
+
+
+class SpendMatrix:
+    """Spend per reporting category per month as a categories x months NumPy array.
+
+    Columns are the SPEND_TREND_LOOKBACK_MONTHS months before `month` followed by `month`
+    itself. Built from MonthlyRollup in one query; `version` is the MATRIX_VERSION token read
+    before that query, or the token of the write last applied with apply().
+    """
+
+    def __init__(self, month, version=''):
+        self.month = month
+        self.version = version
+        last = month.year * 12 + month.month - 1
+        self.months = [
+            (index // 12, index % 12 + 1) for index in range(last - SPEND_TREND_LOOKBACK_MONTHS, last + 1)
+        ]
+        first_year, first_month = self.months[0]
+        rows = list(
+            rollups_between(first_year, first_month, month.year, month.month)
+            .filter(kind=MonthlyRollup.KIND_SPEND)
+            .values('year', 'month', 'reporting_category_id')
+            .annotate(total=net_total() * -1)
+            .order_by()
+        )
+        self.category_ids = sorted({row['reporting_category_id'] for row in rows}, key=lambda pk: pk or 0)
+        self.names = dict(
+            Category.objects.filter(pk__in=[pk for pk in self.category_ids if pk]).values_list('id', 'name')
+        )
+        self.values = np.zeros((len(self.category_ids), len(self.months)))
+        self.column = {key: i for i, key in enumerate(self.months)}
+        self.row_of = {pk: i for i, pk in enumerate(self.category_ids)}
+        for row in rows:
+            self.values[self.row_of[row['reporting_category_id']], self.column[(row['year'], row['month'])]] = float(row['total'])
+
+    def apply(self, state, sign):
+        """Add (sign=1) or remove (sign=-1) one transaction state (see rollups.rollup_state).
+        Returns False when the state's category has no row yet and the matrix must be rebuilt."""
+        year, month, category_id, _, kind = rollup_key(state)
+        if kind != MonthlyRollup.KIND_SPEND or (year, month) not in self.column:
+            return True
+        if category_id not in self.row_of:
+            return False
+        spend = -float(state['amount'] or 0) - float(state['reimbursement'] or 0)
+        self.values[self.row_of[category_id], self.column[(year, month)]] += sign * spend
+        return True
+
+    def anomalies(self, today):
+        """Categories whose month-to-date pace is well above their trailing average,
+        largest z-score first."""
+        trailing, current = self.values[:, :-1], self.values[:, -1]
+        # Months before any spend was recorded would read as zero spend and drag the baseline down.
+        recorded = np.flatnonzero(trailing.sum(axis=0) > 0)
+        if not len(recorded):
+            return []
+        trailing = trailing[:, recorded[0]:]
+        mean = trailing.mean(axis=1)
+        std = trailing.std(axis=1)
+        fraction = today.day / calendar.monthrange(today.year, today.month)[1]
+        pace = current / max(fraction, MIN_MONTH_FRACTION)
+        z_scores = np.divide(pace - mean, std, out=np.zeros_like(mean), where=std > 0)
+        increase = np.divide(pace - mean, mean, out=np.zeros_like(mean), where=mean > 0)
+        flagged = np.flatnonzero((z_scores >= ANOMALY_Z_SCORE) & (increase >= ANOMALY_MIN_INCREASE))
+        flagged = flagged[np.argsort(-z_scores[flagged], kind='stable')]
+        return [
+            {
+                'category_id': self.category_ids[i],
+                'name': self.names.get(self.category_ids[i]) or 'Uncategorized',
+                'spent': float(current[i]),
+                'pace': float(pace[i]),
+                'average': float(mean[i]),
+                'percent_above': round(float(increase[i]) * 100),
+                'z_score': round(float(z_scores[i]), 1),
+            }
+            for i in flagged
+        ]
+
+
+def spend_matrix(today=None):
+    """The cached SpendMatrix for the current month, rebuilt when missing, a month old or
+    built against an older MATRIX_VERSION."""
+    month = (today or date.today()).replace(day=1)
+    # Read the version before the rollups, so a write landing in between leaves the matrix
+    # tagged with the older version and it is rebuilt again on the next read.
+    version = current_version(MATRIX_VERSION)
+    matrix = cache.get(MATRIX_CACHE_KEY)
+    if matrix is None or matrix.month != month or matrix.version != version:
+        matrix = SpendMatrix(month, version)
+        cache.set(MATRIX_CACHE_KEY, matrix, None)
+    return matrix
+
+
+def spending_anomalies(today=None):
+    today = today or date.today()
+    return spend_matrix(today).anomalies(today)
+
+
+def invalidate_spend_matrix():
+    """Mark every process's cached matrix stale. Call inside the write's transaction."""
+    bump_version(MATRIX_VERSION)
+
+
+def transaction_changed(previous, current):
+    """Bump MATRIX_VERSION for one transaction write. If this process's cached matrix is the
+    one the bump replaced, move the write's spend from its previous state to its current one
+    and keep it under the new version instead of rebuilding. Either side may be None."""
+    replaced, version = bump_version(MATRIX_VERSION)
+    matrix = cache.get(MATRIX_CACHE_KEY)
+    if matrix is None or matrix.version != replaced:
+        return
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is not None and not matrix.apply(state, sign):
+            return
+    matrix.version = version
+    cache.set(MATRIX_CACHE_KEY, matrix, None)
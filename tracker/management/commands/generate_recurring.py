@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tracker.recurring import generate_due_transactions
+
+
+class Command(BaseCommand):
+    help = "Create transactions for every recurring transaction occurrence that has fallen due."
+
+    def handle(self, *args, **options):
+        created = generate_due_transactions()
+        self.stdout.write(self.style.SUCCESS(f"Generated {created} recurring transactions."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tracker.insights import invalidate_spend_matrix
+from tracker.range_ledger import invalidate_daily_ledger, rebuild_daily_rollups
+from tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the MonthlyRollup and DailyRollup tables from scratch using the raw Transaction ledger."
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups()
+        invalidate_spend_matrix()
+        daily = rebuild_daily_rollups()
+        invalidate_daily_ledger()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt monthly rollups: {written} rows; daily rollups: {daily} rows."))
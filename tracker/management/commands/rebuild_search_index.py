@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tracker.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the transaction full-text search index and its triggers. migrate repairs "
+        "missing triggers itself; use this to rebuild the index contents by hand."
+    )
+
+    def handle(self, *args, **options):
+        if install_search_index():
+            self.stdout.write(self.style.SUCCESS("Rebuilt the transaction search index."))
+        else:
+            self.stdout.write(self.style.WARNING("Full-text search is not available on this database; searches use LIKE."))
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0017_source_open_close_dates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date'], name='tracker_tra_date_a467f2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['source', 'date'], name='tracker_tra_source__f62f54_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'date'], name='tracker_tra_categor_f5e906_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['description', 'date'], name='tracker_tra_descrip_20f5ca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['recurring_source', 'date'], name='tracker_tra_recurri_d18ac6_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, DecimalField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+
+
+def populate_rollups(apps, schema_editor):
+    Transaction = apps.get_model('tracker', 'Transaction')
+    MonthlyRollup = apps.get_model('tracker', 'MonthlyRollup')
+    credit_q = (
+        Q(category__name__istartswith='card-cash-') |
+        Q(category__name__istartswith='miles-credit-') |
+        Q(category__name__istartswith='credit-')
+    )
+    income_q = Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
+    buckets = (
+        Transaction.objects.annotate(
+            rollup_year=ExtractYear('date'),
+            rollup_month=ExtractMonth('date'),
+            rollup_reporting_category_id=Coalesce('category__reporting_category_id', 'category_id'),
+            rollup_kind=Case(
+                When(credit_q, then=Value('credit')),
+                When(income_q, then=Value('income')),
+                default=Value('spend'),
+                output_field=CharField(),
+            ),
+        )
+        .values('rollup_year', 'rollup_month', 'rollup_reporting_category_id', 'source_id', 'rollup_kind')
+        .annotate(
+            total_amount=Sum('amount'),
+            total_reimbursement=Sum(Coalesce('reimbursement', Value(0, output_field=DecimalField()))),
+            total_count=Count('id'),
+        )
+        .order_by()
+    )
+    MonthlyRollup.objects.bulk_create([
+        MonthlyRollup(
+            year=entry['rollup_year'],
+            month=entry['rollup_month'],
+            reporting_category_id=entry['rollup_reporting_category_id'],
+            source_id=entry['source_id'],
+            kind=entry['rollup_kind'],
+            amount=entry['total_amount'] or 0,
+            reimbursement=entry['total_reimbursement'] or 0,
+            row_count=entry['total_count'],
+        )
+        for entry in buckets
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0018_transaction_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('kind', models.CharField(choices=[('income', 'Income'), ('spend', 'Spend'), ('credit', 'Credit')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('reimbursement', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('row_count', models.IntegerField(default=0)),
+                ('reporting_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tracker.category')),
+                ('source', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tracker.source')),
+            ],
+            options={
+                'ordering': ['year', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('year', 'month', 'reporting_category', 'source', 'kind'), name='unique_monthly_rollup_bucket')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0019_monthlyrollup'),
+    ]
+
+    # ArrayField only exists on PostgreSQL and has no cast to JSON, so the cached
+    # series is dropped and re-created empty; months are recomputed on next view.
+    operations = [
+        migrations.RemoveField(
+            model_name='month',
+            name='daily_spend',
+        ),
+        migrations.AddField(
+            model_name='month',
+            name='daily_spend',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
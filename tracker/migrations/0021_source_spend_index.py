@@ -0,0 +1,78 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:10
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.db.models.functions import Abs
+
+
+def populate_spend_index(apps, schema_editor):
+    Transaction = apps.get_model('tracker', 'Transaction')
+    Source = apps.get_model('tracker', 'Source')
+    SourceSpendIndex = apps.get_model('tracker', 'SourceSpendIndex')
+    # Qualifying spend per (source, date): card spend outside income, credit and rent
+    # categories, each transaction counted by its absolute amount.
+    daily = (
+        Transaction.objects.filter(source__isnull=False)
+        .exclude(Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income'))
+        .exclude(
+            Q(category__name__istartswith='card-cash-') |
+            Q(category__name__istartswith='miles-credit-') |
+            Q(category__name__istartswith='credit-')
+        )
+        .exclude(Q(category__name__icontains='rent') | Q(category__reporting_category__name__icontains='rent'))
+        .values('source_id', 'date')
+        .annotate(total=Sum(Abs('amount')))
+        .order_by('source_id', 'date')
+    )
+    running = defaultdict(Decimal)
+    rows = []
+    for entry in daily:
+        spend = entry['total'] or Decimal('0')
+        if spend <= 0:
+            continue
+        running[entry['source_id']] += spend
+        rows.append(SourceSpendIndex(
+            source_id=entry['source_id'], date=entry['date'], spend=spend,
+            cumulative_spend=running[entry['source_id']],
+        ))
+    SourceSpendIndex.objects.bulk_create(rows, batch_size=1000)
+
+    # Award dates used to be filled in lazily by the rewards page; derive them all now.
+    for source in Source.objects.filter(signup_bonus_miles__gt=0, signup_bonus_min_spend__gt=0):
+        source.signup_bonus_awarded_on = (
+            SourceSpendIndex.objects.filter(source=source, cumulative_spend__gte=source.signup_bonus_min_spend)
+            .order_by('cumulative_spend', 'date')
+            .values_list('date', flat=True)
+            .first()
+        )
+        source.save(update_fields=['signup_bonus_awarded_on'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0020_month_daily_spend_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceSpendIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('spend', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('cumulative_spend', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tracker.source')),
+            ],
+            options={
+                'ordering': ['source', 'date'],
+                'indexes': [models.Index(fields=['source', 'cumulative_spend'], name='tracker_sou_source__b5c535_idx')],
+                'constraints': [models.UniqueConstraint(fields=('source', 'date'), name='unique_source_spend_day')],
+            },
+        ),
+        migrations.RunPython(populate_spend_index, migrations.RunPython.noop),
+    ]
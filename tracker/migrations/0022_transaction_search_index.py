@@ -0,0 +1,74 @@
+from django.db import migrations
+
+FTS_TABLE = 'tracker_transaction_fts'
+
+SQLITE_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        description, notes, tags,
+        content='tracker_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON tracker_transaction BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, notes, tags)
+        VALUES (new.id, new.description, new.notes, new.tags);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON tracker_transaction BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes, tags)
+        VALUES ('delete', old.id, old.description, old.notes, old.tags);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF description, notes, tags ON tracker_transaction BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes, tags)
+        VALUES ('delete', old.id, old.description, old.notes, old.tags);
+        INSERT INTO {FTS_TABLE}(rowid, description, notes, tags)
+        VALUES (new.id, new.description, new.notes, new.tags);
+    END""",
+]
+
+SQLITE_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+PG_INDEX = (
+    "CREATE INDEX IF NOT EXISTS tracker_transaction_search_idx ON tracker_transaction USING GIN (("
+    "to_tsvector('simple', coalesce(tracker_transaction.description, '') || ' ' || "
+    "coalesce(tracker_transaction.notes, '') || ' ' || coalesce(tracker_transaction.tags, ''))))"
+)
+
+
+def install(apps, schema_editor):
+    conn = schema_editor.connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            try:
+                for statement in SQLITE_TEARDOWN + SQLITE_SCHEMA:
+                    cursor.execute(statement)
+            except Exception:
+                # SQLite built without FTS5: searches fall back to LIKE.
+                return
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(PG_INDEX)
+
+
+def remove(apps, schema_editor):
+    conn = schema_editor.connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for statement in SQLITE_TEARDOWN:
+                cursor.execute(statement)
+        elif conn.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS tracker_transaction_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0021_source_spend_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, remove),
+    ]
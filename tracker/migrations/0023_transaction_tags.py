@@ -0,0 +1,78 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:45
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def parse_tags(text):
+    """Distinct tags of a comma-separated tags string, lowercased, trimmed, without a leading
+    '#' and with inner whitespace collapsed, in their original order."""
+    tags = []
+    for part in (text or '').split(','):
+        name = WHITESPACE_RE.sub(' ', part.strip().lstrip('#').strip().lower())[:100]
+        if name and name not in tags:
+            tags.append(name)
+    return tags
+
+
+def populate_tags(apps, schema_editor):
+    Transaction = apps.get_model('tracker', 'Transaction')
+    Tag = apps.get_model('tracker', 'Tag')
+    TransactionTag = apps.get_model('tracker', 'TransactionTag')
+    links = [
+        (transaction_id, name, txn_date)
+        for transaction_id, text, txn_date in Transaction.objects.exclude(tags='').values_list('id', 'tags', 'date').iterator()
+        for name in parse_tags(text)
+    ]
+    counts = Counter(name for _, name, _ in links)
+    Tag.objects.bulk_create([Tag(name=name, transaction_count=count) for name, count in sorted(counts.items())], batch_size=1000)
+    ids = dict(Tag.objects.values_list('name', 'id'))
+    TransactionTag.objects.bulk_create([
+        TransactionTag(transaction_id=transaction_id, tag_id=ids[name], date=txn_date)
+        for transaction_id, name, txn_date in links
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0022_transaction_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transaction_links', to='tracker.tag')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='tracker.transaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transactiontag',
+            index=models.Index(fields=['tag', 'date'], name='tracker_tra_tag_id_afdea0_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='transactiontag',
+            constraint=models.UniqueConstraint(fields=('transaction', 'tag'), name='unique_transaction_tag'),
+        ),
+        migrations.RunPython(populate_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-17 08:10
+
+import calendar
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def add_months(d, months):
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    day = min(d.day, calendar.monthrange(year, month)[1])
+    return d.replace(year=year, month=month, day=day)
+
+
+def next_occurrence(rule):
+    """The rule's next occurrence after last_generated, or its first one: start_date moved
+    forward to day_of_week for weekly rules, or to day_of_month (clamped to the month's
+    length) for monthly and yearly ones."""
+    if rule.frequency == 'weekly':
+        if rule.last_generated:
+            return rule.last_generated + timedelta(weeks=rule.interval)
+        next_date = rule.start_date
+        if rule.day_of_week is not None:
+            next_date += timedelta(days=(rule.day_of_week - next_date.weekday()) % 7)
+        return next_date
+
+    if rule.frequency in ('monthly', 'yearly'):
+        next_date = rule.start_date
+        if rule.last_generated:
+            months = rule.interval * (12 if rule.frequency == 'yearly' else 1)
+            next_date = add_months(rule.last_generated, months)
+        day = min(rule.day_of_month, calendar.monthrange(next_date.year, next_date.month)[1])
+        return next_date.replace(day=day)
+
+    return None
+
+
+def populate_next_due(apps, schema_editor):
+    RecurringTransaction = apps.get_model('tracker', 'RecurringTransaction')
+    rules = list(RecurringTransaction.objects.all())
+    for rule in rules:
+        next_date = next_occurrence(rule)
+        # Past end_date a rule has nothing left to schedule.
+        rule.next_due = None if next_date and rule.end_date and next_date > rule.end_date else next_date
+    RecurringTransaction.objects.bulk_update(rules, ['next_due'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0023_transaction_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringtransaction',
+            name='next_due',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='recurringtransaction',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['next_due'], name='recurring_active_next_due'),
+        ),
+        migrations.RunPython(populate_next_due, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, CharField, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def populate_daily_rollups(apps, schema_editor):
+    Transaction = apps.get_model('tracker', 'Transaction')
+    DailyRollup = apps.get_model('tracker', 'DailyRollup')
+    credit_q = (
+        Q(category__name__istartswith='card-cash-') |
+        Q(category__name__istartswith='miles-credit-') |
+        Q(category__name__istartswith='credit-')
+    )
+    income_q = Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
+    daily = (
+        Transaction.objects.annotate(
+            rollup_reporting_category_id=Coalesce('category__reporting_category_id', 'category_id'),
+            rollup_kind=Case(
+                When(credit_q, then=Value('credit')),
+                When(income_q, then=Value('income')),
+                default=Value('spend'),
+                output_field=CharField(),
+            ),
+        )
+        .values('date', 'rollup_reporting_category_id', 'rollup_kind')
+        .annotate(total=Sum(F('amount') + Coalesce('reimbursement', Value(0, output_field=DecimalField()))))
+        .order_by()
+    )
+    DailyRollup.objects.bulk_create([
+        DailyRollup(
+            date=entry['date'], reporting_category_id=entry['rollup_reporting_category_id'],
+            kind=entry['rollup_kind'], amount=entry['total'] or 0,
+        )
+        for entry in daily
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0025_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('income', 'Income'), ('spend', 'Spend'), ('credit', 'Credit')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('reporting_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tracker.category')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'reporting_category', 'kind'), name='unique_daily_rollup_bucket')],
+            },
+        ),
+        migrations.RunPython(populate_daily_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,131 @@
+from bisect import bisect_right
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Sum
+
+from .models import Category, Transaction
+from .reward_rates import comparison_value, is_active, reward_rate_matrix
+from .rollups import CREDIT_CATEGORY_Q, INCOME_CATEGORY_Q
+
+
+def _activity_breaks(sources):
+    """Sorted dates on which some card opens or closes; cards are equally active between them."""
+    breaks = set()
+    for source in sources:
+        if source.opened_on:
+            breaks.add(source.opened_on)
+        if source.closed_on:
+            breaks.add(source.closed_on + timedelta(days=1))
+    return sorted(breaks)
+
+
+def missed_rewards(start, end):
+    """Rewards lost to using a worse card, for spend dated in [start, end).
+
+    Applies the get_better_card_tip rules to history: each purchase is compared against the
+    best card that was open on its date, with that quarter's reward categories and CPP
+    conversion. Spend is grouped to one cell per (card, category, day) by a single query;
+    the best and used comparison values are looked up once per distinct (category,
+    quarter, open-cards period) and (category, quarter, card), then gathered, multiplied
+    and summed per card and per category with NumPy. Income and credit categories and
+    uncategorised or card-less rows are left out. Values are in dollars.
+    """
+    matrix = reward_rate_matrix()
+    rows = (
+        Transaction.objects.filter(
+            date__gte=start, date__lt=end, category__isnull=False, source__isnull=False,
+        )
+        .exclude(INCOME_CATEGORY_Q | CREDIT_CATEGORY_Q)
+        .values_list('source_id', 'category_id', 'date')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    source_ids, category_ids, days, amounts = [], [], [], []
+    for source_id, category_id, day, total in rows:
+        source_ids.append(source_id)
+        category_ids.append(category_id)
+        days.append(day)
+        amounts.append(total)
+
+    if not days:
+        return {'by_card': [], 'by_category': [], 'total_spend': 0.0, 'total_missed': 0.0}
+
+    # Spend is stored negative; refunds on the same card, category and day net out.
+    spend = np.maximum(-np.array(amounts, dtype=float), 0.0)
+    sources = np.array(source_ids)
+    categories = np.array(category_ids)
+    quarters = np.array([day.year * 4 + (day.month - 1) // 3 for day in days])
+    breaks = _activity_breaks(matrix.sources.values())
+    periods = np.array([bisect_right(breaks, day) for day in days])
+
+    def label(quarter):
+        return f"{quarter // 4}Q{quarter % 4 + 1}"
+
+    # Best card open in each (category, quarter, period).
+    best_keys, best_inverse = np.unique(np.stack([categories, quarters, periods], axis=1), axis=0, return_inverse=True)
+    best_value = np.zeros(len(best_keys))
+    best_source = np.zeros(len(best_keys), dtype=np.int64)
+    for i, (category_id, quarter, period) in enumerate(best_keys):
+        on_date = breaks[period - 1] if period else date.min
+        _, ranking = matrix.rates(int(category_id), label(quarter))
+        best = next((entry for entry in ranking if is_active(entry[0], on_date)), None)
+        if best:
+            best_source[i], best_value[i] = best[0].id, float(best[2])
+
+    # Comparison value of the card actually used in each (category, quarter, card).
+    used_keys, used_inverse = np.unique(np.stack([categories, quarters, sources], axis=1), axis=0, return_inverse=True)
+    used_value = np.zeros(len(used_keys))
+    for i, (category_id, quarter, source_id) in enumerate(used_keys):
+        source = matrix.sources.get(int(source_id))
+        if source is not None:
+            multipliers, _ = matrix.rates(int(category_id), label(quarter))
+            used_value[i] = float(comparison_value(source, multipliers[source.id]))
+
+    best_inverse = best_inverse.reshape(-1)
+    used_inverse = used_inverse.reshape(-1)
+    gap = np.maximum(best_value[best_inverse] - used_value[used_inverse], 0.0)
+    missed = gap * spend
+    better = np.where(gap > 0, best_source[best_inverse], 0)
+
+    source_index, source_pos = np.unique(sources, return_inverse=True)
+    category_index, category_pos = np.unique(categories, return_inverse=True)
+    card_spend = np.bincount(source_pos, weights=spend, minlength=len(source_index))
+    card_missed = np.bincount(source_pos, weights=missed, minlength=len(source_index))
+    card_earned = np.bincount(source_pos, weights=used_value[used_inverse] * spend, minlength=len(source_index))
+    category_spend = np.bincount(category_pos, weights=spend, minlength=len(category_index))
+    category_missed = np.bincount(category_pos, weights=missed, minlength=len(category_index))
+
+    # The card that would have recovered the most of each category's missed value.
+    better_index, better_pos = np.unique(better, return_inverse=True)
+    recovered = np.zeros((len(category_index), len(better_index)))
+    np.add.at(recovered, (category_pos, better_pos.reshape(-1)), missed)
+    top_better = better_index[recovered.argmax(axis=1)]
+
+    names = dict(Category.objects.filter(pk__in=category_index.tolist()).values_list('id', 'name'))
+    by_card = [
+        {
+            'source': matrix.sources.get(int(source_id)),
+            'spend': float(card_spend[i]),
+            'earned': float(card_earned[i]),
+            'missed': float(card_missed[i]),
+        }
+        for i, source_id in enumerate(source_index)
+    ]
+    by_category = [
+        {
+            'category_name': names.get(int(category_id), ''),
+            'spend': float(category_spend[i]),
+            'missed': float(category_missed[i]),
+            'better_source': matrix.sources.get(int(top_better[i])) if category_missed[i] > 0 else None,
+        }
+        for i, category_id in enumerate(category_index)
+    ]
+    by_card.sort(key=lambda row: (-row['missed'], row['source'].name if row['source'] else ''))
+    by_category.sort(key=lambda row: (-row['missed'], row['category_name']))
+    return {
+        'by_card': by_card,
+        'by_category': by_category,
+        'total_spend': float(spend.sum()),
+        'total_missed': float(missed.sum()),
+    }
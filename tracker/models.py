@@ -1,5 +1,4 @@
-from django.db import models
-from django.contrib.postgres.fields import ArrayField
+from django.db import models, transaction as db_transaction
 
 # Create your models here.
 class Category(models.Model):
@@ -20,6 +19,11 @@ class Category(models.Model):
         """
         ordering = ['name']
 
+    def save(self, *args, **kwargs):
+        # Renames and reporting_category changes re-bucket monthly rollups from the save signals.
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
+
 class Source(models.Model):
     name = models.CharField(max_length=100, unique=True)
     annual_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -78,9 +82,17 @@ class RecurringTransaction(models.Model):
     end_date = models.DateField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     last_generated = models.DateField(null=True, blank=True)
+    # Next occurrence date, None once the rule has ended; kept in step by tracker/signals.py
+    # and generate_due_transactions() so upcoming items are one index range scan.
+    next_due = models.DateField(null=True, blank=True)
 
     class Meta:
         ordering = ['description']
+        indexes = [
+            # Partial index: the ORM writes is_active=True as a bare column test on SQLite,
+            # which a leading is_active column could not seek on.
+            models.Index(fields=['next_due'], condition=models.Q(is_active=True), name='recurring_active_next_due'),
+        ]
 
     def get_frequency_display_with_interval(self):
         if self.interval == 1:
@@ -101,6 +113,7 @@ class Transaction(models.Model):
     source = models.ForeignKey(Source, on_delete=models.SET_NULL, default=None, blank=True, null=True)
     recurring_source = models.ForeignKey(RecurringTransaction, on_delete=models.SET_NULL, null=True, blank=True)
     notes = models.TextField(blank=True, default='')
+    # Comma-separated tags as entered; the normalised copy lives in TransactionTag (tracker/tags.py).
     tags = models.CharField(max_length=500, blank=True, default='')
 
     def __str__(self):
@@ -108,12 +121,27 @@ class Transaction(models.Model):
         String for representing the Transaction object (in admin site etc.)
         """
         return f"{self.date} - {self.description} - ${self.amount}"
+
+    def save(self, *args, **kwargs):
+        # Derived tables (see tracker/signals.py) are updated from the save signals;
+        # keep them in the same database transaction as the row itself.
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
     
     class Meta:
         """
-        Meta class to define ordering for the Transaction model.
+        Meta class to define ordering and indexes for the Transaction model.
+        Indexes lead with the column each report filters on and end with date,
+        so month/year range predicates can be answered from the index.
         """
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['date']),
+            models.Index(fields=['source', 'date']),
+            models.Index(fields=['category', 'date']),
+            models.Index(fields=['description', 'date']),
+            models.Index(fields=['recurring_source', 'date']),
+        ]
 
 class DismissedSuggestion(models.Model):
     description = models.CharField(max_length=200, unique=True)
@@ -155,11 +183,12 @@ class GoalContribution(models.Model):
 class Month(models.Model):
     """
     Model representing a month for budget tracking.
+    Caches the month's daily cumulative spend and totals; see tracker/month_cache.py.
     """
     name = models.CharField(max_length=50, unique=True)
     total_spend = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     total_income = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
-    daily_spend = ArrayField(models.DecimalField(max_digits=10, decimal_places=2, default=0.00), blank=True, default=list) # List of len 31
+    daily_spend = models.JSONField(blank=True, default=list) # Cumulative spend per day, list of len 31
 
     def __str__(self):
         """
@@ -173,3 +202,135 @@ class Month(models.Model):
         This will ensure that months are ordered by name in ascending order.
         """
         ordering = ['name']
+
+
+class MonthlyRollup(models.Model):
+    """
+    Pre-aggregated Transaction totals for one month, keyed by reporting category,
+    source and kind. Kept in step with Transaction and Category writes by
+    tracker/rollups.py so reports can read one row per bucket instead of
+    re-summing the ledger.
+    """
+    KIND_INCOME = 'income'
+    KIND_SPEND = 'spend'
+    KIND_CREDIT = 'credit'
+    KIND_CHOICES = [
+        (KIND_INCOME, 'Income'),
+        (KIND_SPEND, 'Spend'),
+        (KIND_CREDIT, 'Credit'),
+    ]
+
+    year = models.PositiveIntegerField()
+    month = models.PositiveSmallIntegerField()
+    reporting_category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    source = models.ForeignKey(Source, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    reimbursement = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['year', 'month']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['year', 'month', 'reporting_category', 'source', 'kind'],
+                name='unique_monthly_rollup_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02d} {self.kind} - ${self.amount}"
+
+
+class DailyRollup(models.Model):
+    """
+    Net Transaction totals (amount + reimbursement) for one day, keyed by reporting category
+    and kind. Kept in step with Transaction and Category writes by tracker/range_ledger.py,
+    whose date-range prefix sums are built from these rows instead of grouping the ledger.
+    """
+    date = models.DateField()
+    reporting_category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=10, choices=MonthlyRollup.KIND_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'reporting_category', 'kind'], name='unique_daily_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.kind} - ${self.amount}"
+
+
+class SourceSpendIndex(models.Model):
+    """
+    Running total of signup-bonus-qualifying spend per source, one row per day with spend.
+    cumulative_spend never decreases with date, so the first day a threshold was reached is
+    a single seek on the (source, cumulative_spend) index. Maintained by tracker/spend_index.py.
+    """
+    source = models.ForeignKey(Source, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    spend = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    cumulative_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+
+    class Meta:
+        ordering = ['source', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'date'], name='unique_source_spend_day'),
+        ]
+        indexes = [
+            models.Index(fields=['source', 'cumulative_spend']),
+        ]
+
+    def __str__(self):
+        return f"{self.source_id} {self.date} - ${self.cumulative_spend}"
+
+
+class Tag(models.Model):
+    """
+    A normalised transaction tag. transaction_count is kept current by tracker/tags.py
+    so tag facets are read from this table rather than counted from the ledger.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    transaction_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class TransactionTag(models.Model):
+    """
+    One tag on one transaction. date copies the transaction's date so a tag's rows for a
+    month range are a seek on the (tag, date) index.
+    """
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='transaction_links')
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['transaction', 'tag'], name='unique_transaction_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} {self.tag_id}"
+
+
+class CacheVersion(models.Model):
+    """
+    A token naming the current state of the data behind a cached result. It is replaced in
+    the same database transaction as each write to that data, so every process sees the
+    change once it commits and a rollback undoes it; see tracker/cache_versions.py.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.name} {self.version}"
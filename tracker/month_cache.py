@@ -0,0 +1,64 @@
+
+from django.db.models import Sum, F, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+from .models import Transaction, Month, MonthlyRollup
+from .rollups import CREDIT_CATEGORY_Q, INCOME_CATEGORY_Q, month_date_range, rollups_between, net_total
+
+DAYS_PER_SERIES = 31
+
+
+def month_cache_name(year, month):
+    return f"{year}-{month:02d}"
+
+
+def compute_daily_spend(year, month):
+    """31-element cumulative spend series for the month, from one GROUP BY date."""
+    start, end = month_date_range(year, month)
+    daily_totals = (
+        Transaction.objects.filter(date__gte=start, date__lt=end)
+        .exclude(INCOME_CATEGORY_Q)
+        .exclude(CREDIT_CATEGORY_Q)
+        .values('date')
+        .annotate(daily_total=Sum(F('amount') + Coalesce('reimbursement', Value(0, output_field=DecimalField()))))
+        .order_by('date')
+    )
+    by_day = {item['date'].day: float(item['daily_total']) * -1 for item in daily_totals}
+
+    series = []
+    cumulative = 0.0
+    for day in range(1, DAYS_PER_SERIES + 1):
+        cumulative += by_day.get(day, 0.0)
+        series.append(round(cumulative, 2))
+    return series
+
+
+def get_month_summary(year, month):
+    """Return the cached Month row for (year, month), computing and storing it on a miss.
+    Rows are deleted by invalidate_months() whenever a transaction in the month changes.
+    """
+    name = month_cache_name(year, month)
+    month_data = Month.objects.filter(name=name).first()
+    if month_data and len(month_data.daily_spend) == DAYS_PER_SERIES:
+        return month_data
+
+    daily_spend = compute_daily_spend(year, month)
+    income = rollups_between(year, month, year, month).filter(
+        kind=MonthlyRollup.KIND_INCOME
+    ).aggregate(total=net_total())['total']
+    month_data, _ = Month.objects.update_or_create(
+        name=name,
+        defaults={
+            'daily_spend': daily_spend,
+            'total_spend': daily_spend[-1],
+            'total_income': income,
+        },
+    )
+    return month_data
+
+
+def invalidate_months(months):
+    """Drop cached Month rows for the given (year, month) pairs."""
+    names = [month_cache_name(year, month) for year, month in set(months)]
+    if names:
+        Month.objects.filter(name__in=names).delete()
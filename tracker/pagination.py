@@ -0,0 +1,75 @@
+from datetime import date
+
+from django.db.models import Q
+
+PER_PAGE = 25
+
+
+def encode_cursor(row):
+    """URL cursor for a transaction row: its date and id, e.g. '2026-10-05.1234'."""
+    return f"{row.date.isoformat()}.{row.pk}"
+
+
+def decode_cursor(value):
+    """(date, id) from a cursor, or None if it is missing or malformed."""
+    try:
+        day, row_id = (value or '').split('.')
+        return date.fromisoformat(day), int(row_id)
+    except ValueError:
+        return None
+
+
+class KeysetPage:
+    """One page of a (date, id) descending keyset listing.
+
+    Iterates like a Paginator page; has_next/has_previous and the matching cursors
+    describe the neighbouring pages.
+    """
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next and self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous and self.object_list else None
+
+
+def keyset_page(queryset, after=None, before=None, per_page=PER_PAGE):
+    """The page of `queryset`, newest first by (date, id), that follows cursor `after` or
+    precedes cursor `before` (the first page when neither is given).
+
+    Each page is one seek on a date index for per_page + 1 rows, the extra row only
+    telling whether there is another page, so a deep page costs the same as the first.
+    The cursor is applied as date <= d AND (date < d OR id < i) rather than a bare OR so
+    SQLite can bound the index range; indexes end in the rowid, which orders ties by id.
+    No total count is taken.
+    """
+    after = decode_cursor(after)
+    before = None if after else decode_cursor(before)
+
+    if before:
+        day, row_id = before
+        rows = list(
+            queryset.filter(Q(date__gte=day), Q(date__gt=day) | Q(id__gt=row_id))
+            .order_by('date', 'id')[:per_page + 1]
+        )
+        has_previous = len(rows) > per_page
+        return KeysetPage(rows[:per_page][::-1], has_next=True, has_previous=has_previous)
+
+    if after:
+        day, row_id = after
+        queryset = queryset.filter(Q(date__lte=day), Q(date__lt=day) | Q(id__lt=row_id))
+    rows = list(queryset.order_by('-date', '-id')[:per_page + 1])
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=after is not None)
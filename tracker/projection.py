@@ -0,0 +1,125 @@
+import calendar
+from collections import defaultdict
+from datetime import date
+
+from .models import Category, MonthlyRollup, RecurringTransaction
+from .recurring import add_months, expand_occurrences
+from .rollups import SPEND_TREND_LOOKBACK_MONTHS, classify_category, month_date_range, net_total, rollups_between
+
+
+def _reporting_id(rule):
+    if rule.category is None:
+        return None
+    return rule.category.reporting_category_id or rule.category_id
+
+
+def _is_spend_rule(rule):
+    if rule.category is None:
+        return True
+    reporting = rule.category.reporting_category
+    return classify_category(rule.category.name, reporting.name if reporting else None) == MonthlyRollup.KIND_SPEND
+
+
+def _recurring_spend(rules, start, end, pending_only=False, months=None):
+    """Spend (positive) from the rules' occurrences in [start, end), per reporting category,
+    optionally counting only occurrences in the given (year, month) buckets."""
+    by_id = {rule.id: rule for rule in rules}
+    totals = defaultdict(float)
+    occurrences = expand_occurrences(rules, start, end, pending_only=pending_only)
+    for rule_id, day, amount in occurrences.tolist():
+        if months is None or (day.year, day.month) in months:
+            totals[_reporting_id(by_id[rule_id])] -= amount
+    return totals
+
+
+def projected_month_spend(today=None):
+    """Projected month-end spend for the current month, per reporting category and in total.
+
+    projected = spent so far + recurring occurrences this month not yet generated
+                + discretionary daily run-rate * days left.
+    Spent so far and the run-rate history come from MonthlyRollup. The run-rate is the spend
+    of the SPEND_TREND_LOOKBACK_MONTHS previous months that have any spend, less what the
+    active recurring rules scheduled in those months, spread over their days. Recurring
+    amounts come from expand_occurrences(), so no transactions are read.
+    """
+    today = today or date.today()
+    year, month = today.year, today.month
+    days_in_month = calendar.monthrange(year, month)[1]
+    days_left = days_in_month - today.day
+    _, month_end = month_date_range(year, month)
+    first_month = add_months(date(year, month, 1), -SPEND_TREND_LOOKBACK_MONTHS)
+
+    spend_by_month = defaultdict(dict)  # (year, month) -> {reporting_category_id: spend}
+    for row in (
+        rollups_between(first_month.year, first_month.month, year, month)
+        .filter(kind=MonthlyRollup.KIND_SPEND)
+        .values('year', 'month', 'reporting_category_id')
+        .annotate(total=net_total() * -1)
+        .order_by()
+    ):
+        spend_by_month[(row['year'], row['month'])][row['reporting_category_id']] = float(row['total'])
+    spent = spend_by_month.pop((year, month), {})
+
+    rules = [
+        rule for rule in RecurringTransaction.objects.filter(is_active=True)
+        .select_related('category__reporting_category')
+        if _is_spend_rule(rule)
+    ]
+    # Pending occurrences come from each rule's next occurrence on, so one due today or
+    # earlier this month that has not been generated yet is still counted.
+    upcoming = _recurring_spend(rules, date(year, month, 1), month_end, pending_only=True)
+
+    history_months = [key for key, totals in spend_by_month.items() if sum(totals.values()) > 0]
+    discretionary = defaultdict(float)
+    history_days = 0
+    if history_months:
+        history_start = date(*min(history_months), 1)
+        scheduled = _recurring_spend(rules, history_start, date(year, month, 1), months=set(history_months))
+        for key in history_months:
+            history_days += calendar.monthrange(*key)[1]
+            for category_id, total in spend_by_month[key].items():
+                discretionary[category_id] += total
+        for category_id, total in scheduled.items():
+            discretionary[category_id] -= total
+
+    budgets = {
+        category.id: (category.name, float(category.budget or 0))
+        for category in Category.objects.filter(reporting_category__isnull=True).exclude(name__iexact='income')
+    }
+    category_ids = set(spent) | set(upcoming) | set(discretionary)
+    names = dict(Category.objects.filter(pk__in=[key for key in category_ids if key]).values_list('id', 'name'))
+
+    rows = []
+    for category_id in set(budgets) | category_ids:
+        name, budget = budgets.get(category_id) or (names.get(category_id) or 'Uncategorized', 0.0)
+        run_rate = max(discretionary.get(category_id, 0.0), 0.0) / history_days if history_days else 0.0
+        row = {
+            'category_id': category_id,
+            'name': name,
+            'budget': budget,
+            'spent': spent.get(category_id, 0.0),
+            'recurring': upcoming.get(category_id, 0.0),
+            'discretionary': run_rate * days_left,
+        }
+        row['projected'] = row['spent'] + row['recurring'] + row['discretionary']
+        if row['budget'] or row['projected']:
+            rows.append(row)
+
+    for row in rows:
+        row['over_budget'] = row['projected'] > row['budget']
+        row['surplus'] = row['budget'] - row['projected']
+    rows.sort(key=lambda row: row['projected'], reverse=True)
+    total = {
+        key: sum(row[key] for row in rows)
+        for key in ('budget', 'spent', 'recurring', 'discretionary', 'projected')
+    }
+    total['over_budget'] = total['projected'] > total['budget']
+    total['surplus'] = total['budget'] - total['projected']
+    return {
+        'rows': rows,
+        'over_budget': [row for row in rows if row['over_budget']],
+        'total': total,
+        'month_label': f"{calendar.month_name[month]} {year}",
+        'days_left': days_left,
+        'history_months': len(history_months),
+    }
@@ -0,0 +1,238 @@
+import copy
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction as db_transaction
+from django.db.models import Case, CharField, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .cache_versions import bump_version, current_version
+from .models import Category, DailyRollup, MonthlyRollup, Transaction
+from .rollups import CREDIT_CATEGORY_Q, INCOME_CATEGORY_Q, classify_category, month_date_range, rollup_key
+
+# CacheVersion name of the DailyRollup table's state. Transaction and category writes and
+# the bulk paths bump it (see tracker/signals.py). A transaction write patches the writing
+# process's ledger with its delta; every other process sees the new version and rebuilds
+# on next use.
+LEDGER_VERSION = 'daily_ledger'
+
+ZERO = Decimal('0')
+
+
+def daily_key(state):
+    """(date, reporting category id, kind) bucket of a transaction state (see rollups.rollup_state)."""
+    _, _, reporting_category_id, _, kind = rollup_key(state)
+    return state['date'], reporting_category_id, kind
+
+
+def apply_daily_deltas(deltas):
+    """Add {(date, reporting_category_id, kind): net amount} deltas to the DailyRollup table."""
+    for (day, reporting_category_id, kind), delta in deltas.items():
+        if not delta:
+            continue
+        bucket = {'date': day, 'reporting_category_id': reporting_category_id, 'kind': kind}
+        if not DailyRollup.objects.filter(**bucket).update(amount=F('amount') + delta):
+            DailyRollup.objects.create(amount=delta, **bucket)
+
+
+def daily_deltas(transactions, deltas=None):
+    """Accumulate the net amounts of Transaction instances into {(date, reporting_category_id,
+    kind): delta}. Used for rows written with bulk_create, which skips the save signals."""
+    deltas = {} if deltas is None else deltas
+    categories = {
+        pk: (reporting_id or pk, classify_category(name, reporting_name))
+        for pk, name, reporting_id, reporting_name in Category.objects.filter(
+            pk__in={txn.category_id for txn in transactions if txn.category_id}
+        ).values_list('pk', 'name', 'reporting_category_id', 'reporting_category__name')
+    }
+    for txn in transactions:
+        reporting_category_id, kind = categories.get(txn.category_id, (None, MonthlyRollup.KIND_SPEND))
+        key = (txn.date, reporting_category_id, kind)
+        deltas[key] = deltas.get(key, ZERO) + Decimal(txn.amount) + Decimal(txn.reimbursement or 0)
+    return deltas
+
+
+def rebuild_daily_rollups(months=None):
+    """Recompute DailyRollup rows from raw transactions.
+    With months=None the whole table is rebuilt; otherwise only the given (year, month) pairs.
+    Returns the number of rows written.
+    """
+    with db_transaction.atomic():
+        if months is None:
+            DailyRollup.objects.all().delete()
+            transactions = Transaction.objects.all()
+        else:
+            if not months:
+                return 0
+            day_q = Q()
+            for year, month in set(months):
+                start, end = month_date_range(year, month)
+                day_q |= Q(date__gte=start, date__lt=end)
+            DailyRollup.objects.filter(day_q).delete()
+            transactions = Transaction.objects.filter(day_q)
+
+        rows = [
+            DailyRollup(
+                date=entry['date'], reporting_category_id=entry['rollup_reporting_category_id'],
+                kind=entry['rollup_kind'], amount=entry['total'] or 0,
+            )
+            for entry in transactions.annotate(
+                rollup_reporting_category_id=Coalesce('category__reporting_category_id', 'category_id'),
+                rollup_kind=Case(
+                    When(CREDIT_CATEGORY_Q, then=Value(MonthlyRollup.KIND_CREDIT)),
+                    When(INCOME_CATEGORY_Q, then=Value(MonthlyRollup.KIND_INCOME)),
+                    default=Value(MonthlyRollup.KIND_SPEND),
+                    output_field=CharField(),
+                ),
+            )
+            .values('date', 'rollup_reporting_category_id', 'rollup_kind')
+            .annotate(total=Sum(F('amount') + Coalesce('reimbursement', Value(0, output_field=DecimalField()))))
+            .order_by()
+        ]
+        DailyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+class DailyLedger:
+    """Prefix sums of net amount (amount + reimbursement) per day for each
+    (reporting category, kind) series, as a series x days NumPy array.
+
+    prefix[s, i] is the series' total over the first i days from `first_day`, so the total
+    over any date range is prefix[:, end] - prefix[:, start] for every series at once,
+    whatever the range's length. Built from the DailyRollup rows in one query; `version` is
+    the LEDGER_VERSION token read before it, or the token of the write last applied with
+    patched().
+    """
+
+    def __init__(self, today=None, version=''):
+        today = today or date.today()
+        self.version = version
+        rows = list(DailyRollup.objects.values_list('date', 'reporting_category_id', 'kind', 'amount').order_by())
+        self.first_day = min((row[0] for row in rows), default=today)
+        self.last_day = max(max((row[0] for row in rows), default=today), today)
+        days = (self.last_day - self.first_day).days + 1
+
+        self.series = sorted({(row[1], row[2]) for row in rows}, key=lambda key: (key[0] or 0, key[1]))
+        self.position = {key: i for i, key in enumerate(self.series)}
+        daily = np.zeros((len(self.series), days))
+        np.add.at(
+            daily,
+            ([self.position[(row[1], row[2])] for row in rows], [(row[0] - self.first_day).days for row in rows]),
+            [float(row[3]) for row in rows],
+        )
+        self.prefix = np.zeros((len(self.series), days + 1))
+        np.cumsum(daily, axis=1, out=self.prefix[:, 1:])
+
+    def _index(self, day):
+        return min(max((day - self.first_day).days, 0), self.prefix.shape[1] - 1)
+
+    def totals(self, start, end):
+        """{(reporting_category_id, kind): net total} over the half-open range [start, end)."""
+        values = self.prefix[:, self._index(end)] - self.prefix[:, self._index(start)]
+        return dict(zip(self.series, values.tolist()))
+
+    def patched(self, deltas, version):
+        """A copy with daily_deltas()-shaped deltas added, tagged `version`; None when a delta
+        falls outside the ledger's days or series and the ledger has to be rebuilt. The copy
+        leaves this ledger untouched for any thread still reading it."""
+        ledger = copy.copy(self)
+        ledger.prefix = self.prefix.copy()
+        ledger.version = version
+        for (day, reporting_category_id, kind), delta in deltas.items():
+            row = self.position.get((reporting_category_id, kind))
+            if row is None or not self.first_day <= day <= self.last_day:
+                return None
+            ledger.prefix[row, (day - self.first_day).days + 1:] += float(delta)
+        return ledger
+
+
+# This process's DailyLedger. Held here rather than in the Django cache, which would pickle
+# the whole prefix array on every read; the LEDGER_VERSION check keeps processes in step.
+_ledger = None
+
+
+def daily_ledger(today=None):
+    """This process's DailyLedger, rebuilt when missing, when today has moved past its span or
+    when it was built against an older LEDGER_VERSION."""
+    global _ledger
+    today = today or date.today()
+    # Read before the ledger query; see insights.spend_matrix().
+    version = current_version(LEDGER_VERSION)
+    ledger = _ledger
+    if ledger is None or ledger.last_day < today or ledger.version != version:
+        ledger = _ledger = DailyLedger(today, version)
+    return ledger
+
+
+def range_report(start, end, today=None):
+    """Income, spend and per reporting category spend against pro-rated budget for the
+    inclusive date range start..end, read from the DailyLedger."""
+    totals = daily_ledger(today).totals(start, end + timedelta(days=1))
+    months = ((end - start).days + 1) / (365.25 / 12)
+
+    spend_by_category = {}
+    income = 0.0
+    for (category_id, kind), total in totals.items():
+        if kind == MonthlyRollup.KIND_INCOME:
+            income += total
+        elif kind == MonthlyRollup.KIND_SPEND:
+            spend_by_category[category_id] = spend_by_category.get(category_id, 0.0) - total
+
+    budgets = {
+        category.id: (category.name, float(category.budget or 0))
+        for category in Category.objects.filter(reporting_category__isnull=True).exclude(name__iexact='income')
+    }
+    names = dict(Category.objects.filter(pk__in=[key for key in spend_by_category if key]).values_list('id', 'name'))
+
+    rows = []
+    for category_id in set(budgets) | set(spend_by_category):
+        name, budget = budgets.get(category_id) or (names.get(category_id) or 'Uncategorized', 0.0)
+        spent = spend_by_category.get(category_id, 0.0)
+        budget *= months
+        if not spent and not budget:
+            continue
+        rows.append({
+            'category_id': category_id,
+            'name': name,
+            'spent': spent,
+            'budget': budget,
+            'surplus': budget - spent,
+        })
+    rows.sort(key=lambda row: row['spent'], reverse=True)
+    total_spend = sum(row['spent'] for row in rows)
+    total_budget = sum(row['budget'] for row in rows)
+    return {
+        'rows': rows,
+        'income': income,
+        'total_spend': total_spend,
+        'total_budget': total_budget,
+        'total_surplus': total_budget - total_spend,
+        'savings': income - total_spend,
+    }
+
+
+def invalidate_daily_ledger():
+    """Mark every process's ledger stale. Call inside the write's transaction, after the
+    DailyRollup rows have been brought up to date."""
+    bump_version(LEDGER_VERSION)
+
+
+def transaction_changed(previous, current):
+    """Move one transaction's net amount from its previous bucket state to its current one in
+    the DailyRollup table and bump LEDGER_VERSION. If this process's ledger is the one the
+    bump replaced, it is patched with the same deltas instead of rebuilt. Either side may be None."""
+    global _ledger
+    deltas = {}
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is not None:
+            key = daily_key(state)
+            deltas[key] = deltas.get(key, ZERO) + sign * (Decimal(state['amount'] or 0) + Decimal(state['reimbursement'] or 0))
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    apply_daily_deltas(deltas)
+    replaced, version = bump_version(LEDGER_VERSION)
+    ledger = _ledger
+    if ledger is not None and ledger.version == replaced:
+        _ledger = ledger.patched(deltas, version)
@@ -0,0 +1,246 @@
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import transaction as db_transaction
+
+from .models import Transaction, RecurringTransaction
+from . import month_cache
+from .recurring_detector import invalidate_suggestions
+from .insights import invalidate_spend_matrix
+from .range_ledger import apply_daily_deltas, daily_deltas, invalidate_daily_ledger
+from .rollups import rebuild_rollups
+from .spend_index import apply_spend_deltas, spend_deltas
+
+# One expanded occurrence of a recurring transaction; see expand_occurrences().
+OCCURRENCE_DTYPE = np.dtype([('rule_id', np.int64), ('date', 'datetime64[D]'), ('amount', np.float64)])
+
+
+def add_months(d, months):
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    day = min(d.day, calendar.monthrange(year, month)[1])
+    return d.replace(year=year, month=month, day=day)
+
+
+def first_occurrence(recurring):
+    """The rule's first occurrence: start_date moved forward to day_of_week for weekly rules,
+    or to day_of_month (clamped to the month's length) for monthly and yearly ones."""
+    next_date = recurring.start_date
+    if recurring.frequency == 'weekly':
+        if recurring.day_of_week is not None:
+            days_ahead = recurring.day_of_week - next_date.weekday()
+            if days_ahead < 0:
+                days_ahead += 7
+            next_date = next_date + timedelta(days=days_ahead)
+        return next_date
+
+    elif recurring.frequency in ('monthly', 'yearly'):
+        day = min(recurring.day_of_month, calendar.monthrange(next_date.year, next_date.month)[1])
+        return next_date.replace(day=day)
+
+    return None
+
+
+def get_next_occurrence(recurring):
+    if not recurring.last_generated:
+        return first_occurrence(recurring)
+
+    if recurring.frequency == 'weekly':
+        return recurring.last_generated + timedelta(weeks=recurring.interval)
+
+    elif recurring.frequency in ('monthly', 'yearly'):
+        months = recurring.interval * (12 if recurring.frequency == 'yearly' else 1)
+        next_date = add_months(recurring.last_generated, months)
+        day = min(recurring.day_of_month, calendar.monthrange(next_date.year, next_date.month)[1])
+        return next_date.replace(day=day)
+
+    return None
+
+
+def _month_index(days):
+    """Months since 1970-01 for datetime64[D] values."""
+    return days.astype('datetime64[M]').astype(np.int64)
+
+
+def _expand_steps(anchors, steps, low, high):
+    """For arithmetic sequences anchors[i] + k * steps[i], k >= 0, every term within
+    [low[i], high[i]]: returns (position of the sequence, term). A zero step is a single term."""
+    step = np.maximum(steps, 1)
+    first = np.where(steps > 0, np.maximum(0, -((anchors - low) // step)), 0)
+    last = np.where(steps > 0, (high - anchors) // step, 0)
+    counts = np.where(
+        steps > 0, np.maximum(last - first + 1, 0), (anchors >= low) & (anchors <= high),
+    ).astype(np.int64)
+    positions = np.repeat(np.arange(len(anchors)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    terms = anchors[positions] + (first[positions] + offsets) * steps[positions]
+    return positions, terms
+
+
+def expand_occurrences(rules, start, end, pending_only=False):
+    """Every occurrence of `rules` dated in [start, end), as an OCCURRENCE_DTYPE array sorted
+    by date then rule id.
+
+    Each rule is an arithmetic sequence: weekly rules step interval * 7 days from their first
+    occurrence; monthly and yearly rules step interval (* 12) months, landing on day_of_month
+    clamped to the month's length. The terms inside the range are computed in one NumPy pass
+    per kind, with no per-occurrence loop. Occurrences after a rule's end_date are dropped.
+    With pending_only the sequence starts at get_next_occurrence(), so it lists what
+    generate_due_transactions() has yet to create rather than the schedule since start_date.
+    """
+    weekly, monthly = [], []
+    last_day = end - timedelta(days=1)
+    for rule in rules:
+        anchor = get_next_occurrence(rule) if pending_only else first_occurrence(rule)
+        if anchor is None:
+            continue
+        stop = min(last_day, rule.end_date) if rule.end_date else last_day
+        if anchor > stop:
+            continue
+        if rule.frequency == 'weekly':
+            weekly.append((rule.id, anchor, rule.interval * 7, stop, rule.amount))
+        else:
+            months = rule.interval * (12 if rule.frequency == 'yearly' else 1)
+            monthly.append((rule.id, anchor, months, stop, rule.amount, rule.day_of_month))
+
+    parts = []
+    if weekly:
+        rule_ids, anchors, steps, stops, amounts = zip(*weekly)
+        anchors = np.array(anchors, dtype='datetime64[D]').astype(np.int64)
+        stops = np.array(stops, dtype='datetime64[D]').astype(np.int64)
+        low = np.full(len(anchors), np.datetime64(start, 'D').astype(np.int64))
+        positions, days = _expand_steps(anchors, np.array(steps, dtype=np.int64), low, stops)
+        parts.append((np.array(rule_ids)[positions], days.astype('datetime64[D]'), np.array(amounts, dtype=float)[positions]))
+
+    if monthly:
+        rule_ids, anchors, steps, stops, amounts, days_of_month = zip(*monthly)
+        stops = np.array(stops, dtype='datetime64[D]')
+        positions, months = _expand_steps(
+            _month_index(np.array(anchors, dtype='datetime64[D]')), np.array(steps, dtype=np.int64),
+            np.full(len(anchors), _month_index(np.datetime64(start, 'D'))), _month_index(stops),
+        )
+        month_start = months.astype('datetime64[M]').astype('datetime64[D]')
+        month_length = ((months + 1).astype('datetime64[M]').astype('datetime64[D]') - month_start).astype(np.int64)
+        dates = month_start + np.minimum(np.array(days_of_month)[positions], month_length) - 1
+        # The clamped day can fall before start or after the stop date in the edge months.
+        keep = (dates >= np.datetime64(start, 'D')) & (dates <= stops[positions])
+        parts.append((np.array(rule_ids)[positions][keep], dates[keep], np.array(amounts, dtype=float)[positions][keep]))
+
+    occurrences = np.zeros(sum(len(part[0]) for part in parts), dtype=OCCURRENCE_DTYPE)
+    if parts:
+        occurrences['rule_id'] = np.concatenate([part[0] for part in parts])
+        occurrences['date'] = np.concatenate([part[1] for part in parts])
+        occurrences['amount'] = np.concatenate([part[2] for part in parts])
+    return occurrences[np.lexsort((occurrences['rule_id'], occurrences['date']))]
+
+
+def scheduled_next_due(recurring):
+    """The value stored in recurring.next_due: the next occurrence, or None past end_date."""
+    next_date = get_next_occurrence(recurring)
+    if next_date and recurring.end_date and next_date > recurring.end_date:
+        return None
+    return next_date
+
+
+def refresh_next_due(recurring):
+    """Recompute recurring.next_due before a save. Views may have assigned ISO date strings,
+    so the date fields are parsed first."""
+    for name in ('start_date', 'end_date', 'last_generated'):
+        field = recurring._meta.get_field(name)
+        setattr(recurring, name, field.to_python(getattr(recurring, name)))
+    recurring.next_due = scheduled_next_due(recurring)
+
+
+def upcoming_recurring(today=None, days=7):
+    """Active recurring transactions falling due after today and within `days`, soonest first."""
+    today = today or date.today()
+    return (
+        RecurringTransaction.objects.filter(
+            is_active=True, next_due__gt=today, next_due__lte=today + timedelta(days=days),
+        )
+        .select_related('category', 'source')
+        .order_by('next_due')
+    )
+
+
+def due_dates(recurring, today):
+    """Occurrence dates of `recurring` that are due on or before `today`, in order.
+    Advances recurring.last_generated in memory and clears is_active once the rule has ended;
+    nothing is written to the database.
+    """
+    if recurring.end_date and recurring.end_date < today:
+        recurring.is_active = False
+        return []
+
+    dates = []
+    next_date = get_next_occurrence(recurring)
+    while next_date and next_date <= today:
+        if recurring.end_date and next_date > recurring.end_date:
+            recurring.is_active = False
+            break
+        if dates and next_date <= dates[-1]:
+            break  # a zero interval would otherwise repeat the same date forever
+        dates.append(next_date)
+        recurring.last_generated = next_date
+        next_date = get_next_occurrence(recurring)
+    return dates
+
+
+def generation_due(today=None):
+    """Cheap check for the index page: is any recurring transaction due to be generated?
+    Either an occurrence has fallen due, a range probe on the partial next_due index, or an
+    active rule's end_date has passed and generation still has to deactivate it.
+    """
+    today = today or date.today()
+    active = RecurringTransaction.objects.filter(is_active=True)
+    return active.filter(next_due__lte=today).exists() or active.filter(end_date__lt=today).exists()
+
+
+def generate_due_transactions(today=None):
+    """Create every due occurrence of the active recurring transactions.
+
+    Occurrences are computed up front and written with one bulk_create, and the rules'
+    last_generated/is_active/next_due with one bulk_update. bulk_create skips the Transaction
+    signals, so the monthly rollups and month cache are refreshed here for the months that
+    received rows and the new spend is added to the spend index. Returns the number of
+    transactions created.
+    """
+    today = today or date.today()
+    with db_transaction.atomic():
+        recurring_list = list(RecurringTransaction.objects.filter(is_active=True))
+        new_transactions = []
+        changed = []
+        for recurring in recurring_list:
+            dates = due_dates(recurring, today)
+            if dates or not recurring.is_active:
+                recurring.next_due = scheduled_next_due(recurring)
+                changed.append(recurring)
+            new_transactions.extend(
+                Transaction(
+                    description=recurring.description,
+                    amount=recurring.amount,
+                    date=next_date,
+                    category_id=recurring.category_id,
+                    source_id=recurring.source_id,
+                    recurring_source=recurring,
+                )
+                for next_date in dates
+            )
+
+        Transaction.objects.bulk_create(new_transactions, batch_size=500)
+        RecurringTransaction.objects.bulk_update(changed, ['last_generated', 'is_active', 'next_due'])
+
+        months = {(txn.date.year, txn.date.month) for txn in new_transactions}
+        rebuild_rollups(months)
+        month_cache.invalidate_months(months)
+        apply_spend_deltas(spend_deltas(new_transactions))
+        apply_daily_deltas(daily_deltas(new_transactions))
+        invalidate_spend_matrix()
+        invalidate_daily_ledger()
+        if changed:
+            # Rules that ended no longer hide their description from the suggestions.
+            invalidate_suggestions()
+
+    return len(new_transactions)
@@ -1,12 +1,71 @@
+import re
 from collections import Counter
-from statistics import median
+from functools import lru_cache
+
+import numpy as np
+from django.core.cache import cache
+
+from .cache_versions import bump_version, current_version
+from .models import Transaction, RecurringTransaction, DismissedSuggestion, Category, Source
+
+# Cache key holding the current recurring suggestions with the SUGGESTIONS_VERSION token they
+# were scanned under, one entry per detection mode. The version is bumped by any write to
+# transactions, recurring transactions, dismissals, categories or sources (see
+# tracker/signals.py) and by the bulk paths that skip those signals.
+SUGGESTIONS_CACHE_KEY = 'tracker:recurring:suggestions:{mode}'
+SUGGESTIONS_VERSION = 'recurring_suggestions'
+
+# Bank descriptions split into tokens on whitespace, '*' and '#'. After the first token,
+# anything holding a digit (dates, reference numbers, store ids) or naming a month is noise.
+MERCHANT_SPLIT_RE = re.compile(r'[\s*#]+')
+MERCHANT_NOISE_RE = re.compile(
+    r'\d|^(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)$'
+    r'|^(?:january|february|march|april|june|july|august|september|october|november|december)$'
+)
+
+CONSISTENCY_TOLERANCE = 0.2
+MIN_CONSISTENCY = 0.7
+
+
+@lru_cache(maxsize=65536)
+def merchant_key(description):
+    """Collapse a bank description to a merchant key, e.g. 'NETFLIX.COM 8392' -> 'netflix.com'."""
+    tokens = [token for token in MERCHANT_SPLIT_RE.split(description.lower()) if token]
+    if not tokens:
+        return ''
+    return ' '.join([tokens[0]] + [token for token in tokens[1:] if not MERCHANT_NOISE_RE.search(token)])
+
+
+def detect_recurring_patterns(mode='exact'):
+    """Suggested recurring transactions, from the cache when nothing has changed since the
+    last scan. mode 'merchant' groups descriptions by merchant_key instead of exact text."""
+    key = SUGGESTIONS_CACHE_KEY.format(mode=mode)
+    # Read the version before scanning, so a write landing in between leaves the entry
+    # tagged with the older version and it is scanned again on the next call.
+    version = current_version(SUGGESTIONS_VERSION)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    suggestions = scan_recurring_patterns(mode)
+    cache.set(key, (version, suggestions), None)
+    return suggestions
+
 
-from django.db.models import Count
+def invalidate_suggestions():
+    """Mark every process's cached suggestions stale. Call inside the write's transaction."""
+    bump_version(SUGGESTIONS_VERSION)
 
-from .models import Transaction, RecurringTransaction, DismissedSuggestion
 
+def scan_recurring_patterns(mode='exact'):
+    """Find recurring patterns among non-recurring transactions.
 
-def detect_recurring_patterns():
+    Reads every candidate row in one date-ordered query, then groups rows by description
+    (or merchant key) with a stable argsort and computes every group's interval median and
+    consistency at once with NumPy. A group is suggested when it has at least three rows,
+    its median interval matches a frequency in _match_frequency and at least
+    MIN_CONSISTENCY of its intervals lie within CONSISTENCY_TOLERANCE of that median. In
+    merchant mode the suggestion carries the group's most recent description.
+    """
     # Descriptions already covered by active recurring transactions
     active_descriptions = set(
         RecurringTransaction.objects.filter(is_active=True)
@@ -18,57 +77,80 @@ def detect_recurring_patterns():
     )
     excluded = active_descriptions | dismissed_descriptions
 
-    # Only non-recurring transactions, grouped by description with 3+ occurrences
-    candidates = (
-        Transaction.objects.filter(recurring_source__isnull=True)
-        .exclude(description__in=excluded)
-        .values('description')
-        .annotate(cnt=Count('id'))
-        .filter(cnt__gte=3)
-    )
+    rows = Transaction.objects.filter(recurring_source__isnull=True).order_by('date')
+    if mode != 'merchant':
+        rows = rows.exclude(description__in=excluded)
+    rows = list(rows.values_list('description', 'date', 'amount', 'category_id', 'source_id'))
+    if mode == 'merchant':
+        keys = {description: merchant_key(description) for description in {row[0] for row in rows} | excluded}
+        excluded_keys = {keys[description] for description in excluded}
+        rows = [row for row in rows if keys[row[0]] not in excluded_keys]
+        row_keys = [keys[row[0]] for row in rows]
+    else:
+        row_keys = [row[0] for row in rows]
+    if not rows:
+        return []
+
+    group_keys, group_pos = np.unique(np.array(row_keys, dtype=object), return_inverse=True)
+    group_pos = group_pos.reshape(-1)
+    order = np.argsort(group_pos, kind='stable')  # grouped, still date order within a group
+    group_pos = group_pos[order]
+    ordinals = np.array([rows[i][1].toordinal() for i in order])
+    counts, medians, consistency = _interval_stats(group_pos, ordinals, len(group_keys))
+
+    candidates = np.flatnonzero((counts >= 2) & (medians > 0) & (consistency >= MIN_CONSISTENCY))
+    starts = np.concatenate(([0], np.cumsum(counts + 1)[:-1]))
+    category_names = dict(Category.objects.values_list('id', 'name'))
+    source_names = dict(Source.objects.values_list('id', 'name'))
 
     suggestions = []
-    for entry in candidates:
-        desc = entry['description']
-        txns = list(
-            Transaction.objects.filter(
-                description=desc, recurring_source__isnull=True
-            )
-            .order_by('date')
-            .values('date', 'amount', 'category_id', 'category__name', 'source_id', 'source__name')
-        )
-        result = analyze_transaction_group(desc, txns)
-        if result:
-            suggestions.append(result)
+    for g in candidates:
+        frequency, interval = _match_frequency(medians[g])
+        if not frequency:
+            continue
+        group_rows = [rows[i] for i in order[starts[g]:starts[g] + counts[g] + 1]]
+        transactions = [
+            {
+                'date': day,
+                'amount': amount,
+                'category_id': category_id,
+                'category__name': category_names.get(category_id),
+                'source_id': source_id,
+                'source__name': source_names.get(source_id),
+            }
+            for _, day, amount, category_id, source_id in group_rows
+        ]
+        suggestions.append(_suggestion(group_rows[-1][0], transactions, frequency, interval, float(consistency[g])))
 
     suggestions.sort(key=lambda s: s['occurrences'], reverse=True)
     return suggestions
 
 
-def analyze_transaction_group(description, transactions):
-    if len(transactions) < 3:
-        return None
+def _interval_stats(group_pos, ordinals, group_count):
+    """Per group: number of intervals, median interval and the fraction of intervals within
+    CONSISTENCY_TOLERANCE of the median. Rows must be grouped and date-ordered within groups."""
+    same_group = group_pos[1:] == group_pos[:-1]
+    gaps = np.diff(ordinals)[same_group]
+    gap_group = group_pos[1:][same_group]
+    counts = np.bincount(gap_group, minlength=group_count)
 
-    dates = [t['date'] for t in transactions]
-    intervals = [(dates[i + 1] - dates[i]).days for i in range(len(dates) - 1)]
-
-    if not intervals:
-        return None
+    sorted_gaps = gaps[np.lexsort((gaps, gap_group))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_gaps = counts > 0
+    medians = np.zeros(group_count)
+    low = (starts + (counts - 1) // 2)[has_gaps]
+    high = (starts + counts // 2)[has_gaps]
+    medians[has_gaps] = (sorted_gaps[low] + sorted_gaps[high]) / 2
 
-    med = median(intervals)
-    if med <= 0:
-        return None
+    group_median = medians[gap_group]
+    consistent = np.abs(gaps - group_median) <= group_median * CONSISTENCY_TOLERANCE
+    consistent_counts = np.bincount(gap_group, weights=consistent, minlength=group_count)
+    consistency = np.divide(consistent_counts, counts, out=np.zeros(group_count), where=has_gaps)
+    return counts, medians, consistency
 
-    frequency, interval = _match_frequency(med)
-    if not frequency:
-        return None
 
-    # Consistency: fraction of intervals within 20% of the median
-    tolerance = med * 0.2
-    consistent = sum(1 for gap in intervals if abs(gap - med) <= tolerance)
-    consistency = consistent / len(intervals)
-    if consistency < 0.7:
-        return None
+def _suggestion(description, transactions, frequency, interval, consistency):
+    dates = [t['date'] for t in transactions]
 
     # Average amount
     amounts = [float(t['amount']) for t in transactions]
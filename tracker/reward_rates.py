@@ -0,0 +1,277 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from .cache_versions import bump_version, current_version
+from .models import Category, RewardCategory, Source
+from .rewards import quarter_label
+from .rollups import CREDIT_CATEGORY_PREFIXES
+
+BLANKET_MULTIPLIERS = {
+    'cashback': Decimal('0.01'),
+    'miles': Decimal('1.0'),
+    'card_cash_miles': Decimal('2.0'),  # 2x miles on non-rent spend
+    'none': Decimal('0'),
+}
+
+# card_cash_miles sources also earn card cash, added as a miles equivalent for comparison purposes.
+# 0.5 bonus makes them rank above a card with the same miles rate but below one with more miles.
+CARD_CASH_MILES_BONUS = Decimal('0.5')
+
+# Cents per point/mile used to normalize miles against cashback for comparison only.
+# Display always shows raw miles (e.g. "2.00x"), never the converted value.
+CPP = Decimal('0.012')
+
+# CacheVersion name of the reward configuration. Every write to Source, RewardCategory or
+# Category bumps it (see tracker/signals.py), which tells each process to rebuild its
+# RewardRateMatrix on next use.
+CONFIG_VERSION = 'reward_config'
+
+# The card recommendation table for a quarter under one CONFIG_VERSION token. A new quarter
+# or version simply misses, so stale entries are never read and age out on their own.
+RECOMMENDATIONS_CACHE_KEY = 'tracker:card_recommendations:{quarter}:{version}'
+RECOMMENDATIONS_CACHE_TIMEOUT = 92 * 24 * 60 * 60
+
+
+def comparison_value(source, raw_multiplier):
+    """Return a dollar-per-dollar comparison value for ranking cards against each other.
+    Miles are converted to dollar value using CPP; cashback is already in dollar terms.
+    card_cash_miles gets the 0.5-mile card-cash bonus before conversion.
+    """
+    if source.reward_type == 'cashback':
+        return raw_multiplier
+    effective_miles = raw_multiplier + CARD_CASH_MILES_BONUS if source.reward_type == 'card_cash_miles' else raw_multiplier
+    return effective_miles * CPP
+
+
+def format_rate_label(multiplier, reward_type):
+    if reward_type == 'cashback':
+        percent = multiplier * 100
+        if percent == int(percent):
+            return f"{int(percent)}%"
+        return f"{percent:.2f}%"
+    return f"{multiplier:.2f}x"
+
+
+def is_active(source, on_date):
+    return (source.opened_on is None or source.opened_on <= on_date) and \
+        (source.closed_on is None or source.closed_on >= on_date)
+
+
+class RewardRateMatrix:
+    """Every card's rate for every (category, quarter), ranked best first.
+
+    Built from three queries. rates() answers for any category and quarter label: the raw
+    multiplier each source earns (its RewardCategory entry, else its BLANKET_MULTIPLIERS
+    rate) and the non-'none' sources as (source, raw multiplier, comparison value), sorted
+    by comparison value and then name. Opening and closing dates are checked at lookup time,
+    so the matrix does not go stale from one day to the next.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.sources = {source.id: source for source in Source.objects.order_by('name')}
+        self.credit_category_ids = {
+            category_id for category_id, name in Category.objects.values_list('id', 'name')
+            if name.lower().startswith(CREDIT_CATEGORY_PREFIXES)
+        }
+
+        base = defaultdict(dict)        # category_id -> {source_id: multiplier}
+        quarterly = defaultdict(dict)   # (category_id, quarter) -> {source_id: multiplier}
+        for source_id, category_id, multiplier, quarter in RewardCategory.objects.values_list(
+            'source_id', 'category_id', 'multiplier', 'applicable_quarter',
+        ):
+            if quarter:
+                quarterly[(category_id, quarter)][source_id] = multiplier
+            else:
+                base[category_id][source_id] = multiplier
+
+        self.default = self._ranked({})
+        self.by_category = {category_id: self._ranked(configured) for category_id, configured in base.items()}
+        # A quarter's entries apply on top of the category's year-round entries.
+        self.by_quarter = {
+            key: self._ranked({**base.get(key[0], {}), **configured})
+            for key, configured in quarterly.items()
+        }
+
+    def _ranked(self, configured):
+        multipliers = {
+            source_id: configured.get(source_id, BLANKET_MULTIPLIERS.get(source.reward_type, Decimal('0')))
+            for source_id, source in self.sources.items()
+        }
+        ranking = [
+            (source, multipliers[source_id], comparison_value(source, multipliers[source_id]))
+            for source_id, source in self.sources.items()
+            if source.reward_type != 'none'
+        ]
+        # sorted() is stable, so equal comparison values stay in name order.
+        ranking.sort(key=lambda entry: entry[2], reverse=True)
+        return multipliers, ranking
+
+    def rates(self, category_id, quarter):
+        return self.by_quarter.get((category_id, quarter)) or self.by_category.get(category_id) or self.default
+
+
+_matrix = None
+
+
+def invalidate_reward_rates():
+    """Mark every process's matrix and recommendation table stale. Call inside the write's
+    transaction, so a rollback takes the bump back with it."""
+    bump_version(CONFIG_VERSION)
+
+
+def reward_config_version():
+    return current_version(CONFIG_VERSION)
+
+
+def reward_rate_matrix():
+    """This process's RewardRateMatrix, rebuilt when the configuration version has moved on."""
+    global _matrix
+    # Read the version before the configuration, so a write landing in between leaves the
+    # matrix tagged with the older version and it is rebuilt again on the next call.
+    version = reward_config_version()
+    if _matrix is None or _matrix.version != version:
+        _matrix = RewardRateMatrix(version)
+    return _matrix
+
+
+def get_better_card_tip(transaction, today=None):
+    """Check if a better reward card existed for this transaction's category/amount.
+
+    Reads only the cached RewardRateMatrix and the transaction's category_id, source_id,
+    amount and date, so it runs one version query unless the reward configuration has changed.
+    """
+    if not transaction.category_id or not transaction.source_id:
+        return None
+    if transaction.amount <= 0:
+        return None
+    matrix = reward_rate_matrix()
+    if transaction.category_id in matrix.credit_category_ids:
+        return None
+    used_source = matrix.sources.get(transaction.source_id)
+    if used_source is None:
+        return None
+
+    txn_date = transaction.date
+    if isinstance(txn_date, str):
+        txn_date = date.fromisoformat(txn_date)
+    multipliers, ranking = matrix.rates(transaction.category_id, quarter_label(txn_date))
+
+    used_raw = multipliers[used_source.id]
+    used_cmp = comparison_value(used_source, used_raw)
+
+    today = today or date.today()
+    best = next((entry for entry in ranking if is_active(entry[0], today)), None)
+    if best is None or best[2] <= used_cmp:
+        return None
+
+    best_source, best_raw, best_cmp = best
+    amount = Decimal(str(transaction.amount))
+    return {
+        'best_source_name': best_source.name,
+        'best_rate_label': format_rate_label(best_raw, best_source.reward_type),
+        'used_rate_label': format_rate_label(used_raw, used_source.reward_type),
+        'missed_value': (best_cmp - used_cmp) * amount,
+        'amount': amount,
+    }
+
+
+def _next_activity_change(sources, today):
+    """The first date after today on which a card opens or closes, or None."""
+    changes = [source.opened_on for source in sources if source.opened_on and source.opened_on > today]
+    changes += [
+        source.closed_on + timedelta(days=1) for source in sources
+        if source.closed_on and source.closed_on >= today
+    ]
+    return min(changes, default=None)
+
+
+def build_card_recommendations(today=None):
+    """For each category with configured reward multipliers, return the best card.
+    Blanket rates from all active cards are considered alongside explicit RewardCategory entries,
+    so a card with a strong all-category rate appears as a candidate for every relevant category.
+
+    Returns (recommendations, valid_until): plain ids, names and rates that can be cached and
+    serialised as JSON, and the date a card next opens or closes, when the table goes stale.
+    """
+    today = today or date.today()
+    current_quarter = quarter_label(today)
+
+    sources = list(Source.objects.order_by('name'))
+    active_sources = [source for source in sources if source.reward_type != 'none' and is_active(source, today)]
+    active_ids = {source.id for source in active_sources}
+
+    reward_cats = RewardCategory.objects.select_related('category').filter(source_id__in=active_ids)
+
+    # Build: category -> {source_id -> (multiplier, is_quarterly)}
+    # Start with blanket rates for all active sources across every category that has
+    # at least one explicit RewardCategory entry.
+    explicit_categories = {}  # category -> set of source_ids with explicit entries
+    configured = {}           # (category, source_id) -> (multiplier, is_quarterly)
+
+    for rc in reward_cats:
+        active_q = (not rc.applicable_quarter) or (rc.applicable_quarter == current_quarter)
+        if not active_q:
+            continue
+        cat = rc.category
+        if cat not in explicit_categories:
+            explicit_categories[cat] = set()
+        explicit_categories[cat].add(rc.source_id)
+        configured[(cat, rc.source_id)] = (rc.multiplier, bool(rc.applicable_quarter))
+
+    recommendations = []
+    for category in sorted(explicit_categories.keys(), key=lambda c: c.name):
+        entries = []
+        for source in active_sources:
+            if (category, source.id) in configured:
+                raw_multiplier, is_quarterly = configured[(category, source.id)]
+            else:
+                raw_multiplier = BLANKET_MULTIPLIERS.get(source.reward_type, Decimal('0'))
+                is_quarterly = False
+            entries.append((source, comparison_value(source, raw_multiplier), raw_multiplier, is_quarterly))
+
+        sorted_entries = sorted(entries, key=lambda e: e[1], reverse=True)
+        best_source, best_cmp, best_raw, is_quarterly = sorted_entries[0]
+        runner_up = sorted_entries[1] if len(sorted_entries) > 1 else None
+        recommendations.append({
+            'category_id': category.id,
+            'category_name': category.name,
+            'best_source_id': best_source.id,
+            'best_source_name': best_source.name,
+            'best_multiplier': best_raw,
+            'best_rate_label': format_rate_label(best_raw, best_source.reward_type),
+            'best_reward_type': best_source.reward_type,
+            'is_quarterly': is_quarterly,
+            'current_quarter': current_quarter,
+            'runner_up': {
+                'source_id': runner_up[0].id,
+                'source_name': runner_up[0].name,
+                'multiplier': runner_up[2],
+                'rate_label': format_rate_label(runner_up[2], runner_up[0].reward_type),
+                'reward_type': runner_up[0].reward_type,
+            } if runner_up else None,
+        })
+    return recommendations, _next_activity_change(sources, today)
+
+
+def card_recommendations(today=None):
+    """The card recommendation table for today, from the cache when possible.
+
+    Keyed by quarter and the database-held reward configuration version, so a quarter
+    rollover or any committed edit to sources, reward categories or categories, from any
+    process, rebuilds it on next use. An entry is also
+    rebuilt once a card has opened or closed since it was built.
+    """
+    today = today or date.today()
+    key = RECOMMENDATIONS_CACHE_KEY.format(quarter=quarter_label(today), version=reward_config_version())
+    cached = cache.get(key)
+    if cached is not None:
+        recommendations, valid_until = cached
+        if valid_until is None or today < valid_until:
+            return recommendations
+    recommendations, valid_until = build_card_recommendations(today)
+    cache.set(key, (recommendations, valid_until), RECOMMENDATIONS_CACHE_TIMEOUT)
+    return recommendations
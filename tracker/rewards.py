@@ -0,0 +1,288 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Sum
+from django.db.models.functions import ExtractQuarter
+
+from .models import Transaction, RewardCategory
+from .rollups import year_date_range
+
+ZERO = Decimal('0')
+
+# Bilt-style card_cash_miles cards: 2x miles and 4% card cash on non-rent spend,
+# and 3% of rent can be covered by card cash to earn 1x points on rent.
+CARD_CASH_MILES_RATE = 2.0
+CARD_CASH_RATE = 0.04
+RENT_CARD_CASH_COST = 0.03
+
+
+def cashback_label(value):
+    percent = value * 100
+    if percent.is_integer():
+        return f"{int(percent)}%"
+    return f"{percent:.2f}%"
+
+
+def quarter_label(date_value):
+    if not date_value:
+        return ""
+    quarter = (date_value.month - 1) // 3 + 1
+    return f"{date_value.year}Q{quarter}"
+
+
+def quarter_number(label):
+    """Quarter (1-4) of an applicable_quarter label like '2025Q2', or None if invalid."""
+    if not label or "Q" not in label:
+        return None
+    year_part, quarter_part = label.split("Q", 1)
+    if not year_part.isdigit() or not quarter_part.isdigit():
+        return None
+    quarter = int(quarter_part)
+    return quarter if 1 <= quarter <= 4 else None
+
+
+def quarter_year(label):
+    return int(label.split("Q", 1)[0]) if quarter_number(label) else None
+
+
+def signup_bonus_for_year(source, year):
+    """Signup bonus miles to count in `year`. signup_bonus_awarded_on is kept current on
+    transaction writes by tracker/spend_index.py, so this is a read of the source row."""
+    bonus_miles = float(source.signup_bonus_miles or 0)
+    awarded_on = source.signup_bonus_awarded_on
+    if bonus_miles <= 0 or (source.signup_bonus_min_spend or 0) <= 0 or not awarded_on:
+        return 0
+    return bonus_miles if awarded_on.year == year else 0
+
+
+def _category_flags(name, reporting_name):
+    """(is_income, credit_prefix, is_rent) for a category, matching the Q filters used elsewhere."""
+    name = (name or '').lower()
+    reporting_name = (reporting_name or '').lower()
+    credit_prefix = next((p for p in ('card-cash-', 'miles-credit-', 'credit-') if name.startswith(p)), None)
+    is_income = name == 'income' or reporting_name == 'income'
+    is_rent = 'rent' in name or 'rent' in reporting_name
+    return is_income, credit_prefix, is_rent
+
+
+class SpendMatrix:
+    """Signed transaction amounts for one year, summed per (source, category, quarter).
+
+    Built from one grouped query; every per-card total the rewards page needs is read from it.
+    """
+
+    def __init__(self, year):
+        self.year = year
+        start, end = year_date_range(year)
+        rows = (
+            Transaction.objects.filter(date__gte=start, date__lt=end, source__isnull=False)
+            .annotate(quarter=ExtractQuarter('date'))
+            .values('source_id', 'category_id', 'quarter', 'category__name', 'category__reporting_category__name')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        self.cells = defaultdict(lambda: ZERO)
+        self.by_source = defaultdict(list)
+        for row in rows:
+            key = (row['source_id'], row['category_id'], row['quarter'])
+            self.cells[key] += row['total'] or ZERO
+            flags = _category_flags(row['category__name'], row['category__reporting_category__name'])
+            self.by_source[row['source_id']].append((row['category_id'], row['quarter'], row['total'] or ZERO, flags))
+
+    def category_total(self, source_id, category_id, quarter=None):
+        quarters = (quarter,) if quarter else (1, 2, 3, 4)
+        return sum((self.cells.get((source_id, category_id, q), ZERO) for q in quarters), ZERO)
+
+    def totals(self, source_id):
+        """Signed totals for one source: base spend (excluding income and credits), its rent and
+        non-rent split, and the card-cash-, miles-credit- and credit- category totals."""
+        totals = defaultdict(lambda: ZERO)
+        for _, _, amount, (is_income, credit_prefix, is_rent) in self.by_source.get(source_id, ()):
+            if credit_prefix:
+                totals[credit_prefix] += amount
+            if is_income or credit_prefix:
+                continue
+            totals['base'] += amount
+            totals['rent' if is_rent else 'non_rent'] += amount
+        return totals
+
+
+def _row(category_name, multiplier, multiplier_label, spend, rewards, rewards_format, **extra):
+    row = {
+        'category_name': category_name,
+        'reporting_category_name': None,
+        'multiplier': multiplier,
+        'multiplier_label': multiplier_label,
+        'spend': spend,
+        'rewards': rewards,
+        'rewards_format': rewards_format,
+    }
+    row.update(extra)
+    return row
+
+
+def _card_cash_miles_summary(source, totals, bonus_miles):
+    rent_spend = abs(float(totals['rent']))
+    non_rent_spend = abs(float(totals['non_rent']))
+    non_rent_miles = non_rent_spend * CARD_CASH_MILES_RATE
+    card_cash_earned = non_rent_spend * CARD_CASH_RATE
+    card_cash_credits = abs(float(totals['card-cash-']))
+    card_cash_pool = card_cash_earned + card_cash_credits
+    rent_coverable = card_cash_pool / RENT_CARD_CASH_COST if card_cash_pool else 0
+    rent_points = min(rent_spend, rent_coverable)
+    bilt_cash_used = rent_points * RENT_CARD_CASH_COST
+    miles_credit_amount = abs(float(totals['miles-credit-']))
+    credit_amount = abs(float(totals['credit-']))
+
+    reward_rows = []
+    if non_rent_spend > 0:
+        reward_rows.append(_row('Non-Rent Spend (Miles)', CARD_CASH_MILES_RATE, None, non_rent_spend, non_rent_miles, 'miles'))
+        reward_rows.append(_row('Card Cash Earned', CARD_CASH_RATE, cashback_label(CARD_CASH_RATE), non_rent_spend, card_cash_earned, 'cash'))
+    if card_cash_credits > 0:
+        reward_rows.append(_row('Card Cash Credits', 0, 'Credit', 0, card_cash_credits, 'cash'))
+    if miles_credit_amount > 0:
+        reward_rows.append(_row('Miles Credits', 0, 'Credit', 0, miles_credit_amount, 'miles'))
+    if rent_spend > 0:
+        reward_rows.append(_row(
+            'Rent (Redeemed Points)', 1.0, f'1x (${bilt_cash_used:.2f} Bilt Cash used)', rent_points, rent_points, 'miles',
+        ))
+    reward_rows.append(_row('Bilt Cash Remaining', 0, 'Balance', 0, card_cash_pool - bilt_cash_used, 'cash'))
+    if credit_amount > 0:
+        reward_rows.append(_row('Credits', 0, 'Credit', 0, credit_amount, 'cash', is_credit=True))
+    if bonus_miles > 0:
+        reward_rows.append(_row('Signup Bonus', 0, 'Bonus', 0, bonus_miles, 'miles'))
+
+    total_rewards_miles = non_rent_miles + rent_points + bonus_miles + miles_credit_amount
+    total_rewards_cash = credit_amount
+    return {
+        'source': source,
+        'reward_rows': reward_rows,
+        'has_quarterly': False,
+        'total_spend': non_rent_spend + rent_spend,
+        'total_rewards': total_rewards_miles + total_rewards_cash,
+        'total_rewards_miles': total_rewards_miles,
+        'total_rewards_cash': total_rewards_cash,
+    }
+
+
+def _category_rewards_summary(source, entries, matrix, totals, bonus_miles):
+    reward_type = source.reward_type
+    rewards_format = 'cash' if reward_type == 'cashback' else 'miles'
+    reward_rows = []
+    total_rewards = 0
+    total_rewards_miles = 0
+    total_rewards_cash = 0
+    total_spend = 0
+    covered_spend = 0
+
+    for entry in entries:
+        quarter = None
+        if entry.applicable_quarter:
+            quarter = quarter_number(entry.applicable_quarter)
+            if not quarter or quarter_year(entry.applicable_quarter) != matrix.year:
+                continue
+        spend = abs(float(matrix.category_total(source.id, entry.category_id, quarter)))
+        multiplier = float(entry.multiplier)
+        rewards = spend * multiplier
+        reporting_category = entry.category.reporting_category
+        reward_rows.append({
+            'category_name': entry.category.name,
+            'reporting_category_name': reporting_category.name if reporting_category else None,
+            'multiplier': multiplier,
+            'multiplier_label': cashback_label(multiplier) if reward_type == 'cashback' else None,
+            'applicable_quarter': entry.applicable_quarter,
+            'quarter_label': f"Q{entry.applicable_quarter.split('Q', 1)[1]}" if entry.applicable_quarter and "Q" in entry.applicable_quarter else None,
+            'spend': spend,
+            'rewards': rewards,
+            'rewards_format': rewards_format,
+        })
+        covered_spend += spend
+        total_spend += spend
+        total_rewards += rewards
+        if reward_type == 'miles':
+            total_rewards_miles += rewards
+        elif reward_type == 'cashback':
+            total_rewards_cash += rewards
+
+    if reward_type == 'miles':
+        if bonus_miles > 0:
+            reward_rows.append(_row('Signup Bonus', 0, 'Bonus', 0, bonus_miles, 'miles', is_bonus=True))
+            total_rewards += bonus_miles
+            total_rewards_miles += bonus_miles
+        miles_credit_amount = abs(float(totals['miles-credit-']))
+        if miles_credit_amount > 0:
+            reward_rows.append(_row('Miles Credits', 0, 'Credit', 0, miles_credit_amount, 'miles', is_credit=True))
+            total_rewards += miles_credit_amount
+            total_rewards_miles += miles_credit_amount
+
+    if reward_type in ('miles', 'cashback'):
+        credit_amount = abs(float(totals['credit-']))
+        if credit_amount > 0:
+            reward_rows.append(_row('Credits', 0, 'Credit', 0, credit_amount, 'cash', is_credit=True))
+            total_rewards += credit_amount
+            total_rewards_cash += credit_amount
+
+    blanket_spend = max(abs(float(totals['base'])) - covered_spend, 0)
+    blanket_multiplier = 0.01 if reward_type == 'cashback' else 1.0
+    blanket_rewards = blanket_spend * blanket_multiplier
+    if blanket_spend > 0 and reward_type != 'none':
+        reward_rows.append(_row(
+            'All Other', blanket_multiplier, '1%' if reward_type == 'cashback' else '1.00x',
+            blanket_spend, blanket_rewards, rewards_format, is_blanket=True,
+        ))
+        total_spend += blanket_spend
+        total_rewards += blanket_rewards
+        if reward_type == 'miles':
+            total_rewards_miles += blanket_rewards
+        elif reward_type == 'cashback':
+            total_rewards_cash += blanket_rewards
+
+    reward_rows.sort(key=lambda row: (row.get('is_blanket', False), row.get('is_credit', False), row['category_name']))
+    return {
+        'source': source,
+        'reward_rows': reward_rows,
+        'has_quarterly': any(row.get('applicable_quarter') for row in reward_rows),
+        'total_spend': total_spend,
+        'total_rewards': total_rewards,
+        'total_rewards_miles': total_rewards_miles,
+        'total_rewards_cash': total_rewards_cash,
+    }
+
+
+def build_rewards_summary(sources, year):
+    """Reward rows and totals for every source in `sources` for one calendar year.
+
+    Spend comes from a single SpendMatrix and reward categories from one query, so the cost
+    does not grow with the number of cards or reward entries.
+    """
+    matrix = SpendMatrix(year)
+    entries_by_source = defaultdict(list)
+    for entry in RewardCategory.objects.select_related('category', 'category__reporting_category'):
+        entries_by_source[entry.source_id].append(entry)
+
+    sources_data = []
+    total_miles_earned = 0
+    total_cashback_earned = 0
+    total_credits_earned = 0
+    for source in sources:
+        totals = matrix.totals(source.id)
+        if source.reward_type == 'card_cash_miles':
+            summary = _card_cash_miles_summary(source, totals, signup_bonus_for_year(source, year))
+            total_miles_earned += summary['total_rewards_miles']
+            total_credits_earned += summary['total_rewards_cash']
+        else:
+            bonus_miles = signup_bonus_for_year(source, year) if source.reward_type == 'miles' else 0
+            summary = _category_rewards_summary(source, entries_by_source[source.id], matrix, totals, bonus_miles)
+            if source.reward_type == 'miles':
+                total_miles_earned += summary['total_rewards_miles']
+                total_credits_earned += summary['total_rewards_cash']
+            elif source.reward_type == 'cashback':
+                total_cashback_earned += summary['total_rewards_cash']
+        sources_data.append(summary)
+
+    return {
+        'sources_data': sources_data,
+        'total_miles_earned': total_miles_earned,
+        'total_cashback_earned': total_cashback_earned,
+        'total_credits_earned': total_credits_earned,
+    }
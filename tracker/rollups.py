@@ -0,0 +1,220 @@
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import Q, F, Sum, Count, Value, Case, When, CharField, DecimalField
+from django.db.models.functions import Coalesce, ExtractYear, ExtractMonth
+
+from .models import Transaction, MonthlyRollup
+
+CREDIT_CATEGORY_Q = (
+    Q(category__name__istartswith='card-cash-') |
+    Q(category__name__istartswith='miles-credit-') |
+    Q(category__name__istartswith='credit-')
+)
+
+INCOME_CATEGORY_Q = Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
+
+CREDIT_CATEGORY_PREFIXES = ('card-cash-', 'miles-credit-', 'credit-')
+
+# Months of history behind the reports' average trend line, the month-end projection's
+# run-rate and the spending anomaly baseline.
+SPEND_TREND_LOOKBACK_MONTHS = 6
+
+# Fields needed to place a transaction in its rollup bucket.
+ROLLUP_FIELDS = (
+    'date', 'amount', 'reimbursement', 'source_id', 'category_id',
+    'category__name', 'category__reporting_category_id', 'category__reporting_category__name',
+)
+
+
+def month_date_range(year, month):
+    """Return the half-open [start, end) date range covering a calendar month.
+    Filter with date__gte/date__lt rather than date__month so the date indexes are used.
+    """
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def year_date_range(year):
+    """Return the half-open [start, end) date range covering a calendar year."""
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def classify_category(name, reporting_name):
+    """Return the rollup kind for a category, matching CREDIT_CATEGORY_Q / INCOME_CATEGORY_Q."""
+    lowered = (name or '').lower()
+    if lowered.startswith(CREDIT_CATEGORY_PREFIXES):
+        return MonthlyRollup.KIND_CREDIT
+    if lowered == 'income' or (reporting_name or '').lower() == 'income':
+        return MonthlyRollup.KIND_INCOME
+    return MonthlyRollup.KIND_SPEND
+
+
+def rollup_state(transaction_id):
+    """Load the bucket-relevant fields of a stored transaction, or None if it does not exist."""
+    if transaction_id is None:
+        return None
+    return Transaction.objects.filter(pk=transaction_id).values(*ROLLUP_FIELDS).first()
+
+
+def rollup_key(state):
+    return (
+        state['date'].year,
+        state['date'].month,
+        state['category__reporting_category_id'] or state['category_id'],
+        state['source_id'],
+        classify_category(state['category__name'], state['category__reporting_category__name']),
+    )
+
+
+def apply_states(states, sign):
+    """Add (sign=1) or remove (sign=-1) a batch of transaction states from the rollup table."""
+    deltas = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+    for state in states:
+        delta = deltas[rollup_key(state)]
+        delta[0] += Decimal(state['amount'] or 0) * sign
+        delta[1] += Decimal(state['reimbursement'] or 0) * sign
+        delta[2] += sign
+
+    for (year, month, reporting_category_id, source_id, kind), (amount, reimbursement, count) in deltas.items():
+        if not amount and not reimbursement and not count:
+            continue
+        bucket = {
+            'year': year,
+            'month': month,
+            'reporting_category_id': reporting_category_id,
+            'source_id': source_id,
+            'kind': kind,
+        }
+        updated = MonthlyRollup.objects.filter(**bucket).update(
+            amount=F('amount') + amount,
+            reimbursement=F('reimbursement') + reimbursement,
+            row_count=F('row_count') + count,
+        )
+        if not updated:
+            MonthlyRollup.objects.create(amount=amount, reimbursement=reimbursement, row_count=count, **bucket)
+
+
+def transaction_changed(previous, current):
+    """Move a transaction's contribution from its previous bucket state to its current one.
+    Either side may be None for creates and deletes.
+    """
+    if previous is not None and current is not None and rollup_key(previous) == rollup_key(current) \
+            and previous['amount'] == current['amount'] and previous['reimbursement'] == current['reimbursement']:
+        return
+    if previous is not None:
+        apply_states([previous], -1)
+    if current is not None:
+        apply_states([current], 1)
+
+
+def months_for_categories(category_ids):
+    """(year, month) pairs holding transactions in the given categories or their reporting children."""
+    return {
+        (d.year, d.month)
+        for d in Transaction.objects.filter(
+            Q(category_id__in=category_ids) | Q(category__reporting_category_id__in=category_ids)
+        ).dates('date', 'month')
+    }
+
+
+def months_for_source(source_id):
+    return {(d.year, d.month) for d in Transaction.objects.filter(source_id=source_id).dates('date', 'month')}
+
+
+def rollup_aggregate_queryset(transactions):
+    """Group a Transaction queryset into rollup buckets with one GROUP BY."""
+    return (
+        transactions.annotate(
+            rollup_year=ExtractYear('date'),
+            rollup_month=ExtractMonth('date'),
+            rollup_reporting_category_id=Coalesce('category__reporting_category_id', 'category_id'),
+            rollup_kind=Case(
+                When(CREDIT_CATEGORY_Q, then=Value(MonthlyRollup.KIND_CREDIT)),
+                When(INCOME_CATEGORY_Q, then=Value(MonthlyRollup.KIND_INCOME)),
+                default=Value(MonthlyRollup.KIND_SPEND),
+                output_field=CharField(),
+            ),
+        )
+        .values('rollup_year', 'rollup_month', 'rollup_reporting_category_id', 'source_id', 'rollup_kind')
+        .annotate(
+            total_amount=Sum('amount'),
+            total_reimbursement=Sum(Coalesce('reimbursement', Value(0, output_field=DecimalField()))),
+            total_count=Count('id'),
+        )
+        .order_by()
+    )
+
+
+def rebuild_rollups(months=None):
+    """Recompute rollup rows from raw transactions.
+    With months=None the whole table is rebuilt; otherwise only the given (year, month) pairs.
+    Returns the number of rollup rows written.
+    """
+    months = None if months is None else sorted(set(months))
+    with db_transaction.atomic():
+        if months is None:
+            MonthlyRollup.objects.all().delete()
+            transactions = Transaction.objects.all()
+        else:
+            if not months:
+                return 0
+            month_q = Q()
+            txn_q = Q()
+            for year, month in months:
+                start, end = month_date_range(year, month)
+                month_q |= Q(year=year, month=month)
+                txn_q |= Q(date__gte=start, date__lt=end)
+            MonthlyRollup.objects.filter(month_q).delete()
+            transactions = Transaction.objects.filter(txn_q)
+
+        rows = [
+            MonthlyRollup(
+                year=entry['rollup_year'],
+                month=entry['rollup_month'],
+                reporting_category_id=entry['rollup_reporting_category_id'],
+                source_id=entry['source_id'],
+                kind=entry['rollup_kind'],
+                amount=entry['total_amount'] or 0,
+                reimbursement=entry['total_reimbursement'] or 0,
+                row_count=entry['total_count'],
+            )
+            for entry in rollup_aggregate_queryset(transactions)
+        ]
+        MonthlyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rollups_between(start_year, start_month, end_year, end_month):
+    """Rollup rows for the inclusive month span (start_year, start_month) .. (end_year, end_month)."""
+    if start_year == end_year:
+        return MonthlyRollup.objects.filter(year=start_year, month__gte=start_month, month__lte=end_month)
+    return MonthlyRollup.objects.filter(
+        Q(year=start_year, month__gte=start_month) |
+        Q(year__gt=start_year, year__lt=end_year) |
+        Q(year=end_year, month__lte=end_month)
+    )
+
+
+def net_total():
+    """Sum expression for amount + reimbursement over rollup rows."""
+    return Coalesce(Sum(F('amount') + F('reimbursement')), Value(0, output_field=DecimalField()))
+
+
+def reporting_category_totals(rollups, kind, negate=False):
+    """Per reporting category net totals for one kind, shaped like annotate_reporting_category() output.
+    negate=True flips the sign so spending (stored negative) reads as a positive total.
+    """
+    return (
+        rollups.filter(kind=kind)
+        .values(
+            'reporting_category_id',
+            reporting_category_name=F('reporting_category__name'),
+            reporting_category_budget=F('reporting_category__budget'),
+        )
+        .annotate(total=net_total() * -1 if negate else net_total())
+        .order_by()
+    )
@@ -0,0 +1,208 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q, FloatField, BooleanField
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'tracker_transaction_fts'
+
+# FTS5 column weights for bm25(): description, notes, tags.
+FTS_WEIGHTS = (10.0, 2.0, 5.0)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Postgres: the same expression is used for the GIN index (migration 0022 keeps its own
+# copy) and for queries, so the planner can answer matches from the index.
+PG_DOCUMENT = (
+    "to_tsvector('simple', coalesce(tracker_transaction.description, '') || ' ' || "
+    "coalesce(tracker_transaction.notes, '') || ' ' || coalesce(tracker_transaction.tags, ''))"
+)
+
+SQLITE_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        description, notes, tags,
+        content='tracker_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON tracker_transaction BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, notes, tags)
+        VALUES (new.id, new.description, new.notes, new.tags);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON tracker_transaction BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes, tags)
+        VALUES ('delete', old.id, old.description, old.notes, old.tags);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF description, notes, tags ON tracker_transaction BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes, tags)
+        VALUES ('delete', old.id, old.description, old.notes, old.tags);
+        INSERT INTO {FTS_TABLE}(rowid, description, notes, tags)
+        VALUES (new.id, new.description, new.notes, new.tags);
+    END""",
+]
+
+SQLITE_TRIGGERS = (f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au")
+
+SQLITE_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+PG_INDEX = f"CREATE INDEX IF NOT EXISTS tracker_transaction_search_idx ON tracker_transaction USING GIN (({PG_DOCUMENT}))"
+
+
+def install_search_index(conn=None):
+    """Create (or recreate) the full-text index for the current database and fill it.
+
+    On SQLite this is an external-content FTS5 table kept in sync by triggers, so every
+    write path (save, delete, bulk_create, queryset.update) updates it. Django rebuilds
+    SQLite tables when some schema changes are applied, which drops the triggers;
+    repair_search_index() puts them back after every migrate. On Postgres it is a GIN
+    expression index, which the database maintains itself. Returns False when the backend
+    has no full-text support and searches fall back to LIKE.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            try:
+                for statement in SQLITE_TEARDOWN + SQLITE_SCHEMA:
+                    cursor.execute(statement)
+            except Exception:
+                # SQLite built without FTS5.
+                return False
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            _fts_tables[conn.settings_dict['NAME']] = True
+            return True
+        if conn.vendor == 'postgresql':
+            cursor.execute(PG_INDEX)
+            return True
+    return False
+
+
+def remove_search_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for statement in SQLITE_TEARDOWN:
+                cursor.execute(statement)
+            _fts_tables[conn.settings_dict['NAME']] = False
+        elif conn.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS tracker_transaction_search_idx")
+
+
+def _sqlite_objects(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE (type = 'table' AND name = %s) OR (type = 'trigger' AND tbl_name = %s)",
+            [FTS_TABLE, 'tracker_transaction'],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def repair_search_index(conn=None):
+    """Reinstall the SQLite full-text index when its table exists but a sync trigger is
+    missing, which happens when a migration rebuilds tracker_transaction. Rows written
+    meanwhile are picked up by the reinstall's rebuild. Returns True if it was repaired."""
+    conn = conn or connection
+    if conn.vendor != 'sqlite':
+        return False
+    existing = _sqlite_objects(conn)
+    if FTS_TABLE not in existing or existing.issuperset(SQLITE_TRIGGERS):
+        return False
+    return install_search_index(conn)
+
+
+def repair_search_index_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate receiver, connected in TrackerConfig.ready(). Migrations may have created
+    or dropped the FTS table, so the cached check is redone."""
+    conn = connections[using]
+    _fts_tables.pop(conn.settings_dict['NAME'], None)
+    repair_search_index(conn)
+
+
+# Whether each SQLite database has the FTS table, keyed by database name. Checked once per
+# process; install_search_index() and remove_search_index() keep it current.
+_fts_tables = {}
+
+
+def _has_fts_table():
+    if connection.vendor != 'sqlite':
+        return connection.vendor == 'postgresql'
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        _fts_tables[name] = FTS_TABLE in _sqlite_objects(connection)
+    return _fts_tables[name]
+
+
+def search_terms(query):
+    return TERM_RE.findall(query or '')
+
+
+def _fts_match(terms):
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def _pg_tsquery(terms):
+    return ' & '.join(f"{term}:*" for term in terms)
+
+
+def search_transactions(queryset, query):
+    """Filter a Transaction queryset to rows matching every word of `query`, each treated as
+    a prefix ('net' matches 'Netflix'), across description, notes and tags.
+
+    The match is a subquery against the full-text index, so it combines with any other
+    filters on the queryset and keeps its ordering.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+
+    if connection.vendor == 'sqlite' and _has_fts_table():
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [_fts_match(terms)],
+        ))
+
+    if connection.vendor == 'postgresql':
+        return queryset.annotate(search_match=RawSQL(
+            f"{PG_DOCUMENT} @@ to_tsquery('simple', %s)", [_pg_tsquery(terms)], output_field=BooleanField(),
+        )).filter(search_match=True)
+
+    for term in terms:
+        queryset = queryset.filter(
+            Q(description__icontains=term) | Q(notes__icontains=term) | Q(tags__icontains=term)
+        )
+    return queryset
+
+
+def ranked_ids(matches, query):
+    """Ids of the rows of `matches` (a queryset already filtered by search_transactions) in
+    order of relevance to `query`, newest first on ties.
+
+    On SQLite the matches are scored once with bm25() and the filtered ids sorted in Python:
+    a per-row rank subquery leaves the join order to the planner, which picks a per-row
+    MATCH as soon as the other filters look selective. Without full-text support every
+    match ranks equally.
+    """
+    terms = search_terms(query)
+    if terms and connection.vendor == 'postgresql':
+        return list(
+            matches.annotate(search_rank=RawSQL(
+                f"ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s))", [_pg_tsquery(terms)], output_field=FloatField(),
+            )).order_by('-search_rank', '-date', '-id').values_list('id', flat=True)
+        )
+
+    rows = matches.order_by().values_list('id', 'date')
+    if terms and connection.vendor == 'sqlite' and _has_fts_table():
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        with connection.cursor() as cursor:
+            # bm25() is lower for better matches.
+            cursor.execute(
+                f"SELECT rowid, bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                [_fts_match(terms)],
+            )
+            scores = dict(cursor.fetchall())
+        ordered = sorted(rows, key=lambda row: (scores.get(row[0], 0.0), -row[1].toordinal(), -row[0]))
+    else:
+        ordered = sorted(rows, key=lambda row: (row[1], row[0]), reverse=True)
+    return [row_id for row_id, _ in ordered]
@@ -0,0 +1,149 @@
+"""
+Keeps derived ledger tables (rollups, daily rollups, month cache, spend index, tags) and cached
+results in step with writes to Transaction, Category and Source.
+Receivers run inside the model's save()/delete() transaction.
+"""
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Transaction, Category, Source, RecurringTransaction, RewardCategory, DismissedSuggestion
+from . import rollups, month_cache, spend_index, recurring, recurring_detector, tags, reward_rates, insights, range_ledger
+
+
+def _state_months(*states):
+    return {(state['date'].year, state['date'].month) for state in states if state is not None}
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_state(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._rollup_previous = rollups.rollup_state(instance.pk)
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    current = rollups.rollup_state(instance.pk)
+    rollups.transaction_changed(previous, current)
+    insights.transaction_changed(previous, current)
+    range_ledger.transaction_changed(previous, current)
+    spend_index.transaction_changed(previous, current)
+    month_cache.invalidate_months(_state_months(previous, current))
+    if instance.tags or not created:
+        tags.sync_transaction_tags(instance.pk, instance.tags, current['date'])
+
+
+@receiver(pre_delete, sender=Transaction)
+def remember_deleted_transaction_state(sender, instance, **kwargs):
+    instance._rollup_previous = rollups.rollup_state(instance.pk)
+    instance._tag_ids = tags.transaction_tag_ids(instance.pk)
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    previous = getattr(instance, '_rollup_previous', None)
+    rollups.transaction_changed(previous, None)
+    insights.transaction_changed(previous, None)
+    range_ledger.transaction_changed(previous, None)
+    spend_index.transaction_changed(previous, None)
+    month_cache.invalidate_months(_state_months(previous))
+    tags.transaction_removed(getattr(instance, '_tag_ids', []))
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_state(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        instance._previous_classification = None
+        return
+    instance._previous_classification = (
+        Category.objects.filter(pk=instance.pk).values_list('name', 'reporting_category_id').first()
+    )
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_classification', None)
+    if raw or previous is None:
+        return
+    previous_name, previous_reporting_id = previous
+    if previous_name == instance.name and previous_reporting_id == instance.reporting_category_id:
+        return
+    # The category (and, through its name, its reporting children) may have moved to a
+    # different reporting bucket or kind; re-aggregate every month it touches.
+    affected_months = rollups.months_for_categories([instance.pk])
+    rollups.rebuild_rollups(affected_months)
+    range_ledger.rebuild_daily_rollups(affected_months)
+    month_cache.invalidate_months(affected_months)
+    insights.invalidate_spend_matrix()
+    range_ledger.invalidate_daily_ledger()
+    # Renaming can also move it in or out of the income/credit/rent exclusions.
+    spend_index.rebuild_spend_index(spend_index.sources_for_categories([instance.pk]))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_months(sender, instance, **kwargs):
+    instance._affected_months = rollups.months_for_categories([instance.pk])
+    instance._affected_sources = spend_index.sources_for_categories([instance.pk])
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    affected_months = getattr(instance, '_affected_months', set())
+    rollups.rebuild_rollups(affected_months)
+    range_ledger.rebuild_daily_rollups(affected_months)
+    month_cache.invalidate_months(affected_months)
+    insights.invalidate_spend_matrix()
+    range_ledger.invalidate_daily_ledger()
+    spend_index.rebuild_spend_index(getattr(instance, '_affected_sources', set()))
+
+
+@receiver(pre_delete, sender=Source)
+def remember_source_months(sender, instance, **kwargs):
+    instance._affected_months = rollups.months_for_source(instance.pk)
+
+
+@receiver(post_delete, sender=Source)
+def source_deleted(sender, instance, **kwargs):
+    rollups.rebuild_rollups(getattr(instance, '_affected_months', set()))
+
+
+@receiver(post_save, sender=Source)
+def source_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # The signup bonus terms may have changed; re-derive the award date from the index.
+    spend_index.refresh_signup_bonuses({instance.pk})
+
+
+@receiver(pre_save, sender=RecurringTransaction)
+def schedule_recurring_transaction(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    recurring.refresh_next_due(instance)
+
+
+@receiver(post_save, sender=Source)
+@receiver(post_delete, sender=Source)
+@receiver(post_save, sender=RewardCategory)
+@receiver(post_delete, sender=RewardCategory)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reward_config_changed(sender, **kwargs):
+    reward_rates.invalidate_reward_rates()
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=RecurringTransaction)
+@receiver(post_delete, sender=RecurringTransaction)
+@receiver(post_save, sender=DismissedSuggestion)
+@receiver(post_delete, sender=DismissedSuggestion)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Source)
+@receiver(post_delete, sender=Source)
+def recurring_candidates_changed(sender, **kwargs):
+    recurring_detector.invalidate_suggestions()
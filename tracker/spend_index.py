@@ -0,0 +1,210 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import Q, F, Sum
+from django.db.models.functions import Abs
+
+from .models import Category, Transaction, Source, SourceSpendIndex, MonthlyRollup
+from .rollups import CREDIT_CATEGORY_Q, INCOME_CATEGORY_Q, classify_category
+
+ZERO = Decimal('0')
+
+RENT_CATEGORY_Q = Q(category__name__icontains='rent') | Q(category__reporting_category__name__icontains='rent')
+
+
+def is_bonus_spend(state):
+    """Whether a transaction state (see rollups.rollup_state) counts towards a signup bonus:
+    spend on a card that is not income, a credit, or rent."""
+    if state is None or state['source_id'] is None:
+        return False
+    name, reporting_name = state['category__name'], state['category__reporting_category__name']
+    if classify_category(name, reporting_name) != MonthlyRollup.KIND_SPEND:
+        return False
+    return 'rent' not in (name or '').lower() and 'rent' not in (reporting_name or '').lower()
+
+
+def daily_spend_queryset(transactions):
+    """Qualifying spend per (source, date), each transaction counted by its absolute amount."""
+    return (
+        transactions.filter(source__isnull=False)
+        .exclude(INCOME_CATEGORY_Q)
+        .exclude(CREDIT_CATEGORY_Q)
+        .exclude(RENT_CATEGORY_Q)
+        .values('source_id', 'date')
+        .annotate(total=Sum(Abs('amount')))
+        .order_by('source_id', 'date')
+    )
+
+
+def cumulative_rows(entries):
+    """Turn daily_spend_queryset() rows into (source_id, date, spend, cumulative_spend) tuples."""
+    running = defaultdict(lambda: ZERO)
+    for entry in entries:
+        spend = entry['total'] or ZERO
+        if spend <= 0:
+            continue
+        running[entry['source_id']] += spend
+        yield entry['source_id'], entry['date'], spend, running[entry['source_id']]
+
+
+def bonus_met_on(source_id, min_spend):
+    """First date the source's cumulative qualifying spend reached min_spend, or None.
+    cumulative_spend is monotonic per source, so this is a binary search down the
+    (source, cumulative_spend) index rather than a walk over the source's history.
+    """
+    return (
+        SourceSpendIndex.objects.filter(source_id=source_id, cumulative_spend__gte=min_spend)
+        .order_by('cumulative_spend', 'date')
+        .values_list('date', flat=True)
+        .first()
+    )
+
+
+def refresh_signup_bonuses(source_ids=None):
+    """Recompute signup_bonus_awarded_on for sources with a bonus configured.
+    With source_ids=None every such source is refreshed.
+    """
+    if source_ids is not None and not source_ids:
+        return
+    sources = Source.objects.filter(signup_bonus_miles__gt=0, signup_bonus_min_spend__gt=0)
+    if source_ids is not None:
+        sources = sources.filter(pk__in=source_ids)
+    for source_id, min_spend, awarded_on in sources.values_list('pk', 'signup_bonus_min_spend', 'signup_bonus_awarded_on'):
+        met_on = bonus_met_on(source_id, min_spend)
+        if met_on != awarded_on:
+            # update() rather than save(): this runs from Source's own post_save receiver.
+            Source.objects.filter(pk=source_id).update(signup_bonus_awarded_on=met_on)
+
+
+def _apply_delta(source_id, day, delta):
+    updated = SourceSpendIndex.objects.filter(source_id=source_id, date=day).update(spend=F('spend') + delta)
+    if not updated:
+        prior = (
+            SourceSpendIndex.objects.filter(source_id=source_id, date__lt=day)
+            .order_by('-date')
+            .values_list('cumulative_spend', flat=True)
+            .first()
+        )
+        SourceSpendIndex.objects.create(source_id=source_id, date=day, spend=delta, cumulative_spend=prior or ZERO)
+    SourceSpendIndex.objects.filter(source_id=source_id, date__gte=day).update(
+        cumulative_spend=F('cumulative_spend') + delta
+    )
+    SourceSpendIndex.objects.filter(source_id=source_id, date=day, spend__lte=0).delete()
+
+
+def transaction_changed(previous, current):
+    """Move a transaction's qualifying spend from its previous state to its current one and
+    refresh the award date of any source whose running total changed."""
+    deltas = defaultdict(lambda: ZERO)
+    for state, sign in ((previous, -1), (current, 1)):
+        if is_bonus_spend(state):
+            deltas[(state['source_id'], state['date'])] += abs(Decimal(state['amount'] or 0)) * sign
+
+    changed_sources = set()
+    for (source_id, day), delta in deltas.items():
+        if delta:
+            _apply_delta(source_id, day, delta)
+            changed_sources.add(source_id)
+    refresh_signup_bonuses(changed_sources)
+
+
+def _apply_deltas(deltas):
+    """Apply {(source_id, date): delta} to the index in one pass per source.
+
+    Only the source's rows from its earliest changed day onward are read; their spend and
+    running totals are recomputed in memory and written back with bulk updates. Returns
+    the ids of the sources that changed.
+    """
+    by_source = defaultdict(lambda: defaultdict(lambda: ZERO))
+    for (source_id, day), delta in deltas.items():
+        if delta:
+            by_source[source_id][day] += delta
+
+    for source_id, days in by_source.items():
+        first_day = min(days)
+        running = (
+            SourceSpendIndex.objects.filter(source_id=source_id, date__lt=first_day)
+            .order_by('-date')
+            .values_list('cumulative_spend', flat=True)
+            .first()
+        ) or ZERO
+        existing = {
+            row.date: row for row in SourceSpendIndex.objects.filter(source_id=source_id, date__gte=first_day)
+        }
+        updated, created, removed = [], [], []
+        for day in sorted(existing.keys() | days.keys()):
+            row = existing.get(day)
+            spend = (row.spend if row else ZERO) + days.get(day, ZERO)
+            if spend <= 0:
+                if row:
+                    removed.append(row.pk)
+                continue
+            running += spend
+            if row is None:
+                created.append(SourceSpendIndex(source_id=source_id, date=day, spend=spend, cumulative_spend=running))
+            elif row.spend != spend or row.cumulative_spend != running:
+                row.spend, row.cumulative_spend = spend, running
+                updated.append(row)
+        SourceSpendIndex.objects.bulk_update(updated, ['spend', 'cumulative_spend'], batch_size=1000)
+        SourceSpendIndex.objects.bulk_create(created, batch_size=1000)
+        SourceSpendIndex.objects.filter(pk__in=removed).delete()
+    return set(by_source)
+
+
+def spend_deltas(transactions, deltas=None):
+    """Accumulate the qualifying spend of Transaction instances into {(source_id, date): delta}.
+    Used for rows written with bulk_create, which skips the save signals."""
+    deltas = {} if deltas is None else deltas
+    transactions = [txn for txn in transactions if txn.source_id]
+    category_names = {
+        pk: (name, reporting_name)
+        for pk, name, reporting_name in Category.objects.filter(
+            pk__in={txn.category_id for txn in transactions if txn.category_id}
+        ).values_list('pk', 'name', 'reporting_category__name')
+    }
+    for txn in transactions:
+        name, reporting_name = category_names.get(txn.category_id, (None, None))
+        state = {'source_id': txn.source_id, 'category__name': name, 'category__reporting_category__name': reporting_name}
+        if is_bonus_spend(state):
+            key = (txn.source_id, txn.date)
+            deltas[key] = deltas.get(key, ZERO) + abs(Decimal(txn.amount))
+    return deltas
+
+
+def apply_spend_deltas(deltas):
+    """Apply spend_deltas() output to the index and refresh the award date of every source
+    whose running total changed."""
+    refresh_signup_bonuses(_apply_deltas(deltas))
+
+
+def sources_for_categories(category_ids):
+    """Sources with transactions in the given categories or their reporting children."""
+    return set(
+        Transaction.objects.filter(
+            Q(category_id__in=category_ids) | Q(category__reporting_category_id__in=category_ids),
+            source__isnull=False,
+        ).values_list('source_id', flat=True).distinct()
+    )
+
+
+def rebuild_spend_index(source_ids=None):
+    """Recompute the index from raw transactions, for every source or only the given ones.
+    Returns the number of index rows written.
+    """
+    with db_transaction.atomic():
+        if source_ids is None:
+            SourceSpendIndex.objects.all().delete()
+            transactions = Transaction.objects.all()
+        else:
+            if not source_ids:
+                return 0
+            SourceSpendIndex.objects.filter(source_id__in=source_ids).delete()
+            transactions = Transaction.objects.filter(source_id__in=source_ids)
+        rows = [
+            SourceSpendIndex(source_id=source_id, date=day, spend=spend, cumulative_spend=cumulative)
+            for source_id, day, spend, cumulative in cumulative_rows(daily_spend_queryset(transactions))
+        ]
+        SourceSpendIndex.objects.bulk_create(rows, batch_size=1000)
+        refresh_signup_bonuses(source_ids)
+    return len(rows)
@@ -0,0 +1,120 @@
+import re
+from collections import Counter, defaultdict
+
+from django.db.models import F, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce, ExtractYear, ExtractMonth
+
+from .models import Category, MonthlyRollup, Tag, TransactionTag
+from .rollups import classify_category
+
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+FACET_LIMIT = 20
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_tag(name):
+    """Lowercase, trim, drop a leading '#' and collapse inner whitespace: ' #Road  Trip' -> 'road trip'."""
+    name = WHITESPACE_RE.sub(' ', (name or '').strip().lstrip('#').strip().lower())
+    return name[:TAG_MAX_LENGTH]
+
+
+def parse_tags(text):
+    """Distinct normalised tags of a comma-separated tags string, in their original order."""
+    tags = []
+    for part in (text or '').split(','):
+        name = normalize_tag(part)
+        if name and name not in tags:
+            tags.append(name)
+    return tags
+
+
+def _tag_ids(names):
+    """name -> id for every name, creating the missing tags in one bulk insert."""
+    ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = set(names) - ids.keys()
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in sorted(missing)], ignore_conflicts=True)
+        ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+def _adjust_counts(deltas):
+    for tag_id, delta in deltas.items():
+        if delta:
+            Tag.objects.filter(pk=tag_id).update(transaction_count=F('transaction_count') + delta)
+
+
+def sync_transaction_tags(transaction_id, text, txn_date):
+    """Bring one transaction's TransactionTag rows and the tag counts in line with its tags text."""
+    wanted = parse_tags(text)
+    existing = {
+        link['tag__name']: link
+        for link in TransactionTag.objects.filter(transaction_id=transaction_id).values('id', 'tag_id', 'tag__name', 'date')
+    }
+    if not wanted and not existing:
+        return
+
+    deltas = Counter()
+    removed = [link for name, link in existing.items() if name not in wanted]
+    if removed:
+        TransactionTag.objects.filter(pk__in=[link['id'] for link in removed]).delete()
+        deltas.update({link['tag_id']: -1 for link in removed})
+
+    added = [name for name in wanted if name not in existing]
+    if added:
+        ids = _tag_ids(added)
+        TransactionTag.objects.bulk_create([
+            TransactionTag(transaction_id=transaction_id, tag_id=ids[name], date=txn_date) for name in added
+        ])
+        deltas.update({ids[name]: 1 for name in added})
+
+    moved = [link['id'] for name, link in existing.items() if name in wanted and link['date'] != txn_date]
+    if moved:
+        TransactionTag.objects.filter(pk__in=moved).update(date=txn_date)
+    _adjust_counts(deltas)
+
+
+def transaction_tag_ids(transaction_id):
+    return list(TransactionTag.objects.filter(transaction_id=transaction_id).values_list('tag_id', flat=True))
+
+
+def transaction_removed(tag_ids):
+    """Decrement the counts of the tags a deleted transaction carried (its links cascade away)."""
+    _adjust_counts(Counter({tag_id: -1 for tag_id in tag_ids}))
+
+
+def tag_facets(limit=FACET_LIMIT):
+    """The most used tags with their transaction counts, read from the Tag table."""
+    return list(Tag.objects.filter(transaction_count__gt=0).order_by('-transaction_count', 'name')[:limit])
+
+
+def _non_spend_category_ids():
+    return [
+        row['id']
+        for row in Category.objects.values('id', 'name', 'reporting_category__name')
+        if classify_category(row['name'], row['reporting_category__name']) != MonthlyRollup.KIND_SPEND
+    ]
+
+
+def tag_monthly_spend(names, start, end):
+    """Spend per tag per month over [start, end), as {tag name: [(year, month, spend), ...]}.
+
+    Rows are found through the (tag, date) index; income and credit categories are left
+    out as in the rollups, and spend is reported as a positive amount net of reimbursement.
+    """
+    rows = (
+        TransactionTag.objects.filter(tag__name__in=names, date__gte=start, date__lt=end)
+        .exclude(transaction__category_id__in=_non_spend_category_ids())
+        .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('tag__name', 'year', 'month')
+        .annotate(spend=Sum(
+            F('transaction__amount') + Coalesce('transaction__reimbursement', Value(0, output_field=DecimalField()))
+        ))
+        .order_by('tag__name', 'year', 'month')
+    )
+    totals = defaultdict(list)
+    for row in rows:
+        totals[row['tag__name']].append((row['year'], row['month'], -(row['spend'] or 0)))
+    return dict(totals)
+
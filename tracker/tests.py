@@ -1,3 +1,1823 @@
-from django.test import TestCase
+import calendar
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from statistics import mean, pstdev
+from types import SimpleNamespace
+from unittest import skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.test import TestCase, TransactionTestCase
+
+from .aggregation import daily_totals, period_totals
+from .cache_versions import bump_version
+from .csv_import import STAGING_MAX_AGE, _staging_path, discard_staged, import_staged, stage_upload, staged_rows
+from .duplicates import (
+    NEAR_DUPLICATE_AMOUNT_TOLERANCE, NEAR_DUPLICATE_DAYS, NEAR_DUPLICATE_SIMILARITY, NearDuplicateIndex,
+    description_profile, find_near_duplicates, profile_similarity,
+)
+from .insights import ANOMALY_MIN_INCREASE, ANOMALY_Z_SCORE, SpendMatrix, spend_matrix, spending_anomalies
+from .models import (
+    Category, DailyRollup, DismissedSuggestion, GoalContribution, Month, MonthlyRollup, RecurringTransaction,
+    RewardCategory, SavingsGoal, Source, SourceSpendIndex, Tag, Transaction, TransactionTag,
+)
+from .month_cache import get_month_summary
+from .pagination import keyset_page
+from .projection import projected_month_spend
+from .range_ledger import DailyLedger, daily_ledger, range_report, rebuild_daily_rollups
+from .recurring import (
+    add_months, expand_occurrences, generate_due_transactions, generation_due, get_next_occurrence, upcoming_recurring,
+)
+from .recurring_detector import SUGGESTIONS_VERSION, detect_recurring_patterns
+from .reward_rates import (
+    BLANKET_MULTIPLIERS, build_card_recommendations, card_recommendations, comparison_value, format_rate_label,
+    CONFIG_VERSION, get_better_card_tip, reward_config_version,
+)
+from .rewards import SpendMatrix as RewardsSpendMatrix, build_rewards_summary, quarter_label
+from .rollups import (
+    CREDIT_CATEGORY_Q, INCOME_CATEGORY_Q, ROLLUP_FIELDS, classify_category, month_date_range, rebuild_rollups,
+    rollup_key,
+)
+from .search import FTS_TABLE, SQLITE_TRIGGERS, _sqlite_objects, repair_search_index, search_transactions
+from .spend_index import RENT_CATEGORY_Q, rebuild_spend_index, refresh_signup_bonuses
+from .tags import parse_tags, tag_facets, tag_monthly_spend
+from .views import _allocate_in_order, annotate_net_amount, annotate_reporting_category, year_date_range
+
+
+@skipUnless(connection.vendor == 'sqlite', "Query plans are asserted against SQLite's EXPLAIN QUERY PLAN output")
+class TransactionIndexPlanTests(TestCase):
+    """
+    The report views filter Transaction by date ranges, optionally combined with
+    source, category, description or recurring_source. Each of those paths should
+    be answered by an index search rather than a full table scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Groceries', budget=400)
+        cls.source = Source.objects.create(name='Visa')
+        cls.recurring = RecurringTransaction.objects.create(
+            description='Rent', amount=-1500, start_date=date(2024, 1, 1),
+        )
+        Transaction.objects.bulk_create([
+            Transaction(
+                date=date(2024, (i % 12) + 1, (i % 28) + 1),
+                description=f'Store {i % 7}',
+                amount=-10 - i,
+                category=cls.category,
+                source=cls.source,
+            )
+            for i in range(200)
+        ])
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'SEARCH tracker_transaction USING (COVERING )?INDEX', plan)
+        self.assertNotIn('SCAN tracker_transaction', plan, plan)
+
+    def test_month_range_uses_date_index(self):
+        start, end = month_date_range(2024, 3)
+        self.assertUsesIndex(Transaction.objects.filter(date__gte=start, date__lt=end))
+
+    def test_source_year_uses_source_date_index(self):
+        start, end = year_date_range(2024)
+        self.assertUsesIndex(
+            Transaction.objects.filter(source=self.source, date__gte=start, date__lt=end)
+        )
+
+    def test_category_range_uses_category_date_index(self):
+        start, end = month_date_range(2024, 6)
+        self.assertUsesIndex(
+            Transaction.objects.filter(category=self.category, date__gte=start, date__lt=end)
+        )
+
+    def test_description_lookup_uses_description_date_index(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(description='Store 3', recurring_source__isnull=True).order_by('date')
+        )
+
+    def test_recurring_source_lookup_uses_recurring_source_date_index(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(recurring_source=self.recurring).order_by('date')
+        )
+
+    def test_keyset_page_seeks_date_index_without_sorting(self):
+        cursor = Q(date__lte=date(2024, 6, 15)), Q(date__lt=date(2024, 6, 15)) | Q(id__lt=100)
+        queryset = Transaction.objects.filter(*cursor).order_by('-date', '-id')[:26]
+        self.assertUsesIndex(queryset)
+        self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+    def test_upcoming_recurring_seeks_next_due_index(self):
+        self.assertEqual(self.recurring.next_due, date(2024, 1, 1))
+        plan = upcoming_recurring(today=date(2024, 1, 1), days=30).explain()
+        self.assertIn('SEARCH tracker_recurringtransaction USING INDEX recurring_active_next_due', plan, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+def _rollup_snapshot():
+    """{bucket: (amount, reimbursement, row_count)} with emptied buckets left out."""
+    return {
+        (row.year, row.month, row.reporting_category_id, row.source_id, row.kind):
+            (row.amount, row.reimbursement, row.row_count)
+        for row in MonthlyRollup.objects.all()
+        if row.amount or row.reimbursement or row.row_count
+    }
+
+
+def _direct_rollups():
+    """The rollup buckets summed straight from Transaction with classify_category()."""
+    buckets = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+    for state in Transaction.objects.values(*ROLLUP_FIELDS):
+        bucket = buckets[rollup_key(state)]
+        bucket[0] += state['amount']
+        bucket[1] += state['reimbursement'] or 0
+        bucket[2] += 1
+    return {key: tuple(value) for key, value in buckets.items()}
+
+
+class MonthlyRollupTests(TestCase):
+    """The signal-maintained rollup table should always equal a fresh aggregation of the ledger."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.income = Category.objects.create(name='Income')
+        cls.salary = Category.objects.create(name='Salary', reporting_category=cls.income)
+        cls.food = Category.objects.create(name='Food', budget=500)
+        cls.dining = Category.objects.create(name='Dining', reporting_category=cls.food)
+        cls.cash = Category.objects.create(name='card-cash-visa')
+        cls.visa = Source.objects.create(name='Visa')
+        cls.amex = Source.objects.create(name='Amex')
+        for i, category in enumerate([cls.salary, cls.food, cls.dining, cls.cash, None] * 4):
+            Transaction.objects.create(
+                date=date(2024, i % 3 + 1, i + 1), description=f'Row {i}',
+                amount=2000 if category == cls.salary else -10 - i,
+                reimbursement=3 if i % 5 == 2 else 0,
+                category=category, source=cls.visa if i % 2 else cls.amex,
+            )
+
+    def assertRollupsCurrent(self):
+        self.assertEqual(_rollup_snapshot(), _direct_rollups())
+
+    def test_creates_match_direct_aggregation(self):
+        self.assertRollupsCurrent()
+        rebuild_rollups()
+        self.assertRollupsCurrent()
+
+    def test_edits_and_deletes_move_buckets(self):
+        txn = Transaction.objects.filter(category=self.dining).first()
+        txn.amount = -99
+        txn.date = date(2023, 12, 31)
+        txn.category = self.cash
+        txn.source = None
+        txn.save()
+        Transaction.objects.filter(category=self.food).first().delete()
+        self.assertRollupsCurrent()
+
+    def test_category_rename_rebuckets_kind(self):
+        self.food.name = 'credit-food'
+        self.food.save()
+        self.assertRollupsCurrent()
+
+    def test_reporting_category_change_rebuckets(self):
+        self.dining.reporting_category = None
+        self.dining.save()
+        self.assertRollupsCurrent()
+        self.salary.reporting_category = self.food
+        self.salary.save()
+        self.assertRollupsCurrent()
+
+    def test_category_delete_rebuckets_uncategorised(self):
+        self.food.delete()
+        self.income.delete()
+        self.assertRollupsCurrent()
+
+    def test_source_delete_rebuckets(self):
+        self.visa.delete()
+        self.assertRollupsCurrent()
+
+
+def _migration(name):
+    return import_module(f'tracker.migrations.{name}')
+
+
+class DataMigrationTests(TestCase):
+    """The data migrations keep their own copy of the logic that fills the derived tables, so
+    later changes to the app cannot alter them. Run against the current schema, they must
+    still derive what the app does."""
+
+    @classmethod
+    def setUpTestData(cls):
+        income = Category.objects.create(name='Income')
+        categories = [
+            income, Category.objects.create(name='Salary', reporting_category=income),
+            Category.objects.create(name='Food'), Category.objects.create(name='Rent'),
+            Category.objects.create(name='card-cash-visa'), None,
+        ]
+        sources = [
+            Source.objects.create(name='Visa', signup_bonus_miles=50000, signup_bonus_min_spend=300),
+            Source.objects.create(name='Amex'), None,
+        ]
+        rng = random.Random(17)
+        Transaction.objects.bulk_create([
+            Transaction(
+                date=date(2024, 1, 1) + timedelta(days=rng.randint(0, 90)), description='Seeded',
+                amount=Decimal(rng.randint(-9000, 3000)) / 100, reimbursement=Decimal(rng.choice([0, 0, 150])) / 100,
+                category=rng.choice(categories), source=rng.choice(sources), tags=rng.choice(['', 'Trip', '#trip, Food ']),
+            )
+            for _ in range(200)
+        ])
+
+    def test_monthly_rollups(self):
+        rebuild_rollups()
+        expected = _rollup_snapshot()
+        MonthlyRollup.objects.all().delete()
+        _migration('0019_monthlyrollup').populate_rollups(django_apps, None)
+        self.assertEqual(_rollup_snapshot(), expected)
+
+    def test_spend_index_and_bonus_dates(self):
+        def snapshot():
+            return (
+                list(SourceSpendIndex.objects.values_list('source_id', 'date', 'spend', 'cumulative_spend')),
+                list(Source.objects.order_by('pk').values_list('signup_bonus_awarded_on', flat=True)),
+            )
+
+        rebuild_spend_index()
+        expected = snapshot()
+        self.assertIsNotNone(expected[1][0])
+        SourceSpendIndex.objects.all().delete()
+        Source.objects.update(signup_bonus_awarded_on=None)
+        _migration('0021_source_spend_index').populate_spend_index(django_apps, None)
+        self.assertEqual(snapshot(), expected)
+
+    def test_recurring_next_due(self):
+        rng = random.Random(21)
+        rules = _random_rules(rng, 60)
+        for rule in rules[::3]:
+            rule.last_generated = rule.start_date + timedelta(days=rng.randint(0, 200))
+            rule.save()
+        expected = dict(RecurringTransaction.objects.values_list('pk', 'next_due'))
+        self.assertTrue(any(expected.values()) and not all(expected.values()))
+        RecurringTransaction.objects.update(next_due=None)
+        _migration('0024_recurring_next_due').populate_next_due(django_apps, None)
+        self.assertEqual(dict(RecurringTransaction.objects.values_list('pk', 'next_due')), expected)
+
+    def test_daily_rollups(self):
+        rebuild_daily_rollups()
+        expected = _daily_rollup_snapshot()
+        DailyRollup.objects.all().delete()
+        _migration('0026_dailyrollup').populate_daily_rollups(django_apps, None)
+        self.assertEqual(_daily_rollup_snapshot(), expected)
+
+    def test_tag_links(self):
+        # The seed is bulk-created, so no links exist until the migration derives them.
+        _migration('0023_transaction_tags').populate_tags(django_apps, None)
+        rows = Transaction.objects.values_list('id', 'tags', 'date')
+        links = {(txn_id, name, txn_date) for txn_id, text, txn_date in rows for name in parse_tags(text)}
+        self.assertEqual(set(TransactionTag.objects.values_list('transaction_id', 'tag__name', 'date')), links)
+        counts = defaultdict(int)
+        for _, name, _ in links:
+            counts[name] += 1
+        self.assertEqual(dict(Tag.objects.values_list('name', 'transaction_count')), dict(counts))
+        self.assertEqual(set(counts), {'trip', 'food'})
+
+
+class MonthCacheTests(TestCase):
+    """Cached Month rows should be dropped for exactly the months a write touches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.income = Category.objects.create(name='Income')
+        cls.food = Category.objects.create(name='Food')
+        cls.cash = Category.objects.create(name='card-cash-visa')
+        for i in range(30):
+            Transaction.objects.create(
+                date=date(2024, i % 2 + 3, i % 28 + 1), description=f'Row {i}',
+                amount=1500 if i % 10 == 0 else -5 - i, reimbursement=2 if i % 7 == 0 else 0,
+                category=[cls.income, cls.food, cls.cash, None][i % 4] if i % 10 else cls.income,
+            )
+
+    def expected(self, year, month):
+        """(cumulative daily spend, income) computed row by row, as the uncached report did."""
+        by_day = defaultdict(Decimal)
+        income = Decimal('0')
+        start, end = month_date_range(year, month)
+        for state in Transaction.objects.filter(date__gte=start, date__lt=end).values(*ROLLUP_FIELDS):
+            net = state['amount'] + (state['reimbursement'] or 0)
+            kind = rollup_key(state)[4]
+            if kind == MonthlyRollup.KIND_INCOME:
+                income += net
+            elif kind == MonthlyRollup.KIND_SPEND:
+                by_day[state['date'].day] -= net
+        series, cumulative = [], Decimal('0')
+        for day in range(1, 32):
+            cumulative += by_day[day]
+            series.append(float(cumulative))
+        return series, income
+
+    def assertSummaryCurrent(self, year, month):
+        summary = get_month_summary(year, month)
+        series, income = self.expected(year, month)
+        self.assertEqual(summary.daily_spend, series)
+        self.assertEqual(summary.total_income, income)
+
+    def test_summary_matches_rows_and_is_cached(self):
+        self.assertSummaryCurrent(2024, 3)
+        self.assertTrue(Month.objects.filter(name='2024-03').exists())
+        self.assertSummaryCurrent(2024, 4)
+
+    def test_write_invalidates_only_touched_months(self):
+        get_month_summary(2024, 3)
+        get_month_summary(2024, 4)
+        get_month_summary(2024, 5)
+        txn = Transaction.objects.filter(date__month=4, category=self.food).first()
+        txn.date = date(2024, 3, 30)
+        txn.save()
+        self.assertEqual(set(Month.objects.values_list('name', flat=True)), {'2024-05'})
+        self.assertSummaryCurrent(2024, 3)
+        self.assertSummaryCurrent(2024, 4)
+
+    def test_category_rename_and_delete_invalidate(self):
+        get_month_summary(2024, 3)
+        self.food.name = 'Income Extra'
+        self.food.reporting_category = self.income
+        self.food.save()
+        self.assertSummaryCurrent(2024, 3)
+        self.income.delete()
+        self.assertSummaryCurrent(2024, 3)
+        Transaction.objects.filter(date__month=3).first().delete()
+        self.assertSummaryCurrent(2024, 3)
+
+
+def _seed_ledger(start=date(2023, 11, 1), days=240, seed=1):
+    """Categories of every kind, two cards and a few hundred seeded transactions from `start`."""
+    rng = random.Random(seed)
+    income = Category.objects.create(name='Income')
+    categories = {
+        'income': income,
+        'salary': Category.objects.create(name='Salary', reporting_category=income),
+        'food': Category.objects.create(name='Food', budget=500),
+        'rent': Category.objects.create(name='Rent', budget=1500),
+        'cash': Category.objects.create(name='card-cash-visa'),
+    }
+    categories['dining'] = Category.objects.create(name='Dining', reporting_category=categories['food'])
+    sources = [Source.objects.create(name='Visa'), Source.objects.create(name='Amex')]
+    rows = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        for key in ('salary', 'food', 'dining', 'rent', 'cash', None):
+            if rng.random() < 0.35:
+                amount = rng.randint(1000, 3000) if key == 'salary' else -rng.randint(5, 120)
+                rows.append(Transaction(
+                    date=day, description=f'{key} {rng.randint(1, 5)}', amount=amount,
+                    reimbursement=rng.choice([0, 0, 0, 4]), category=categories.get(key),
+                    source=rng.choice(sources + [None]),
+                ))
+    Transaction.objects.bulk_create(rows)
+    rebuild_rollups()
+    rebuild_daily_rollups()
+    return categories, sources
+
+
+class PeriodTotalsTests(TestCase):
+    """period_totals() reads MonthlyRollup; it should agree with the per-transaction queries it replaced."""
+
+    @classmethod
+    def setUpTestData(cls):
+        _seed_ledger()
+
+    def test_matches_transaction_queries(self):
+        buckets = [(2023, 12), (2024, 1), (2024, 2), (2024, 5)]
+        totals = period_totals(buckets)
+
+        for row in totals['months']:
+            start, end = month_date_range(row['year'], row['month'])
+            transactions = annotate_net_amount(Transaction.objects.filter(date__gte=start, date__lt=end))
+            income = transactions.filter(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q)
+            spend = transactions.exclude(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q)
+            self.assertEqual(row['income'], income.aggregate(total=Sum('net_amount'))['total'])
+            self.assertEqual(row['spend'], spend.aggregate(total=Sum('net_amount'))['total'])
+            self.assertEqual(row['savings'], row['income'] + row['spend'])
+
+        month_q = Q()
+        for year, month in buckets:
+            start, end = month_date_range(year, month)
+            month_q |= Q(date__gte=start, date__lt=end)
+        transactions = annotate_net_amount(Transaction.objects.filter(month_q))
+        spending = (
+            annotate_reporting_category(transactions.exclude(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q))
+            .values('reporting_category_id').annotate(total=Sum('net_amount') * -1)
+        )
+        income = (
+            annotate_reporting_category(transactions.filter(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q))
+            .values('reporting_category_id').annotate(total=Sum('net_amount'))
+        )
+        for rows, expected in ((totals['spending_by_category'], spending), (totals['income_by_category'], income)):
+            self.assertEqual(
+                {row['reporting_category_id']: row['total'] for row in rows},
+                {row['reporting_category_id']: row['total'] for row in expected},
+            )
+
+    def test_daily_totals_match_transaction_queries(self):
+        start, end = month_date_range(2024, 3)
+        by_date = daily_totals(start, end)
+        for day in range(1, 32):
+            on_day = annotate_net_amount(Transaction.objects.filter(date=date(2024, 3, day)).exclude(CREDIT_CATEGORY_Q))
+            income = on_day.filter(INCOME_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total']
+            spend = on_day.exclude(INCOME_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total']
+            if income is None and spend is None:
+                self.assertNotIn(date(2024, 3, day), by_date)
+                continue
+            self.assertEqual(by_date[date(2024, 3, day)], {'income': income or 0, 'spend': spend or 0})
+
+
+class MonthToDateReportTests(TestCase):
+    """mtd_report's daily series and category table against per-day and per-category queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        _seed_ledger()
+
+    def test_past_month_matches_transaction_queries(self):
+        response = self.client.get('/mtd_report/', {'year': 2024, 'month': 2})
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        self.assertEqual(context['days_in_month'], 29)
+        self.assertEqual(context['days_elapsed'], 29)
+
+        cumulative_income = cumulative_spend = Decimal('0')
+        for entry in context['savings_chart_data']:
+            on_day = annotate_net_amount(
+                Transaction.objects.filter(date=date(2024, 2, entry['day'])).exclude(CREDIT_CATEGORY_Q)
+            )
+            income = on_day.filter(INCOME_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total'] or 0
+            spend = -(on_day.exclude(INCOME_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total'] or 0)
+            cumulative_income += income
+            cumulative_spend += spend
+            self.assertAlmostEqual(entry['income'], float(income))
+            self.assertAlmostEqual(entry['spend'], float(spend))
+            self.assertAlmostEqual(entry['cumulative_savings'], float(cumulative_income - cumulative_spend))
+        self.assertAlmostEqual(context['spend_to_date'], float(cumulative_spend))
+
+        start, end = month_date_range(2024, 2)
+        expected = (
+            annotate_reporting_category(annotate_net_amount(
+                Transaction.objects.filter(date__gte=start, date__lt=end)
+            ).exclude(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q))
+            .values('reporting_category_id').annotate(total=Sum('net_amount') * -1)
+        )
+        self.assertEqual(
+            {row['category__id']: round(row['total'], 2) for row in context['mtd_data'] if row['total']},
+            {row['reporting_category_id']: float(row['total']) for row in expected},
+        )
+
+
+class GoalsViewTests(TestCase):
+    """goals_view's savings history and contribution totals against per-month and per-goal queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        _seed_ledger()
+        cls.house = SavingsGoal.objects.create(name='House', target_amount=50000, priority=1)
+        cls.car = SavingsGoal.objects.create(name='Car', target_amount=800, priority=2)
+        SavingsGoal.objects.update(created_at=date(2023, 12, 5))
+        for i in range(14):
+            GoalContribution.objects.create(goal=cls.car, amount=10 + i, date=date(2024, 1, i + 1))
+
+    def test_savings_and_contributions_match_queries(self):
+        response = self.client.get('/goals/')
+        self.assertEqual(response.status_code, 200)
+
+        net_by_month = []
+        month = date(2023, 12, 1)
+        while month <= date.today():
+            start, end = month_date_range(month.year, month.month)
+            transactions = annotate_net_amount(
+                Transaction.objects.filter(date__gte=start, date__lt=end).exclude(CREDIT_CATEGORY_Q)
+            )
+            net_by_month.append(float(transactions.aggregate(total=Sum('net_amount'))['total'] or 0))
+            month = add_months(month, 1)
+        self.assertAlmostEqual(response.context['avg_monthly_savings'], round(sum(net_by_month) / len(net_by_month), 2))
+
+        goals = {row['goal'].name: row for row in response.context['goals']}
+        self.assertEqual(goals['Car']['manual'], float(sum(10 + i for i in range(14))))
+        self.assertEqual(
+            [c.date for c in goals['Car']['contributions']],
+            [date(2024, 1, day) for day in range(14, 4, -1)],
+        )
+        self.assertEqual(goals['House']['manual'], 0.0)
+        self.assertLessEqual(
+            sum(row['auto_allocated'] for row in goals.values()),
+            sum(net for net in net_by_month if net > 0) + 0.01,
+        )
+
+    def test_allocation_fills_in_order(self):
+        wanted = np.array([300.0, 0.0, 500.0, 200.0])
+        self.assertEqual(list(_allocate_in_order(wanted, 650)), [300, 0, 350, 0])
+        self.assertEqual(list(_allocate_in_order(wanted, 0)), [0, 0, 0, 0])
+        self.assertEqual(list(_allocate_in_order(wanted, 5000)), [300, 0, 500, 200])
+        self.assertEqual(list(_allocate_in_order(np.array([]), 100)), [])
+
+
+class RewardsSpendMatrixTests(TestCase):
+    """rewards.SpendMatrix totals against the per-source queries rewards_tracker used to run."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.sources = _seed_ledger()
+
+    def test_totals_match_per_source_queries(self):
+        matrix = RewardsSpendMatrix(2024)
+        start, end = year_date_range(2024)
+        income_q = Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
+        rent_q = Q(category__name__icontains='rent') | Q(category__reporting_category__name__icontains='rent')
+
+        def total(queryset):
+            return queryset.aggregate(total=Sum('amount'))['total'] or 0
+
+        for source in self.sources:
+            totals = matrix.totals(source.id)
+            year = Transaction.objects.filter(source=source, date__gte=start, date__lt=end)
+            base = year.exclude(income_q).exclude(CREDIT_CATEGORY_Q)
+            self.assertEqual(totals['base'], total(base))
+            self.assertEqual(totals['rent'], total(base.filter(rent_q)))
+            self.assertEqual(totals['non_rent'], total(base.exclude(rent_q)))
+            self.assertEqual(totals['card-cash-'], total(year.filter(category__name__istartswith='card-cash-')))
+
+            for quarter in (None, 1, 2):
+                expected = year.filter(category=self.categories['food'])
+                if quarter:
+                    expected = expected.filter(date__quarter=quarter)
+                self.assertEqual(
+                    matrix.category_total(source.id, self.categories['food'].id, quarter), total(expected),
+                )
+
+    def test_cashback_summary_splits_category_and_blanket_spend(self):
+        visa = self.sources[0]
+        RewardCategory.objects.create(source=visa, category=self.categories['food'], multiplier=Decimal('0.03'))
+        summary = build_rewards_summary([visa], 2024)['sources_data'][0]
+        rows = {row['category_name']: row for row in summary['reward_rows']}
+
+        start, end = year_date_range(2024)
+        year = Transaction.objects.filter(source=visa, date__gte=start, date__lt=end)
+        food = abs(float(year.filter(category=self.categories['food']).aggregate(total=Sum('amount'))['total']))
+        base = abs(float(year.exclude(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q).aggregate(total=Sum('amount'))['total']))
+        self.assertAlmostEqual(rows['Food']['spend'], food)
+        self.assertAlmostEqual(rows['Food']['rewards'], food * 0.03)
+        self.assertAlmostEqual(rows['All Other']['spend'], base - food)
+        self.assertAlmostEqual(summary['total_rewards_cash'], food * 0.03 + (base - food) * 0.01)
+
+
+def _daily_rollup_snapshot():
+    """Non-zero DailyRollup buckets as {(date, reporting category id, kind): amount}."""
+    return {
+        (day, category_id, kind): amount
+        for day, category_id, kind, amount in DailyRollup.objects.values_list('date', 'reporting_category_id', 'kind', 'amount')
+        if amount
+    }
+
+
+def _spend_index_snapshot():
+    return list(SourceSpendIndex.objects.order_by('source_id', 'date').values_list(
+        'source_id', 'date', 'spend', 'cumulative_spend',
+    ))
+
+
+def _bonus_date_by_walk(source, min_spend):
+    """First date the card's qualifying spend reached min_spend, walking its transactions in
+    date order as the rewards page did before the spend index."""
+    total = Decimal('0')
+    for day, amount in (
+        Transaction.objects.filter(source=source)
+        .exclude(INCOME_CATEGORY_Q).exclude(CREDIT_CATEGORY_Q).exclude(RENT_CATEGORY_Q)
+        .order_by('date', 'id').values_list('date', 'amount')
+    ):
+        total += abs(amount)
+        if total >= min_spend:
+            return day
+    return None
+
+
+class SourceSpendIndexTests(TestCase):
+    """The signal-maintained spend index and award dates against a rebuild and a history walk."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, (cls.visa, cls.amex) = _seed_ledger(days=60)
+        rebuild_spend_index()
+        Source.objects.filter(pk=cls.visa.pk).update(signup_bonus_miles=60000, signup_bonus_min_spend=600)
+        Source.objects.filter(pk=cls.amex.pk).update(signup_bonus_miles=30000, signup_bonus_min_spend=1800)
+        refresh_signup_bonuses()
+
+    def assertIndexCurrent(self):
+        maintained = _spend_index_snapshot()
+        rebuild_spend_index()
+        self.assertEqual(maintained, _spend_index_snapshot())
+        for source in Source.objects.all():
+            self.assertEqual(
+                source.signup_bonus_awarded_on, _bonus_date_by_walk(source, source.signup_bonus_min_spend),
+            )
+
+    def test_rebuild_matches_walk(self):
+        self.assertIsNotNone(Source.objects.get(pk=self.visa.pk).signup_bonus_awarded_on)
+        self.assertIndexCurrent()
+
+    def test_transaction_writes_keep_index_current(self):
+        food = self.categories['food']
+        Transaction.objects.create(date=date(2023, 11, 1), description='Big', amount=-900, category=food, source=self.amex)
+        moved = Transaction.objects.filter(source=self.visa, category=food).first()
+        moved.source = self.amex
+        moved.date = date(2023, 11, 2)
+        moved.save()
+        to_rent = Transaction.objects.filter(source=self.visa, category=self.categories['dining']).first()
+        to_rent.category = self.categories['rent']
+        to_rent.save()
+        Transaction.objects.filter(source=self.visa).exclude(category=self.categories['salary']).first().delete()
+        self.assertIndexCurrent()
+
+    def test_category_and_bonus_term_changes(self):
+        self.categories['food'].name = 'Food rental'
+        self.categories['food'].save()
+        self.assertIndexCurrent()
+        self.visa.signup_bonus_miles = 60000
+        self.visa.signup_bonus_min_spend = 100000
+        self.visa.save()
+        self.assertIsNone(Source.objects.get(pk=self.visa.pk).signup_bonus_awarded_on)
+
+
+class GenerateDueTransactionsTests(TestCase):
+    """Bulk generation skips the Transaction signals; the derived tables must still match."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, (cls.visa, cls.amex) = _seed_ledger(start=date(2024, 1, 1), days=90)
+        rebuild_spend_index()
+        Source.objects.filter(pk=cls.visa.pk).update(signup_bonus_miles=60000, signup_bonus_min_spend=2500)
+        refresh_signup_bonuses()
+        RecurringTransaction.objects.create(
+            description='Gym', amount=-45, category=cls.categories['food'], source=cls.visa,
+            frequency='monthly', day_of_month=31, start_date=date(2024, 1, 31), end_date=date(2024, 10, 1),
+        )
+        RecurringTransaction.objects.create(
+            description='Rent', amount=-1500, category=cls.categories['rent'], source=cls.visa,
+            frequency='monthly', day_of_month=1, start_date=date(2024, 2, 1),
+        )
+        RecurringTransaction.objects.create(
+            description='Paper', amount=-3, category=None, source=cls.amex,
+            frequency='weekly', day_of_week=0, start_date=date(2024, 3, 4),
+        )
+
+    def test_generated_rows_update_derived_tables(self):
+        created = generate_due_transactions(today=date(2024, 9, 15))
+        self.assertEqual(Transaction.objects.filter(recurring_source__isnull=False).count(), created)
+        self.assertEqual(
+            sorted(Transaction.objects.filter(description='Gym').values_list('date', flat=True)),
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30), date(2024, 5, 31),
+             date(2024, 6, 30), date(2024, 7, 31), date(2024, 8, 31)],
+        )
+        self.assertEqual(_rollup_snapshot(), _direct_rollups())
+        maintained = _daily_rollup_snapshot()
+        rebuild_daily_rollups()
+        self.assertEqual(maintained, _daily_rollup_snapshot())
+
+        maintained = _spend_index_snapshot()
+        rebuild_spend_index()
+        self.assertEqual(maintained, _spend_index_snapshot())
+        visa = Source.objects.get(pk=self.visa.pk)
+        self.assertEqual(visa.signup_bonus_awarded_on, _bonus_date_by_walk(visa, visa.signup_bonus_min_spend))
+
+        self.assertEqual(generate_due_transactions(today=date(2024, 9, 15)), 0)
+
+    def test_generation_due_reads_stored_schedule(self):
+        self.assertFalse(generation_due(today=date(2024, 1, 30)))
+        self.assertTrue(generation_due(today=date(2024, 1, 31)))
+
+        # Rolled-back writes leave nothing behind.
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            RecurringTransaction.objects.create(
+                description='Tax', amount=-9, frequency='monthly', day_of_month=2, start_date=date(2024, 1, 2),
+            )
+            self.assertTrue(generation_due(today=date(2024, 1, 15)))
+            raise RuntimeError
+        self.assertFalse(generation_due(today=date(2024, 1, 15)))
+
+        # A write from another process, which fires no signals here, is seen at once.
+        RecurringTransaction.objects.filter(description='Paper').update(next_due=date(2024, 1, 10))
+        self.assertTrue(generation_due(today=date(2024, 1, 15)))
+        RecurringTransaction.objects.filter(description='Paper').update(next_due=date(2024, 3, 4))
+
+        # A rule whose end_date passed before its next occurrence still needs deactivating.
+        ended = RecurringTransaction.objects.create(
+            description='Trial', amount=-1, frequency='monthly', day_of_month=31,
+            start_date=date(2024, 1, 20), end_date=date(2024, 1, 10),
+        )
+        self.assertIsNone(ended.next_due)
+        self.assertTrue(generation_due(today=date(2024, 1, 11)))
+        generate_due_transactions(today=date(2024, 1, 11))
+        self.assertFalse(generation_due(today=date(2024, 1, 11)))
+
+        generate_due_transactions(today=date(2024, 9, 15))
+        self.assertFalse(generation_due(today=date(2024, 9, 15)))
+
+
+IMPORT_CSV = """Date,Description,Amount,Category,Source
+03/01/24,Coffee,-4.50,Food,Visa
+03/02/24,Groceries,"-$1,204.10",Food,NewCard
+03/02/24,Groceries,"-$1,204.10",Food,NewCard
+bad,Broken,-1,Food,Visa
+03/05/24,Paycheck,2000,Income,
+2024-03-07,Existing,-20.00,Food,Visa
+03/09/24,Cash,-5,,
+"""
+
+
+def _upload(text=IMPORT_CSV):
+    return SimpleUploadedFile('bank.csv', text.encode('utf-8'), content_type='text/csv')
+
+
+class StagedCsvImportTests(TestCase):
+    """Staging, duplicate flagging and the bulk insert of a CSV import."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='Food')
+        Category.objects.create(name='Income')
+        cls.visa = Source.objects.create(name='Visa')
+        Transaction.objects.create(date=date(2024, 3, 7), description='Existing', amount=-20, category=cls.food, source=cls.visa)
+        rebuild_spend_index()
+
+    def test_stage_and_import(self):
+        staged = stage_upload(_upload())
+        self.assertEqual(staged['row_count'], 6)
+        self.assertEqual([error['line'] for error in staged['errors']], [5])
+        self.assertEqual(staged['date_range'], (date(2024, 3, 1), date(2024, 3, 9)))
+        self.assertEqual(
+            {row['line']: row['duplicate'] for row in staged['preview_rows'] if row['duplicate']}, {7: 'Existing'},
+        )
+
+        version = reward_config_version()
+        result = import_staged(staged['token'], staged['date_range'], batch_size=2)
+        self.assertEqual(result, {'created': 4, 'skipped': 2})
+        self.assertFalse(os.path.exists(_staging_path(staged['token'])))
+        self.assertEqual(
+            Transaction.objects.get(description='Groceries').amount, Decimal('-1204.10'),
+        )
+        self.assertTrue(Source.objects.filter(name='NewCard').exists())
+        self.assertIsNone(Transaction.objects.get(description='Cash').category)
+        # The new card was bulk-created, so the reward configuration must have moved on.
+        self.assertNotEqual(reward_config_version(), version)
+
+        self.assertEqual(_rollup_snapshot(), _direct_rollups())
+        maintained = _daily_rollup_snapshot()
+        rebuild_daily_rollups()
+        self.assertEqual(maintained, _daily_rollup_snapshot())
+        maintained = _spend_index_snapshot()
+        rebuild_spend_index()
+        self.assertEqual(maintained, _spend_index_snapshot())
+
+        staged = stage_upload(_upload())
+        self.assertEqual(import_staged(staged['token'], staged['date_range']), {'created': 0, 'skipped': 6})
+
+    def test_confirm_view_keeps_staged_upload_until_posted(self):
+        self.client.post('/import-preview/', {'csv_file': _upload()})
+        token = self.client.session['csv_import']['token']
+        self.client.get('/import-confirm/')
+        self.assertEqual(self.client.session['csv_import']['token'], token)
+        self.assertTrue(os.path.exists(_staging_path(token)))
+
+        self.client.post('/import-confirm/')
+        self.assertNotIn('csv_import', self.client.session)
+        self.assertFalse(os.path.exists(_staging_path(token)))
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_cancel_and_expiry_discard_staged_files(self):
+        self.client.post('/import-preview/', {'csv_file': _upload()})
+        token = self.client.session['csv_import']['token']
+        self.client.post('/import-cancel/')
+        self.assertNotIn('csv_import', self.client.session)
+        self.assertFalse(os.path.exists(_staging_path(token)))
+
+        abandoned = stage_upload(_upload())['token']
+        stale = time.time() - STAGING_MAX_AGE - 60
+        os.utime(_staging_path(abandoned), (stale, stale))
+        current = stage_upload(_upload())['token']
+        self.assertFalse(os.path.exists(_staging_path(abandoned)))
+        self.assertTrue(os.path.exists(_staging_path(current)))
+        discard_staged(current)
+
+        response = self.client.post('/import-confirm/', follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.client.post('/import-preview/', {'csv_file': _upload()})
+        discard_staged(self.client.session['csv_import']['token'])
+        response = self.client.post('/import-confirm/', follow=True)
+        self.assertContains(response, 'That import has expired')
+
+
+MERCHANTS = [
+    'AMZN Mktp US*2K4', 'Amazon.com', 'Netflix.com', 'SQ *BLUE BOTTLE', 'SQ *SWEETGREEN',
+    'Starbucks Coffee', 'Peets Coffee', 'STARBUCKS STORE 0042', 'Uber Eats', 'Shell Oil 5712',
+]
+
+
+def _brute_force_matches(description, txn_date, amount):
+    """Every ledger row a near-duplicate probe should return, found by scanning the whole table."""
+    profile = description_profile(description)
+    matches = set()
+    for row in Transaction.objects.values('id', 'date', 'amount', 'description'):
+        if abs((row['date'] - txn_date).days) > NEAR_DUPLICATE_DAYS:
+            continue
+        if abs(row['amount'] - amount) > NEAR_DUPLICATE_AMOUNT_TOLERANCE:
+            continue
+        exact = row['date'] == txn_date and row['amount'] == amount
+        if exact or profile_similarity(profile, description_profile(row['description'])) >= NEAR_DUPLICATE_SIMILARITY:
+            matches.add(row['id'])
+    return matches
+
+
+class NearDuplicateIndexTests(TestCase):
+    """The bucketed, bisected index and the import's duplicate flags against a full scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(3)
+        Transaction.objects.bulk_create([
+            Transaction(
+                date=date(2024, 5, 1) + timedelta(days=rng.randint(0, 20)),
+                description=rng.choice(MERCHANTS),
+                amount=Decimal(-rng.randint(500, 540)) / 100 * rng.choice([1, 10]),
+            )
+            for _ in range(150)
+        ])
+
+    def test_index_matches_full_scan(self):
+        rng = random.Random(4)
+        index = NearDuplicateIndex.for_range(date(2024, 5, 1), date(2024, 5, 21))
+        for _ in range(60):
+            probe = (
+                rng.choice(MERCHANTS),
+                date(2024, 5, 1) + timedelta(days=rng.randint(0, 20)),
+                Decimal(-rng.randint(500, 540)) / 100 * rng.choice([1, 10]),
+            )
+            self.assertEqual({match['id'] for match in index.matches(*probe)}, _brute_force_matches(*probe), probe)
+
+    def test_import_flags_every_staged_row(self):
+        rng = random.Random(5)
+        lines = ['Date,Description,Amount']
+        probes = {}
+        for line in range(2, 202):
+            probe = (
+                rng.choice(MERCHANTS),
+                date(2024, 5, 1) + timedelta(days=rng.randint(0, 20)),
+                Decimal(-rng.randint(500, 540)) / 100 * rng.choice([1, 10]),
+            )
+            probes[line] = probe
+            lines.append(f'{probe[1].isoformat()},{probe[0]},{probe[2]}')
+        staged = stage_upload(_upload('\n'.join(lines) + '\n'))
+        flagged = {row['line'] for row in staged_rows(staged['token']) if row['duplicate']}
+        discard_staged(staged['token'])
+        self.assertEqual(staged['duplicate_count'], len(flagged))
+        self.assertEqual(flagged, {line for line, probe in probes.items() if _brute_force_matches(*probe)})
+
+
+class DescriptionSimilarityTests(TestCase):
+    """Bank abbreviations of one merchant should match; merchants sharing only generic words should not."""
+
+    def similarity(self, a, b):
+        return profile_similarity(description_profile(a), description_profile(b))
+
+    def test_abbreviated_variants_match(self):
+        for a, b in [
+            ('AMZN Mktp US*2K4', 'Amazon.com'),
+            ('AMZN Mktp US*2K4', 'AMAZON.COM*MK1AB'),
+            ('AMZN Digital*1A2B3', 'Amazon Digital Services'),
+            ('STARBUCKS STORE 0042', 'Starbucks Coffee'),
+            ('SQ *BLUE BOTTLE COFFEE', 'Blue Bottle Coffee'),
+            ('TST* Joes Pizza', 'Joes Pizza'),
+        ]:
+            self.assertGreaterEqual(self.similarity(a, b), NEAR_DUPLICATE_SIMILARITY, (a, b))
+
+    def test_different_merchants_do_not_match(self):
+        for a, b in [
+            ('Netflix.com', 'Amazon.com'),
+            ('SQ *BLUE BOTTLE', 'SQ *SWEETGREEN'),
+            ('Starbucks Coffee', 'Peets Coffee'),
+            ('Shell Oil 5712', 'Chevron 0021'),
+        ]:
+            self.assertLess(self.similarity(a, b), NEAR_DUPLICATE_SIMILARITY, (a, b))
+
+    def test_same_day_and_amount_still_flags_unrelated_descriptions(self):
+        Transaction.objects.create(date=date(2024, 5, 3), description='Netflix.com', amount=Decimal('-15.49'))
+        matches = find_near_duplicates('Amazon.com', date(2024, 5, 3), Decimal('-15.49'))
+        self.assertEqual([match['score'] for match in matches], [1.0])
+        self.assertEqual(find_near_duplicates('Amazon.com', date(2024, 5, 4), Decimal('-15.49')), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 triggers are SQLite only')
+class SearchIndexTests(TestCase):
+    """The FTS5 sync triggers must survive migrations, and be reinstalled when one is lost."""
+
+    def matching(self, query):
+        return set(search_transactions(Transaction.objects.all(), query).values_list('description', flat=True))
+
+    def test_triggers_exist_after_migrations(self):
+        self.assertTrue({FTS_TABLE, *SQLITE_TRIGGERS} <= _sqlite_objects(connection))
+
+    def test_writes_reach_the_index(self):
+        txn = Transaction.objects.create(date=date(2024, 5, 3), description='Blue Bottle Coffee', amount=Decimal('-6.50'))
+        self.assertEqual(self.matching('bottle'), {'Blue Bottle Coffee'})
+        txn.description = 'Sweetgreen'
+        txn.save()
+        self.assertEqual(self.matching('bottle'), set())
+        self.assertEqual(self.matching('sweet'), {'Sweetgreen'})
+        txn.delete()
+        self.assertEqual(self.matching('sweet'), set())
+
+    def test_repair_restores_missing_trigger(self):
+        self.assertFalse(repair_search_index())
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {SQLITE_TRIGGERS[0]}")
+        Transaction.objects.create(date=date(2024, 5, 3), description='Netflix.com', amount=Decimal('-15.49'))
+        self.assertEqual(self.matching('netflix'), set())
+        self.assertTrue(repair_search_index())
+        self.assertTrue(set(SQLITE_TRIGGERS) <= _sqlite_objects(connection))
+        self.assertEqual(self.matching('netflix'), {'Netflix.com'})
+
+class SearchMigrationTests(TransactionTestCase):
+    """Migration 0022 carries its own copy of the FTS schema. Runs outside a test transaction:
+    SQLite cannot roll an FTS5 table's DDL back cleanly."""
+
+    def test_migration_reinstalls_index(self):
+        Transaction.objects.create(date=date(2024, 5, 3), description='Blue Bottle Coffee', amount=Decimal('-6.50'))
+        migration = _migration('0022_transaction_search_index')
+        editor = SimpleNamespace(connection=connection)
+        migration.remove(django_apps, editor)
+        self.assertFalse({FTS_TABLE, *SQLITE_TRIGGERS} & _sqlite_objects(connection))
+        migration.install(django_apps, editor)
+        self.assertTrue({FTS_TABLE, *SQLITE_TRIGGERS} <= _sqlite_objects(connection))
+        self.assertEqual(
+            set(search_transactions(Transaction.objects.all(), 'bottle').values_list('description', flat=True)),
+            {'Blue Bottle Coffee'},
+        )
+
+
+TAG_TEXTS = ['', 'Trip', '#trip, food', ' Road  Trip ,trip', 'food,FOOD, #Food', 'carpool', 'car, carpool', 'gift']
+
+
+class TransactionTagTests(TestCase):
+    """Tag links and counts are maintained per write; compare them with parsing every row's tags text."""
+
+    def setUp(self):
+        self.food = Category.objects.create(name='Food', budget=Decimal('400.00'))
+        self.income = Category.objects.create(name='Income')
+
+    def assert_matches_text(self):
+        rows = Transaction.objects.values_list('id', 'tags', 'date')
+        expected_links = {(txn_id, name, txn_date) for txn_id, text, txn_date in rows for name in parse_tags(text)}
+        self.assertEqual(set(TransactionTag.objects.values_list('transaction_id', 'tag__name', 'date')), expected_links)
+        counts = defaultdict(int)
+        for _, name, _ in expected_links:
+            counts[name] += 1
+        self.assertEqual({tag.name: tag.transaction_count for tag in Tag.objects.filter(transaction_count__gt=0)}, dict(counts))
+        self.assertEqual(
+            [(tag.name, tag.transaction_count) for tag in tag_facets(limit=100)],
+            sorted(counts.items(), key=lambda item: (-item[1], item[0])),
+        )
+
+    def test_counts_follow_saves_updates_and_deletes(self):
+        rng = random.Random(6)
+        live = []
+        for _ in range(150):
+            action = rng.random()
+            if action < 0.5 or not live:
+                live.append(Transaction.objects.create(
+                    date=date(2024, 1, 1) + timedelta(days=rng.randint(0, 120)),
+                    description='Tagged', amount=Decimal(-rng.randint(100, 5000)) / 100,
+                    category=rng.choice([self.food, self.income]), tags=rng.choice(TAG_TEXTS),
+                ))
+            elif action < 0.85:
+                txn = rng.choice(live)
+                txn.tags = rng.choice(TAG_TEXTS)
+                if rng.random() < 0.3:
+                    txn.date += timedelta(days=rng.randint(-20, 20))
+                txn.save()
+            else:
+                live.pop(rng.randrange(len(live))).delete()
+        self.assert_matches_text()
+
+    def test_parse_tags_normalises(self):
+        self.assertEqual(parse_tags(' #Road  Trip ,trip, ROAD trip,, #'), ['road trip', 'trip'])
+        self.assertEqual(parse_tags(None), [])
+        self.assertEqual(parse_tags('x' * 150), ['x' * 100])
+
+    def test_monthly_spend_matches_direct_sum(self):
+        rng = random.Random(7)
+        for _ in range(120):
+            Transaction.objects.create(
+                date=date(2024, 1, 1) + timedelta(days=rng.randint(0, 150)),
+                description='Tagged', amount=Decimal(-rng.randint(100, 5000)) / 100,
+                reimbursement=Decimal(rng.choice([0, 0, 250])) / 100,
+                category=rng.choice([self.food, self.food, self.income, None]), tags=rng.choice(TAG_TEXTS),
+            )
+        expected = defaultdict(lambda: defaultdict(Decimal))
+        for txn in Transaction.objects.filter(date__gte=date(2024, 2, 1), date__lt=date(2024, 5, 1)):
+            if txn.category_id == self.income.id:
+                continue
+            for name in parse_tags(txn.tags):
+                expected[name][(txn.date.year, txn.date.month)] -= txn.amount + (txn.reimbursement or 0)
+        names = ['trip', 'food', 'road trip', 'car', 'missing']
+        self.assertEqual(
+            tag_monthly_spend(names, date(2024, 2, 1), date(2024, 5, 1)),
+            {name: [(year, month, spend) for (year, month), spend in sorted(expected[name].items())]
+             for name in names if expected[name]},
+        )
+
+    def test_index_filters_on_exact_tag(self):
+        Transaction.objects.create(date=date(2024, 3, 1), description='Pool', amount=Decimal('-5.00'), tags='carpool')
+        Transaction.objects.create(date=date(2024, 3, 2), description='Car wash', amount=Decimal('-9.00'), tags='car, carpool')
+        response = self.client.get('/', {'tag': '#Car'})
+        self.assertEqual([txn.description for txn in response.context['transactions']], ['Car wash'])
+
+
+class KeysetPaginationTests(TestCase):
+    """Walking keyset pages either way must give the same pages as offset slicing of the full ordering."""
+
+    def setUp(self):
+        rng = random.Random(8)
+        # Few distinct dates so most page boundaries fall inside a run of equal dates.
+        Transaction.objects.bulk_create([
+            Transaction(date=date(2024, 3, 1) + timedelta(days=rng.randint(0, 6)), description=f'Row {i}',
+                        amount=Decimal('-1.00'), category=None)
+            for i in range(103)
+        ])
+        self.ordered = list(Transaction.objects.order_by('-date', '-id').values_list('id', flat=True))
+
+    def offset_pages(self, ids, per_page):
+        return [ids[i:i + per_page] for i in range(0, len(ids), per_page)]
+
+    def walk(self, queryset, per_page):
+        forward, page = [], keyset_page(queryset, per_page=per_page)
+        forward.append(page)
+        while page.has_next:
+            page = keyset_page(queryset, after=page.next_cursor, per_page=per_page)
+            forward.append(page)
+        backward = [page]
+        while page.has_previous:
+            page = keyset_page(queryset, before=page.previous_cursor, per_page=per_page)
+            backward.append(page)
+        return forward, backward[::-1]
+
+    def test_pages_match_offset_slices(self):
+        for per_page in (1, 7, 10, 25, 103, 200):
+            expected = self.offset_pages(self.ordered, per_page)
+            forward, backward = self.walk(Transaction.objects.all(), per_page)
+            for pages in (forward, backward):
+                self.assertEqual([[row.pk for row in page] for page in pages], expected, per_page)
+                self.assertEqual([page.has_previous for page in pages], [i > 0 for i in range(len(expected))])
+                self.assertEqual([page.has_next for page in pages], [i < len(expected) - 1 for i in range(len(expected))])
+
+    def test_filtered_queryset(self):
+        queryset = Transaction.objects.exclude(date=date(2024, 3, 4))
+        expected = self.offset_pages(list(queryset.order_by('-date', '-id').values_list('id', flat=True)), 9)
+        forward, backward = self.walk(queryset, 9)
+        self.assertEqual([[row.pk for row in page] for page in forward], expected)
+        self.assertEqual([[row.pk for row in page] for page in backward], expected)
+
+    def test_empty_and_malformed_cursors(self):
+        page = keyset_page(Transaction.objects.none())
+        self.assertEqual((list(page), page.has_next, page.has_previous, page.next_cursor), ([], False, False, None))
+        for cursor in ('', 'nonsense', '2024-03-01', '2024-13-01.5', '2024-03-01.x'):
+            page = keyset_page(Transaction.objects.all(), after=cursor, per_page=10)
+            self.assertEqual([row.pk for row in page], self.ordered[:10], cursor)
+            self.assertFalse(page.has_previous)
+
+
+def _tip_by_scan(transaction, today):
+    """The better-card tip as the transactions page computed it per row before the rate matrix."""
+    if not transaction.category or not transaction.source or transaction.amount <= 0:
+        return None
+    if transaction.category.name.lower().startswith(('card-cash-', 'miles-credit-', 'credit-')):
+        return None
+    configured = {}
+    for rc in RewardCategory.objects.filter(category=transaction.category):
+        if rc.applicable_quarter and rc.applicable_quarter != quarter_label(transaction.date):
+            continue
+        configured[rc.source_id] = rc.multiplier
+    sources = Source.objects.exclude(reward_type='none').filter(
+        Q(opened_on__isnull=True) | Q(opened_on__lte=today), Q(closed_on__isnull=True) | Q(closed_on__gte=today),
+    )
+
+    def effective_raw(source):
+        return configured.get(source.id, BLANKET_MULTIPLIERS.get(source.reward_type, Decimal('0')))
+
+    used_raw = effective_raw(transaction.source)
+    used_cmp = best_cmp = comparison_value(transaction.source, used_raw)
+    best = None
+    for source in sources:
+        raw = effective_raw(source)
+        if comparison_value(source, raw) > best_cmp:
+            best, best_raw, best_cmp = source, raw, comparison_value(source, raw)
+    if best is None:
+        return None
+    return {
+        'best_source_name': best.name,
+        'best_rate_label': format_rate_label(best_raw, best.reward_type),
+        'used_rate_label': format_rate_label(used_raw, transaction.source.reward_type),
+        'missed_value': (best_cmp - used_cmp) * transaction.amount,
+        'amount': transaction.amount,
+    }
+
+
+class RandomRewardConfig:
+    """Cards with random reward types and open/close dates, and random rates for them."""
+
+    TODAY = date(2024, 5, 15)
+
+    def setUp(self):
+        cache.clear()
+        rng = self.rng = random.Random(9)
+        reward_types = ['cashback', 'miles', 'card_cash_miles', 'none']
+        self.sources = [
+            Source.objects.create(
+                name=f'Card {i}', reward_type=reward_types[i % 4],
+                opened_on=rng.choice([None, date(2023, 1, 1), date(2024, 6, 1)]),
+                closed_on=rng.choice([None, None, date(2024, 3, 1), date(2024, 12, 31)]),
+            )
+            for i in range(7)
+        ]
+        self.categories = [Category.objects.create(name=name) for name in ('Food', 'Travel', 'Gas', 'credit-Travel')]
+
+    def randomise_rates(self):
+        RewardCategory.objects.all().delete()
+        for _ in range(12):
+            RewardCategory.objects.create(
+                source=self.rng.choice(self.sources), category=self.rng.choice(self.categories),
+                multiplier=self.rng.choice([Decimal('0.02'), Decimal('0.05'), Decimal('1.50'), Decimal('3.00'), Decimal('5.00')]),
+                applicable_quarter=self.rng.choice([None, None, '2024Q1', '2024Q2']),
+            )
+
+
+class BetterCardTipTests(RandomRewardConfig, TestCase):
+    """get_better_card_tip from the cached RewardRateMatrix against the per-transaction scan it replaced."""
+
+    def assert_tips_match(self):
+        tips = 0
+        for _ in range(150):
+            txn = Transaction(
+                date=date(2024, 1, 1) + timedelta(days=self.rng.randint(0, 180)), description='Purchase',
+                amount=Decimal(self.rng.randint(-500, 20000)) / 100,
+                category=self.rng.choice(self.categories + [None]), source=self.rng.choice(self.sources + [None]),
+            )
+            expected = _tip_by_scan(txn, self.TODAY)
+            self.assertEqual(get_better_card_tip(txn, today=self.TODAY), expected)
+            tips += expected is not None
+        self.assertGreater(tips, 0)
+
+    def test_tips_match_scan(self):
+        for _ in range(4):
+            self.randomise_rates()
+            self.assert_tips_match()
+
+    def test_tips_follow_card_edits(self):
+        self.randomise_rates()
+        self.assert_tips_match()
+        for source in self.sources[:3]:
+            source.reward_type = 'cashback' if source.reward_type != 'cashback' else 'miles'
+            source.closed_on = None
+            source.save()
+        self.assert_tips_match()
+
+
+class RewardConfigVersionTests(TestCase):
+    """The reward configuration version lives in the database, so it is shared by every
+    process and rolled back with the write that bumped it."""
+
+    def setUp(self):
+        cache.clear()
+        self.food = Category.objects.create(name='Food')
+        self.visa = Source.objects.create(name='Visa', reward_type='cashback')
+        Source.objects.create(name='Amex', reward_type='miles')
+        self.purchase = Transaction(date=date(2024, 5, 15), description='Lunch', amount=100, category=self.food, source=self.visa)
+
+    def best_card(self):
+        tip = get_better_card_tip(self.purchase, today=date(2024, 5, 15))
+        return tip and tip['best_source_name']
+
+    def test_rolled_back_edit_is_not_served(self):
+        self.assertEqual(self.best_card(), 'Amex')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            RewardCategory.objects.create(source=self.visa, category=self.food, multiplier=Decimal('0.05'))
+            self.assertIsNone(self.best_card())
+            raise RuntimeError
+        self.assertEqual(self.best_card(), 'Amex')
+
+    def test_edit_from_another_process(self):
+        self.assertEqual(self.best_card(), 'Amex')
+        version = reward_config_version()
+        # Another process's write: no signal fires here and this process's cache is untouched,
+        # only the shared version row moves.
+        RewardCategory.objects.bulk_create([RewardCategory(source=self.visa, category=self.food, multiplier=Decimal('0.05'))])
+        bump_version(CONFIG_VERSION)
+        self.assertNotEqual(reward_config_version(), version)
+        self.assertIsNone(self.best_card())
+
+    def best_recommended(self):
+        return {row['category_name']: row['best_source_name'] for row in card_recommendations(date(2024, 5, 15))}
+
+    def test_recommendations_follow_shared_version(self):
+        RewardCategory.objects.create(source=self.visa, category=self.food, multiplier=Decimal('0.01'))
+        self.assertEqual(self.best_recommended(), {'Food': 'Amex'})
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            RewardCategory.objects.filter(source=self.visa).update(multiplier=Decimal('0.05'))
+            bump_version(CONFIG_VERSION)
+            self.assertEqual(self.best_recommended(), {'Food': 'Visa'})
+            raise RuntimeError
+        self.assertEqual(self.best_recommended(), {'Food': 'Amex'})
+
+        RewardCategory.objects.filter(source=self.visa).update(multiplier=Decimal('0.05'))
+        self.assertEqual(self.best_recommended(), {'Food': 'Amex'})  # cached; nothing bumped yet
+        bump_version(CONFIG_VERSION)
+        self.assertEqual(self.best_recommended(), {'Food': 'Visa'})
+
+
+class CardRecommendationsCacheTests(RandomRewardConfig, TestCase):
+    """The cached recommendation table must always equal a fresh build_card_recommendations()."""
+
+    def assert_fresh(self, today):
+        self.assertEqual(card_recommendations(today), build_card_recommendations(today)[0], today)
+
+    def test_cache_follows_config_edits(self):
+        self.randomise_rates()
+        self.assert_fresh(self.TODAY)
+        for _ in range(20):
+            edit = self.rng.random()
+            if edit < 0.4:
+                rate = self.rng.choice(list(RewardCategory.objects.all()))
+                rate.multiplier += Decimal('2.00')
+                rate.save()
+            elif edit < 0.6:
+                self.rng.choice(list(RewardCategory.objects.all())).delete()
+            elif edit < 0.8:
+                source = self.rng.choice(self.sources)
+                source.reward_type = self.rng.choice(['cashback', 'miles', 'card_cash_miles', 'none'])
+                source.save()
+            else:
+                category = self.rng.choice(self.categories)
+                category.name += 'x'
+                category.save()
+            self.assert_fresh(self.TODAY)
+
+    def test_cache_follows_quarter_and_card_dates(self):
+        self.randomise_rates()
+        # Cards in setUp open on 2024-06-01 and close on 2024-03-01 or 2024-12-31.
+        for today in (date(2024, 2, 29), date(2024, 3, 1), date(2024, 3, 2), date(2024, 4, 1),
+                      date(2024, 5, 31), date(2024, 6, 1), date(2024, 12, 31), date(2025, 1, 1)):
+            self.assert_fresh(today)
+
+
+class RecurringDetectorTests(TestCase):
+    """Recurring suggestions for hand-built histories, and their cache across writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = Category.objects.create(name='Food')
+        bills = Category.objects.create(name='Bills')
+        cls.visa = Source.objects.create(name='Visa')
+
+        def rows(description, days, amount=-10, category=None, source=None):
+            return [
+                Transaction(date=day, description=description(i) if callable(description) else description,
+                            amount=amount, category=category, source=source)
+                for i, day in enumerate(days)
+            ]
+
+        months = [date(2023, month, 5) for month in range(1, 7)]
+        Transaction.objects.bulk_create(
+            # One merchant under a new reference number every month.
+            rows(lambda i: f'NETFLIX.COM {1000 + i}', months, amount=Decimal('-15.49'), category=bills, source=cls.visa)
+            + rows('Gym', [date(2023, 1, 2) + timedelta(weeks=week) for week in range(4)],
+                   amount=-30, category=cls.food, source=cls.visa)
+            + rows('Water', [date(2023, 1, 10), date(2023, 4, 11), date(2023, 7, 11)], amount=-60)
+            + rows('Two only', months[:2])
+            + rows('Same day', [date(2023, 3, 1)] * 3)
+            + rows('Irregular', [date(2023, 1, 1), date(2023, 1, 8), date(2023, 2, 7), date(2023, 5, 8)])
+            + rows('Spotify USA', months[:4])
+            + rows('Cleaner', [date(2023, 2, 1) + timedelta(weeks=week) for week in range(5)])
+            + rows('Market', [date(2023, 6, 1)])
+        )
+        Transaction.objects.filter(description='Gym', date=date(2023, 1, 23)).update(amount=-34, category=bills)
+        RecurringTransaction.objects.create(
+            description='Spotify USA', amount=-10, frequency='monthly', day_of_month=5, start_date=date(2023, 1, 5),
+        )
+        DismissedSuggestion.objects.create(description='Cleaner')
+
+    def setUp(self):
+        cache.clear()
+
+    def summary(self, mode='exact'):
+        return [(s['description'], s['frequency'], s['interval'], s['occurrences']) for s in detect_recurring_patterns(mode)]
+
+    def test_exact_descriptions(self):
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+        gym, water = detect_recurring_patterns()
+        self.assertEqual(gym, {
+            'description': 'Gym', 'amount': -31.0, 'frequency': 'weekly', 'interval': 1,
+            'day_of_month': 1, 'day_of_week': 0, 'category_id': self.food.id, 'category_name': 'Food',
+            'source_id': self.visa.id, 'source_name': 'Visa', 'occurrences': 4, 'consistency_score': 1.0,
+            'start_date': '2023-01-02',
+        })
+        self.assertEqual((water['day_of_month'], water['day_of_week'], water['category_id']), (11, None, None))
+
+    def test_merchant_groups_reference_numbers(self):
+        self.assertEqual(self.summary('merchant'), [
+            ('NETFLIX.COM 1005', 'monthly', 1, 6), ('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3),
+        ])
+        DismissedSuggestion.objects.create(description='NETFLIX.COM 9999')
+        self.assertEqual(self.summary('merchant'), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+
+    def test_cached_suggestions_follow_writes(self):
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+        Transaction.objects.create(date=date(2023, 1, 30), description='Gym', amount=-30)
+        DismissedSuggestion.objects.create(description='Water')
+        RecurringTransaction.objects.filter(description='Spotify USA').update(is_active=False)
+        RecurringTransaction.objects.get(description='Spotify USA').save()
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 5), ('Spotify USA', 'monthly', 1, 4)])
+
+    def test_rolled_back_write_is_not_served(self):
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            DismissedSuggestion.objects.create(description='Gym')
+            self.assertEqual(self.summary(), [('Water', 'monthly', 3, 3)])
+            raise RuntimeError
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+
+    def test_write_from_another_process(self):
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+        # Another process's write fires no signal here; only the shared version row moves.
+        Transaction.objects.bulk_create([Transaction(date=date(2023, 1, 30), description='Gym', amount=-30)])
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 4), ('Water', 'monthly', 3, 3)])
+        bump_version(SUGGESTIONS_VERSION)
+        self.assertEqual(self.summary(), [('Gym', 'weekly', 1, 5), ('Water', 'monthly', 3, 3)])
+
+
+def _random_rules(rng, count, start=date(2023, 11, 1)):
+    """Active recurring rules of every frequency, with month-end days and some end dates."""
+    rules = []
+    for i in range(count):
+        frequency = rng.choice(['weekly', 'monthly', 'monthly', 'yearly'])
+        start_date = start + timedelta(days=rng.randint(0, 150))
+        rules.append(RecurringTransaction.objects.create(
+            description=f'Rule {i}', amount=Decimal(-rng.randint(500, 20000)) / 100, frequency=frequency,
+            interval=rng.choice([1, 1, 2, 3]), day_of_month=rng.choice([1, 15, 28, 29, 30, 31]),
+            day_of_week=rng.choice([None, 0, 4, 6]) if frequency == 'weekly' else None, start_date=start_date,
+            end_date=rng.choice([None, None, start_date + timedelta(days=rng.randint(20, 400))]),
+        ))
+    return rules
+
+
+class UpcomingRecurringTests(TestCase):
+    """upcoming_recurring reads the stored next_due; compare it with get_next_occurrence per rule."""
+
+    def upcoming_by_scan(self, today, days=7):
+        upcoming = []
+        for recurring in RecurringTransaction.objects.filter(is_active=True):
+            next_date = get_next_occurrence(recurring)
+            if recurring.end_date and next_date > recurring.end_date:
+                continue
+            if today < next_date <= today + timedelta(days=days):
+                upcoming.append((next_date, recurring.pk))
+        return sorted(upcoming)
+
+    def test_next_due_follows_generation_and_edits(self):
+        rng = random.Random(11)
+        rules = _random_rules(rng, 25)
+        for today in [date(2023, 11, 1) + timedelta(days=n) for n in range(0, 420, 9)]:
+            generate_due_transactions(today=today)
+            self.assertEqual(
+                sorted((rule.next_due, rule.pk) for rule in upcoming_recurring(today=today, days=7)),
+                self.upcoming_by_scan(today), today,
+            )
+            rule = RecurringTransaction.objects.get(pk=rng.choice(rules).pk)
+            rule.day_of_month = rng.choice([1, 30, 31])
+            rule.interval = rng.choice([1, 2])
+            rule.save()
+            self.assertEqual(
+                sorted((rule.next_due, rule.pk) for rule in upcoming_recurring(today=today, days=30)),
+                self.upcoming_by_scan(today, days=30), today,
+            )
+
+
+def _occurrences_by_stepping(rule, start, end, pending_only=False):
+    """(rule id, date, amount) of every occurrence in [start, end), found by advancing
+    last_generated one get_next_occurrence() at a time as generate_due_transactions does."""
+    last_generated = rule.last_generated if pending_only else None
+    stepper = RecurringTransaction(
+        frequency=rule.frequency, interval=rule.interval, day_of_month=rule.day_of_month,
+        day_of_week=rule.day_of_week, start_date=rule.start_date, last_generated=last_generated,
+    )
+    found = []
+    next_date = get_next_occurrence(stepper)
+    while next_date < end and not (rule.end_date and next_date > rule.end_date):
+        if next_date >= start:
+            found.append((rule.pk, next_date, float(rule.amount)))
+        stepper.last_generated = next_date
+        next_date = get_next_occurrence(stepper)
+    return found
+
+
+class ExpandOccurrencesTests(TestCase):
+    """The vectorised expansion against stepping each rule with get_next_occurrence."""
+
+    def expanded(self, rules, start, end, pending_only=False):
+        return [
+            (int(row['rule_id']), row['date'].astype(date), float(row['amount']))
+            for row in expand_occurrences(rules, start, end, pending_only=pending_only)
+        ]
+
+    def stepped(self, rules, start, end, pending_only=False):
+        return sorted(
+            (occurrence for rule in rules for occurrence in _occurrences_by_stepping(rule, start, end, pending_only)),
+            key=lambda occurrence: (occurrence[1], occurrence[0]),
+        )
+
+    def test_schedule_matches_stepping(self):
+        rng = random.Random(12)
+        rules = _random_rules(rng, 60)
+        for start, end in [
+            (date(2023, 1, 1), date(2026, 1, 1)), (date(2024, 2, 1), date(2024, 3, 1)),
+            (date(2024, 2, 29), date(2024, 3, 31)), (date(2024, 1, 31), date(2024, 2, 1)),
+            (date(2024, 12, 30), date(2025, 3, 2)),
+        ]:
+            self.assertEqual(self.expanded(rules, start, end), self.stepped(rules, start, end), (start, end))
+
+    def test_pending_matches_stepping(self):
+        rng = random.Random(13)
+        _random_rules(rng, 60)
+        for today in (date(2024, 1, 31), date(2024, 2, 29), date(2024, 6, 30)):
+            generate_due_transactions(today=today)
+            rules = list(RecurringTransaction.objects.all())
+            start, end = today.replace(day=1), add_months(today.replace(day=1), 2)
+            self.assertEqual(
+                self.expanded(rules, start, end, pending_only=True), self.stepped(rules, start, end, pending_only=True),
+            )
+
+    def test_month_end_days_clamp(self):
+        rule = RecurringTransaction.objects.create(
+            description='Month end', amount=-10, frequency='monthly', day_of_month=31, start_date=date(2024, 1, 31),
+            end_date=date(2024, 6, 29),
+        )
+        self.assertEqual(
+            [day for _, day, _ in self.expanded([rule], date(2024, 1, 1), date(2025, 1, 1))],
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30), date(2024, 5, 31)],
+        )
+
+
+class ProjectedMonthSpendTests(TestCase):
+    """projected_month_spend against spend summed from transactions and rules stepped one by one."""
+
+    TODAY = date(2024, 5, 15)
+
+    def setUp(self):
+        rng = random.Random(14)
+        self.food = Category.objects.create(name='Food', budget=Decimal('400.00'))
+        self.rent = Category.objects.create(name='Rent', budget=Decimal('1500.00'))
+        self.fun = Category.objects.create(name='Fun', budget=Decimal('100.00'))
+        income = Category.objects.create(name='Income')
+        month = date(2023, 11, 1)
+        while month <= self.TODAY:
+            last_day = min(add_months(month, 1) - timedelta(days=1), self.TODAY)
+            for _ in range(12):
+                Transaction.objects.create(
+                    date=month + timedelta(days=rng.randint(0, (last_day - month).days)), description='Groceries',
+                    amount=Decimal(-rng.randint(500, 6000)) / 100, category=rng.choice([self.food, self.fun]),
+                )
+            if month < self.TODAY.replace(day=1):
+                Transaction.objects.create(date=month, description='Rent', amount=Decimal('-1500.00'), category=self.rent)
+            month = add_months(month, 1)
+
+        def rule(description, amount, category, day, last_generated):
+            return RecurringTransaction.objects.create(
+                description=description, amount=amount, category=category, frequency='monthly', day_of_month=day,
+                start_date=date(2023, 10, day), last_generated=last_generated,
+            )
+
+        # Due on the 1st but not generated yet, due today, still ahead, and already generated.
+        rule('Rent', Decimal('-1500.00'), self.rent, 1, date(2024, 4, 1))
+        rule('Gym', Decimal('-45.00'), self.fun, 15, date(2024, 4, 15))
+        rule('Streaming', Decimal('-20.00'), self.fun, 20, date(2024, 4, 20))
+        phone = rule('Phone', Decimal('-60.00'), self.fun, 3, date(2024, 5, 3))
+        Transaction.objects.create(date=date(2024, 5, 3), description='Phone', amount=Decimal('-60.00'),
+                                   category=self.fun, recurring_source=phone)
+        rule('Salary', Decimal('5000.00'), income, 1, date(2024, 4, 1))
+
+    def test_rows_match_direct_computation(self):
+        month_start, month_end = date(2024, 5, 1), date(2024, 6, 1)
+        history = [add_months(month_start, -n) for n in range(6, 0, -1)]
+        spend_categories = [self.food, self.rent, self.fun]
+        rules = [rule for rule in RecurringTransaction.objects.all() if rule.category.name != 'Income']
+
+        def spend(category, start, end):
+            rows = Transaction.objects.filter(category=category, date__gte=start, date__lt=end)
+            return -float(sum(row.amount + (row.reimbursement or 0) for row in rows))
+
+        def scheduled(category, start, end, pending_only=False):
+            return -sum(
+                amount for rule in rules if rule.category_id == category.id
+                for _, _, amount in _occurrences_by_stepping(rule, start, end, pending_only)
+            )
+
+        history_days = sum((add_months(month, 1) - month).days for month in history)
+        projection = projected_month_spend(today=self.TODAY)
+        rows = {row['category_id']: row for row in projection['rows']}
+        self.assertEqual(set(rows), {category.id for category in spend_categories})
+        for category in spend_categories:
+            row = rows[category.id]
+            discretionary = sum(
+                spend(category, month, add_months(month, 1)) - scheduled(category, month, add_months(month, 1))
+                for month in history
+            )
+            self.assertAlmostEqual(row['spent'], spend(category, month_start, month_end))
+            self.assertAlmostEqual(row['recurring'], scheduled(category, month_start, month_end, pending_only=True))
+            self.assertAlmostEqual(row['discretionary'], max(discretionary, 0) / history_days * 16)
+            self.assertAlmostEqual(row['projected'], row['spent'] + row['recurring'] + row['discretionary'])
+
+        # Rent due on the 1st and the gym due today are counted; the generated phone bill is
+        # in spent only.
+        self.assertAlmostEqual(rows[self.rent.id]['recurring'], 1500.0)
+        self.assertAlmostEqual(rows[self.fun.id]['recurring'], 65.0)
+        self.assertEqual(projection['history_months'], 6)
+
+
+def _anomalies_by_loop(today):
+    """spending_anomalies worked out from the transactions with plain loops."""
+    current = today.replace(day=1)
+    months = [add_months(current, -n) for n in range(6, -1, -1)]
+    categories = {category.id: category for category in Category.objects.select_related('reporting_category')}
+    spend = defaultdict(lambda: [0.0] * len(months))
+    for txn in Transaction.objects.filter(date__gte=months[0], date__lt=add_months(current, 1)):
+        category = categories.get(txn.category_id)
+        if category is None:
+            key = None
+        else:
+            reporting = category.reporting_category
+            if classify_category(category.name, reporting.name if reporting else None) != MonthlyRollup.KIND_SPEND:
+                continue
+            key = category.reporting_category_id or category.id
+        spend[key][months.index(txn.date.replace(day=1))] -= float(txn.amount + (txn.reimbursement or 0))
+    recorded = [i for i in range(len(months) - 1) if sum(values[i] for values in spend.values()) > 0]
+    if not recorded:
+        return []
+    fraction = max(today.day / calendar.monthrange(today.year, today.month)[1], 0.25)
+    flagged = []
+    for key in sorted(spend, key=lambda pk: pk or 0):
+        trailing = spend[key][recorded[0]:-1]
+        average, deviation = mean(trailing), pstdev(trailing)
+        pace = spend[key][-1] / fraction
+        z_score = (pace - average) / deviation if deviation > 0 else 0.0
+        increase = (pace - average) / average if average > 0 else 0.0
+        if z_score >= ANOMALY_Z_SCORE and increase >= ANOMALY_MIN_INCREASE:
+            flagged.append((key, pace, average, z_score))
+    flagged.sort(key=lambda row: -row[3])
+    return flagged
+
+
+class SpendingAnomalyTests(TestCase):
+    """SpendMatrix anomalies against plain loops over the ledger, and the matrix's cache version."""
+
+    TODAY = date(2024, 6, 20)
+
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(15)
+        food = Category.objects.create(name='Food')
+        dining = Category.objects.create(name='Dining', reporting_category=food)
+        travel = Category.objects.create(name='Travel')
+        fuel = Category.objects.create(name='Fuel')
+        cls.categories = [food, dining, travel, fuel, Category.objects.create(name='Income'),
+                           Category.objects.create(name='credit-Visa'), None]
+        for _ in range(400):
+            day = date(2023, 12, 1) + timedelta(days=rng.randint(0, (cls.TODAY - date(2023, 12, 1)).days))
+            Transaction.objects.create(
+                date=day, description='Spend', amount=Decimal(-rng.randint(500, 8000)) / 100,
+                reimbursement=Decimal(rng.choice([0, 0, 0, 1000])) / 100, category=rng.choice(cls.categories),
+            )
+        # A spike this month in dining (reported under food) and travel.
+        for category, amount in ((dining, '-900.00'), (travel, '-1200.00')):
+            Transaction.objects.create(date=date(2024, 6, 3), description='Spike', amount=Decimal(amount), category=category)
+
+    def assert_matches_loops(self):
+        expected = _anomalies_by_loop(self.TODAY)
+        anomalies = spending_anomalies(self.TODAY)
+        self.assertEqual([row['category_id'] for row in anomalies], [row[0] for row in expected])
+        for row, (_, pace, average, z_score) in zip(anomalies, expected):
+            self.assertAlmostEqual(row['pace'], pace, places=6)
+            self.assertAlmostEqual(row['average'], average, places=6)
+            self.assertEqual(row['z_score'], round(z_score, 1))
+        return anomalies
+
+    def test_anomalies_match_loops(self):
+        self.assertTrue(self.assert_matches_loops())
+
+    def test_cached_matrix_follows_writes(self):
+        self.assert_matches_loops()
+        txn = Transaction.objects.create(date=date(2024, 6, 4), description='Fuel', amount=Decimal('-800.00'),
+                                         category=self.categories[3])
+        self.assertIn(self.categories[3].id, [row['category_id'] for row in self.assert_matches_loops()])
+        txn.category = self.categories[4]
+        txn.save()
+        self.assert_matches_loops()
+        self.categories[2].name = 'credit-Travel'
+        self.categories[2].save()
+        self.assert_matches_loops()
+
+    def test_rolled_back_write_is_not_served(self):
+        before = spend_matrix(self.TODAY).values.copy()
+        try:
+            with transaction.atomic():
+                Transaction.objects.create(date=date(2024, 6, 5), description='Oops', amount=Decimal('-5000.00'),
+                                           category=self.categories[0])
+                self.assertFalse((spend_matrix(self.TODAY).values == before).all())
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertTrue((spend_matrix(self.TODAY).values == before).all())
+        Transaction.objects.create(date=date(2024, 6, 5), description='Real', amount=Decimal('-20.00'),
+                                   category=self.categories[0])
+        self.assert_fresh()
+
+    def assert_fresh(self):
+        matrix = spend_matrix(self.TODAY)
+        fresh = SpendMatrix(self.TODAY.replace(day=1))
+        self.assertEqual(matrix.category_ids, fresh.category_ids)
+        self.assertTrue(np.allclose(matrix.values, fresh.values))
+
+    def test_local_writes_patch_the_matrix(self):
+        spend_matrix(self.TODAY)
+        txn = Transaction.objects.create(date=date(2024, 6, 4), description='Fuel', amount=Decimal('-80.00'),
+                                         reimbursement=Decimal('5.00'), category=self.categories[1])
+        txn.date, txn.category = date(2024, 1, 9), self.categories[3]
+        txn.save()
+        Transaction.objects.create(date=date(2022, 1, 1), description='Old', amount=Decimal('-7.00'), category=self.categories[2])
+        with self.assertNumQueries(1):  # the version check; the matrix was patched, not rebuilt
+            spend_matrix(self.TODAY)
+        self.assert_fresh()
+        txn.delete()
+        self.assert_fresh()
+
+    def test_new_category_rebuilds(self):
+        spend_matrix(self.TODAY)
+        Transaction.objects.create(date=date(2024, 6, 4), description='Pets', amount=Decimal('-60.00'),
+                                   category=Category.objects.create(name='Pets'))
+        self.assert_fresh()
+
+    def test_write_after_another_process_rebuilds(self):
+        spend_matrix(self.TODAY)
+        # Another process's write: the rows and the version row move, this process's cache does not.
+        Transaction.objects.filter(description='Spike').update(amount=Decimal('-1.00'))
+        call_command('rebuild_rollups', stdout=open(os.devnull, 'w'))
+        # This process's next write must not patch the copy that missed it.
+        Transaction.objects.create(date=date(2024, 6, 5), description='Local', amount=Decimal('-20.00'),
+                                   category=self.categories[0])
+        self.assert_fresh()
+
+    def test_bulk_writes_from_another_process(self):
+        self.assert_matches_loops()
+        # A queryset update skips the signals, as a bulk job would; rebuild_rollups then
+        # bumps the database version, which this process's cached copy is checked against.
+        Transaction.objects.filter(description='Spike').update(amount=Decimal('-1.00'))
+        call_command('rebuild_rollups', stdout=open(os.devnull, 'w'))
+        self.assert_matches_loops()
+
+
+def _range_by_sum(start, end):
+    """(income, {reporting category id: spend}) over start..end inclusive, from one Sum per bucket."""
+    rows = annotate_reporting_category(
+        Transaction.objects.filter(date__gte=start, date__lte=end).exclude(CREDIT_CATEGORY_Q)
+    ).values('reporting_category_id').annotate(
+        total=Sum('amount') + Sum(Coalesce('reimbursement', Value(0, output_field=DecimalField()))),
+    ).order_by()
+    income_rows = Transaction.objects.filter(INCOME_CATEGORY_Q, date__gte=start, date__lte=end)
+    income = income_rows.aggregate(total=Sum('amount'))['total'] or 0
+    income += income_rows.aggregate(total=Sum('reimbursement'))['total'] or 0
+    income_ids = set(Category.objects.filter(Q(name__iexact='income') | Q(reporting_category__name__iexact='income'))
+                     .values_list('pk', flat=True))
+    spend = {row['reporting_category_id']: -float(row['total']) for row in rows
+             if row['reporting_category_id'] not in income_ids}
+    return float(income), spend
+
+
+class RangeLedgerTests(TestCase):
+    """range_report from the DailyLedger prefix sums against direct Sums, and the ledger's version chain."""
+
+    TODAY = date(2024, 6, 30)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.sources = _seed_ledger()
+
+    def assert_matches_sums(self, start, end):
+        report = range_report(start, end, today=self.TODAY)
+        income, spend = _range_by_sum(start, end)
+        self.assertAlmostEqual(report['income'], income, places=6)
+        self.assertEqual({row['category_id'] for row in report['rows'] if row['spent']}, {k for k, v in spend.items() if v})
+        for row in report['rows']:
+            self.assertAlmostEqual(row['spent'], spend.get(row['category_id'], 0.0), places=6, msg=(start, end, row))
+        self.assertAlmostEqual(report['total_spend'], sum(spend.values()), places=6)
+
+    def test_random_ranges_match_sums(self):
+        rng = random.Random(16)
+        ranges = [(date(2023, 1, 1), date(2025, 1, 1)), (date(2023, 11, 1), date(2023, 11, 1)),
+                  (date(2024, 2, 29), date(2024, 3, 1)), (date(2024, 6, 28), date(2024, 7, 10))]
+        for _ in range(25):
+            start = date(2023, 10, 20) + timedelta(days=rng.randint(0, 260))
+            ranges.append((start, start + timedelta(days=rng.randint(0, 120))))
+        for start, end in ranges:
+            self.assert_matches_sums(start, end)
+
+    def test_cached_ledger_follows_writes(self):
+        self.assert_matches_sums(date(2024, 1, 1), date(2024, 3, 31))
+        txn = Transaction.objects.create(date=date(2024, 2, 10), description='New', amount=Decimal('-77.00'),
+                                         category=self.categories['rent'])
+        self.assert_matches_sums(date(2024, 1, 1), date(2024, 3, 31))
+        txn.date, txn.category = date(2022, 5, 1), None
+        txn.save()
+        self.assert_matches_sums(date(2022, 1, 1), date(2024, 3, 31))
+        txn.delete()
+        self.categories['dining'].reporting_category = None
+        self.categories['dining'].save()
+        self.assert_matches_sums(date(2024, 1, 1), date(2024, 3, 31))
+        maintained = _daily_rollup_snapshot()
+        rebuild_daily_rollups()
+        self.assertEqual(maintained, _daily_rollup_snapshot())
+
+    def test_rolled_back_write_is_not_served(self):
+        before = daily_ledger(self.TODAY).prefix.copy()
+        try:
+            with transaction.atomic():
+                Transaction.objects.create(date=date(2024, 2, 10), description='Oops', amount=Decimal('-5000.00'),
+                                           category=self.categories['food'])
+                self.assertNotEqual(daily_ledger(self.TODAY).prefix.tolist(), before.tolist())
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(daily_ledger(self.TODAY).prefix.tolist(), before.tolist())
+        Transaction.objects.create(date=date(2024, 2, 10), description='Real', amount=Decimal('-20.00'),
+                                   category=self.categories['food'])
+        self.assert_fresh()
+
+    def assert_fresh(self):
+        ledger = daily_ledger(self.TODAY)
+        fresh = DailyLedger(self.TODAY)
+        self.assertEqual((ledger.series, ledger.first_day, ledger.last_day), (fresh.series, fresh.first_day, fresh.last_day))
+        self.assertTrue(np.allclose(ledger.prefix, fresh.prefix))
+
+    def test_local_writes_patch_the_ledger(self):
+        daily_ledger(self.TODAY)
+        txn = Transaction.objects.create(date=date(2024, 2, 10), description='New', amount=Decimal('-77.00'),
+                                         reimbursement=Decimal('7.00'), category=self.categories['dining'])
+        txn.date, txn.category = date(2024, 5, 1), self.categories['salary']
+        txn.save()
+        with self.assertNumQueries(1):  # the version check; the ledger was patched, not rebuilt
+            daily_ledger(self.TODAY)
+        self.assert_fresh()
+        version = daily_ledger(self.TODAY).version
+        txn.description = 'Renamed'
+        txn.save()
+        self.assertEqual(daily_ledger(self.TODAY).version, version)
+        txn.delete()
+        self.assert_fresh()
+
+    def test_writes_outside_the_ledger_rebuild(self):
+        daily_ledger(self.TODAY)
+        Transaction.objects.create(date=date(2020, 1, 1), description='Old', amount=Decimal('-5.00'),
+                                   category=self.categories['food'])
+        self.assert_fresh()
+        Transaction.objects.create(date=date(2024, 2, 1), description='Pets', amount=Decimal('-5.00'),
+                                   category=Category.objects.create(name='Pets'))
+        self.assert_fresh()
+
+    def test_write_after_another_process_rebuilds(self):
+        daily_ledger(self.TODAY)
+        # Another process's bulk write: rows, daily rollups and the version row move, while
+        # this process's ledger does not.
+        Transaction.objects.filter(category=self.categories['rent']).update(amount=Decimal('-1.00'))
+        call_command('rebuild_rollups', stdout=open(os.devnull, 'w'))
+        # This process's next write must not patch the ledger that missed it.
+        Transaction.objects.create(date=date(2024, 2, 10), description='Local', amount=Decimal('-20.00'),
+                                   category=self.categories['food'])
+        self.assert_fresh()
+        self.assert_matches_sums(date(2024, 1, 1), date(2024, 3, 31))
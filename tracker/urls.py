@@ -17,9 +17,13 @@ urlpatterns = [
     path("reports/", views.reports_view, name="reports"),
     path("import-preview/", views.import_csv_preview, name="import_csv_preview"),
     path("import-confirm/", views.import_csv_confirm, name="import_csv_confirm"),
+    path("import-cancel/", views.import_csv_cancel, name="import_csv_cancel"),
     path("ytd_report/", views.ytd_report, name="ytd_report"),
     path("mtd_report/", views.mtd_report, name="mtd_report"),
+    path("range_report/", views.range_report_view, name="range_report"),
     path("rewards/", views.rewards_tracker, name="rewards_tracker"),
+    path("card_recommendations/", views.card_recommendations_json, name="card_recommendations"),
+    path("missed_rewards/", views.missed_rewards_view, name="missed_rewards"),
     path("category_year/", views.category_year_view, name="category_year"),
     path("add_recurring/", views.add_recurring_transaction, name="add_recurring"),
     path("edit_recurring/<int:recurring_id>/", views.edit_recurring_transaction, name="edit_recurring"),
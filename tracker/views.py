@@ -1,79 +1,43 @@
 from django.shortcuts import render, HttpResponseRedirect
+from django.http import JsonResponse
 from django.contrib import messages
 from .models import *
 from decimal import Decimal
 from datetime import datetime, timedelta, date
 from django.db.models import Sum, Q, Exists, OuterRef, Min, Max, F, Value, DecimalField, Case, When, BooleanField
 import calendar
+import numpy as np
 from django.db.models.functions import ExtractYear, ExtractMonth, Coalesce
-import csv
-from io import TextIOWrapper
 from django.core.paginator import Paginator
 import time
 from .recurring_detector import detect_recurring_patterns
-
-CREDIT_CATEGORY_Q = (
-    Q(category__name__istartswith='card-cash-') |
-    Q(category__name__istartswith='miles-credit-') |
-    Q(category__name__istartswith='credit-')
+from .month_cache import get_month_summary
+from .aggregation import period_totals, running_average, daily_totals
+from .rewards import build_rewards_summary, quarter_label
+from .missed_rewards import missed_rewards
+from .projection import projected_month_spend
+from .insights import spending_anomalies
+from .range_ledger import range_report
+from .reward_rates import card_recommendations, get_better_card_tip
+from .duplicates import find_near_duplicates
+from .csv_import import stage_upload, import_staged, discard_staged
+from .search import search_transactions, ranked_ids
+from .tags import normalize_tag, tag_facets, tag_monthly_spend
+from .pagination import keyset_page
+from .recurring import (
+    add_months, generate_due_transactions, generation_due, upcoming_recurring,
+)
+from .rollups import (
+    CREDIT_CATEGORY_Q, month_date_range, year_date_range, rollups_between, reporting_category_totals, net_total,
+    SPEND_TREND_LOOKBACK_MONTHS,
 )
 
-SPEND_TREND_LOOKBACK_MONTHS = 6
-
-BLANKET_MULTIPLIERS = {
-    'cashback': Decimal('0.01'),
-    'miles': Decimal('1.0'),
-    'card_cash_miles': Decimal('2.0'),  # 2x miles on non-rent spend
-    'none': Decimal('0'),
-}
-
-# card_cash_miles sources also earn card cash, added as a miles equivalent for comparison purposes.
-# 0.5 bonus makes them rank above a card with the same miles rate but below one with more miles.
-CARD_CASH_MILES_BONUS = Decimal('0.5')
-
-# Cents per point/mile used to normalize miles against cashback for comparison only.
-# Display always shows raw miles (e.g. "2.00x"), never the converted value.
-CPP = Decimal('0.012')
-
-
-def comparison_value(source, raw_multiplier):
-    """Return a dollar-per-dollar comparison value for ranking cards against each other.
-    Miles are converted to dollar value using CPP; cashback is already in dollar terms.
-    card_cash_miles gets the 0.5-mile card-cash bonus before conversion.
-    """
-    if source.reward_type == 'cashback':
-        return raw_multiplier
-    effective_miles = raw_multiplier + CARD_CASH_MILES_BONUS if source.reward_type == 'card_cash_miles' else raw_multiplier
-    return effective_miles * CPP
+UPCOMING_HORIZONS = (7, 30, 90)
 
 
 def get_monthly_cumulative_spend(year, month):
     """Returns a 31-element list of cumulative spend for the given month."""
-    transactions = annotate_net_amount(
-        Transaction.objects.filter(date__month=month, date__year=year)
-    ).exclude(category__name__iexact='income').exclude(
-        category__reporting_category__name__iexact='income'
-    ).exclude(CREDIT_CATEGORY_Q)
-
-    daily_totals = (
-        transactions.order_by("date")
-        .values("date")
-        .annotate(daily_total=Sum("net_amount"))
-    )
-
-    day_cumulative = {}
-    cumulative = 0.0
-    for item in daily_totals:
-        cumulative += float(item["daily_total"]) * -1
-        day_cumulative[item["date"].day] = cumulative
-
-    result = []
-    last_val = 0.0
-    for day in range(1, 32):
-        if day in day_cumulative:
-            last_val = day_cumulative[day]
-        result.append(last_val)
-    return result
+    return get_month_summary(year, month).daily_spend
 
 
 def annotate_reporting_category(queryset):
@@ -90,147 +54,6 @@ def annotate_net_amount(queryset):
     )
 
 
-def quarter_label(date_value):
-    if not date_value:
-        return ""
-    quarter = (date_value.month - 1) // 3 + 1
-    return f"{date_value.year}Q{quarter}"
-
-
-def get_better_card_tip(transaction):
-    """Check if a better reward card existed for this transaction's category/amount."""
-    if not transaction.category or not transaction.source:
-        return None
-    if transaction.amount <= 0:
-        return None
-    cat_name = transaction.category.name.lower()
-    if cat_name.startswith('card-cash-') or cat_name.startswith('miles-credit-') or cat_name.startswith('credit-'):
-        return None
-
-    current_quarter = quarter_label(transaction.date)
-
-    reward_cats = RewardCategory.objects.filter(
-        category=transaction.category
-    ).select_related('source')
-
-    configured = {}
-    for rc in reward_cats:
-        if rc.applicable_quarter and rc.applicable_quarter != current_quarter:
-            continue
-        configured[rc.source_id] = rc.multiplier
-
-    today = date.today()
-    all_sources = Source.objects.exclude(reward_type='none').filter(
-        Q(opened_on__isnull=True) | Q(opened_on__lte=today)
-    ).filter(
-        Q(closed_on__isnull=True) | Q(closed_on__gte=today)
-    )
-
-    def effective_raw(source):
-        return configured[source.id] if source.id in configured else BLANKET_MULTIPLIERS.get(source.reward_type, Decimal('0'))
-
-    used_raw = effective_raw(transaction.source)
-    used_cmp = comparison_value(transaction.source, used_raw)
-
-    best_source = None
-    best_raw = used_raw
-    best_cmp = used_cmp
-    for source in all_sources:
-        raw = effective_raw(source)
-        cmp = comparison_value(source, raw)
-        if cmp > best_cmp:
-            best_cmp = cmp
-            best_raw = raw
-            best_source = source
-
-    if best_source is None:
-        return None
-
-    missed_value = (best_cmp - used_cmp) * transaction.amount
-    return {
-        'best_source_name': best_source.name,
-        'best_rate_label': format_rate_label(best_raw, best_source.reward_type),
-        'used_rate_label': format_rate_label(used_raw, transaction.source.reward_type),
-        'missed_value': missed_value,
-        'amount': transaction.amount,
-    }
-
-
-def format_rate_label(multiplier, reward_type):
-    if reward_type == 'cashback':
-        percent = multiplier * 100
-        if percent == int(percent):
-            return f"{int(percent)}%"
-        return f"{percent:.2f}%"
-    return f"{multiplier:.2f}x"
-
-
-def build_card_recommendations():
-    """For each category with configured reward multipliers, return the best card.
-    Blanket rates from all active cards are considered alongside explicit RewardCategory entries,
-    so a card with a strong all-category rate appears as a candidate for every relevant category.
-    """
-    current_quarter = quarter_label(date.today())
-    today = date.today()
-
-    active_sources = list(Source.objects.exclude(reward_type='none').filter(
-        Q(opened_on__isnull=True) | Q(opened_on__lte=today)
-    ).filter(
-        Q(closed_on__isnull=True) | Q(closed_on__gte=today)
-    ))
-
-    reward_cats = RewardCategory.objects.select_related('source', 'category').filter(
-        source__in=active_sources
-    )
-
-    # Build: category -> {source_id -> (multiplier, is_quarterly)}
-    # Start with blanket rates for all active sources across every category that has
-    # at least one explicit RewardCategory entry.
-    explicit_categories = {}  # category -> set of source_ids with explicit entries
-    configured = {}           # (category, source_id) -> (multiplier, is_quarterly)
-
-    for rc in reward_cats:
-        active_q = (not rc.applicable_quarter) or (rc.applicable_quarter == current_quarter)
-        if not active_q:
-            continue
-        cat = rc.category
-        if cat not in explicit_categories:
-            explicit_categories[cat] = set()
-        explicit_categories[cat].add(rc.source_id)
-        configured[(cat, rc.source_id)] = (rc.multiplier, bool(rc.applicable_quarter))
-
-    recommendations = []
-    for category in sorted(explicit_categories.keys(), key=lambda c: c.name):
-        entries = []
-        for source in active_sources:
-            if (category, source.id) in configured:
-                raw_multiplier, is_quarterly = configured[(category, source.id)]
-            else:
-                raw_multiplier = BLANKET_MULTIPLIERS.get(source.reward_type, Decimal('0'))
-                is_quarterly = False
-            entries.append((source, comparison_value(source, raw_multiplier), raw_multiplier, is_quarterly))
-
-        sorted_entries = sorted(entries, key=lambda e: e[1], reverse=True)
-        best_source, best_cmp, best_raw, is_quarterly = sorted_entries[0]
-        runner_up = sorted_entries[1] if len(sorted_entries) > 1 else None
-        recommendations.append({
-            'category': category,
-            'best_source': best_source,
-            'best_multiplier': best_raw,
-            'best_rate_label': format_rate_label(best_raw, best_source.reward_type),
-            'best_reward_type': best_source.reward_type,
-            'is_quarterly': is_quarterly,
-            'current_quarter': current_quarter,
-            'runner_up': {
-                'source': runner_up[0],
-                'multiplier': runner_up[2],
-                'rate_label': format_rate_label(runner_up[2], runner_up[0].reward_type),
-                'reward_type': runner_up[0].reward_type,
-            } if runner_up else None,
-        })
-    return recommendations
-
-
 def quarter_date_range(label):
     if not label or "Q" not in label:
         return None, None
@@ -249,51 +72,107 @@ def quarter_date_range(label):
     end_date = datetime(year, end_month, end_day).date()
     return start_date, end_date
 
+
+def transaction_years():
+    """Years spanned by the ledger, from the first to the last transaction.
+    Uses MIN/MAX on the date index instead of extracting the year from every row.
+    """
+    bounds = Transaction.objects.aggregate(min_date=Min('date'), max_date=Max('date'))
+    if not bounds['min_date']:
+        return []
+    return list(range(bounds['min_date'].year, bounds['max_date'].year + 1))
+
 # Create your views here.
 def index(request):
     """
     View function for the index page of the budget tool.
     """
-    # Auto-generate due recurring transactions on page load
-    generate_due_transactions()
+    # Generation normally runs from `manage.py generate_recurring`; catch up here only
+    # when an active rule has fallen due.
+    if generation_due():
+        generate_due_transactions()
 
     category_filter = request.GET.get('category')
     source_filter = request.GET.get('source')
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     search_query = request.GET.get('search', '').strip()
+    sort = request.GET.get('sort', '')
+    tag_filter = normalize_tag(request.GET.get('tag', ''))
 
     transactions_list = annotate_net_amount(
         Transaction.objects.all()
     ).order_by('-date')
 
     if search_query:
-        transactions_list = transactions_list.filter(
-            Q(description__icontains=search_query) |
-            Q(notes__icontains=search_query) |
-            Q(tags__icontains=search_query)
-        )
+        transactions_list = search_transactions(transactions_list, search_query)
     if category_filter:
         transactions_list = transactions_list.filter(
             Q(category__reporting_category_id=category_filter) | Q(category__id=category_filter)
         )
     if source_filter:
         transactions_list = transactions_list.filter(source__id=source_filter)
+    if tag_filter:
+        transactions_list = transactions_list.filter(tag_links__tag__name=tag_filter)
     if start_date:
         transactions_list = transactions_list.filter(date__gte=start_date)
     if end_date:
         transactions_list = transactions_list.filter(date__lte=end_date)
 
-    paginator = Paginator(transactions_list, 25)
-
-    page_number = request.GET.get('page',1)
-    transactions = paginator.get_page(page_number)
+    tag_spend = []
+    if tag_filter:
+        # Last twelve months of spend under the selected tag, oldest first.
+        this_month = date.today().replace(day=1)
+        tag_spend = [
+            {'month': date(year, month, 1), 'spend': spend}
+            for year, month, spend in tag_monthly_spend([tag_filter], add_months(this_month, -11), add_months(this_month, 1)).get(tag_filter, [])
+        ]
+
+    # Links keep the filters and replace only the paging parameters.
+    filter_params = request.GET.copy()
+    for key in ('page', 'after', 'before', 'count'):
+        filter_params.pop(key, None)
+
+    def page_url(**params):
+        query = filter_params.copy()
+        query.update(params)
+        return '?' + query.urlencode()
+
+    previous_url = next_url = None
+    if search_query and sort == 'relevance':
+        # Page through the ranked ids, then load only the rows on the page.
+        transactions = Paginator(ranked_ids(transactions_list, search_query), 25).get_page(request.GET.get('page', 1))
+        rows = transactions_list.in_bulk(transactions.object_list)
+        transactions.object_list = [rows[row_id] for row_id in transactions.object_list]
+        if transactions.has_previous():
+            previous_url = page_url(page=transactions.previous_page_number())
+        if transactions.has_next():
+            next_url = page_url(page=transactions.next_page_number())
+    else:
+        transactions = keyset_page(transactions_list, after=request.GET.get('after'), before=request.GET.get('before'))
+        if transactions.has_previous:
+            previous_url = page_url(before=transactions.previous_cursor)
+        if transactions.has_next:
+            next_url = page_url(after=transactions.next_cursor)
+
+    # An exact count of a filtered list scans every match, so it is only taken on request;
+    # the unfiltered total is the sum of the monthly rollup row counts.
+    total_count = None
+    if not any(value for key, value in filter_params.items() if key != 'upcoming_days'):
+        total_count = MonthlyRollup.objects.aggregate(total=Sum('row_count'))['total'] or 0
+    elif request.GET.get('count'):
+        total_count = transactions_list.count()
     categories = Category.objects.all()
     sources = Source.objects.all()
     today = datetime.now().strftime("%Y-%m-%d")
 
-    # Get upcoming recurring transactions (next 7 days)
-    upcoming_transactions = get_upcoming_transactions()
+    # Get upcoming recurring transactions (next 7 days unless another horizon is picked)
+    upcoming_days = request.GET.get('upcoming_days', '')
+    upcoming_days = int(upcoming_days) if upcoming_days.isdigit() else UPCOMING_HORIZONS[0]
+    if upcoming_days not in UPCOMING_HORIZONS:
+        upcoming_days = UPCOMING_HORIZONS[0]
+    upcoming_transactions = get_upcoming_transactions(upcoming_days)
+    show_upcoming = bool(upcoming_transactions) or RecurringTransaction.objects.filter(is_active=True).exists()
 
     context = {
         'transactions': transactions,
@@ -305,7 +184,22 @@ def index(request):
         'start_date': start_date,
         'end_date': end_date,
         'search_query': search_query,
+        'sort': sort,
+        'selected_tag': tag_filter,
+        'previous_url': previous_url,
+        'next_url': next_url,
+        'first_url': page_url() if previous_url else None,
+        'total_count': total_count,
+        'count_url': page_url(count=1),
+        'tag_facets': tag_facets(),
+        'tag_spend': tag_spend,
         'upcoming_transactions': upcoming_transactions,
+        'upcoming_days': upcoming_days,
+        'upcoming_links': [(days, page_url(upcoming_days=days)) for days in UPCOMING_HORIZONS],
+        'show_upcoming': show_upcoming,
+        'projection': projected_month_spend(),
+        'anomalies': spending_anomalies(),
+        'trend_lookback': SPEND_TREND_LOOKBACK_MONTHS,
     }
     return render(request, "tracker/index.html", context)
 
@@ -381,16 +275,19 @@ def add_transaction(request):
     )
     new_transaction.save()
 
-    # Check for potential duplicates (same date + amount, excluding this transaction)
-    duplicates = Transaction.objects.filter(
-        date=new_transaction.date,
-        amount=new_transaction.amount,
-    ).exclude(id=new_transaction.id)
-    if duplicates.exists():
-        dup = duplicates.first()
+    # Check for potential duplicates: same date + amount, or a similar description
+    # with a close amount a few days either side
+    duplicates = find_near_duplicates(
+        new_transaction.description,
+        datetime.strptime(request.POST['date'], "%Y-%m-%d").date(),
+        Decimal(str(amount)),
+        exclude_id=new_transaction.id,
+    )
+    if duplicates:
+        dup = duplicates[0]
         messages.warning(
             request,
-            f'Possible duplicate: "{dup.description}" on {dup.date} for ${dup.amount:.2f} already exists.'
+            f'Possible duplicate: "{dup["description"]}" on {dup["date"]} for ${dup["amount"]:.2f} already exists.'
         )
 
     tip = get_better_card_tip(new_transaction)
@@ -480,90 +377,14 @@ def is_valid_date(date_str):
         return False
 
 
-def add_months(d, months):
-    month = d.month - 1 + months
-    year = d.year + month // 12
-    month = month % 12 + 1
-    day = min(d.day, calendar.monthrange(year, month)[1])
-    return d.replace(year=year, month=month, day=day)
-
-
-def get_next_occurrence(recurring):
-    if recurring.frequency == 'weekly':
-        if recurring.last_generated:
-            next_date = recurring.last_generated + timedelta(weeks=recurring.interval)
-        else:
-            next_date = recurring.start_date
-            if recurring.day_of_week is not None:
-                days_ahead = recurring.day_of_week - next_date.weekday()
-                if days_ahead < 0:
-                    days_ahead += 7
-                next_date = next_date + timedelta(days=days_ahead)
-        return next_date
-
-    elif recurring.frequency == 'monthly':
-        if recurring.last_generated:
-            next_date = add_months(recurring.last_generated, recurring.interval)
-        else:
-            next_date = recurring.start_date
-        day = min(recurring.day_of_month, calendar.monthrange(next_date.year, next_date.month)[1])
-        next_date = next_date.replace(day=day)
-        return next_date
-
-    elif recurring.frequency == 'yearly':
-        if recurring.last_generated:
-            next_date = add_months(recurring.last_generated, recurring.interval * 12)
-        else:
-            next_date = recurring.start_date
-        day = min(recurring.day_of_month, calendar.monthrange(next_date.year, next_date.month)[1])
-        next_date = next_date.replace(day=day)
-        return next_date
-
-    return None
-
-
-def generate_due_transactions():
-    today = date.today()
-    recurring_list = RecurringTransaction.objects.filter(is_active=True)
-
-    for recurring in recurring_list:
-        if recurring.end_date and recurring.end_date < today:
-            recurring.is_active = False
-            recurring.save()
-            continue
-
-        next_date = get_next_occurrence(recurring)
-
-        while next_date and next_date <= today:
-            if recurring.end_date and next_date > recurring.end_date:
-                recurring.is_active = False
-                recurring.save()
-                break
-            Transaction.objects.create(
-                description=recurring.description,
-                amount=recurring.amount,
-                date=next_date,
-                category=recurring.category,
-                source=recurring.source,
-                recurring_source=recurring,
-            )
-            recurring.last_generated = next_date
-            recurring.save()
-            next_date = get_next_occurrence(recurring)
-
-
-def get_upcoming_transactions():
-    today = date.today()
-    upcoming = []
-    for recurring in RecurringTransaction.objects.filter(is_active=True):
-        next_date = get_next_occurrence(recurring)
-        if next_date and today < next_date <= today + timedelta(days=7):
-            upcoming.append({
-                'recurring': recurring,
-                'date': next_date,
-            })
-    upcoming.sort(key=lambda x: x['date'])
-    return upcoming
+def get_upcoming_transactions(days=UPCOMING_HORIZONS[0]):
+    return [
+        {
+            'recurring': recurring,
+            'date': recurring.next_due,
+        }
+        for recurring in upcoming_recurring(days=days)
+    ]
 
 
 def add_recurring_transaction(request):
@@ -737,7 +558,7 @@ def add_from_recurring(request, recurring_id):
         amount = float(recurring.amount)
 
     if not date_str or not is_valid_date(date_str):
-        next_date = get_next_occurrence(recurring)
+        next_date = recurring.next_due
         date_str = next_date.isoformat() if next_date else date.today().isoformat()
 
     try:
@@ -906,13 +727,12 @@ def settings_page(request):
     recurring_transactions = RecurringTransaction.objects.filter(is_active=True)
     recurring_with_next = []
     for rt in recurring_transactions:
-        next_date = get_next_occurrence(rt)
         recurring_with_next.append({
             'recurring': rt,
-            'next_date': next_date,
+            'next_date': rt.next_due,
         })
 
-    recurring_suggestions = detect_recurring_patterns()
+    recurring_suggestions = detect_recurring_patterns(mode='merchant')
 
     context = {
         'categories': categories,
@@ -1148,89 +968,25 @@ def delete_transaction(request, transaction_id):
 
 
 def reports_view(request):
-    income_total_amount = None
-    final_line_data = None 
-    year_values = (
-        Transaction.objects.annotate(year=ExtractYear("date"))
-        .values_list("year", flat=True)
-        .distinct()
-        .order_by("year")
-    )
+    year_values = transaction_years()
     # Handle month/year selection
     month = int(request.GET.get("month", datetime.today().month))
     year = int(request.GET.get("year", datetime.today().year))
 
-    month_name = str(year) + '-' + str(month).zfill(2)
-
-    daily_totals = []
-    month_data = Month.objects.filter(name=month_name).first()
-    if month_data:
-        daily_totals = month_data.daily_spend
-        income_total_amount = float(month_data.total_income)
-        total_spent = float(month_data.total_spend)
-
-        final_line_data = []
-        for i, daily_total in enumerate(daily_totals):
-            date = datetime(year, month, i + 1)
-            final_line_data.append({
-                "date": date.strftime("%Y-%m-%d"),
-                "cumulative": float(daily_total)
-            })
-    
-    base_transactions = annotate_net_amount(
-        Transaction.objects.filter(date__month=month, date__year=year)
-    )
-    transactions = base_transactions.exclude(category__name__iexact='income').exclude(
-        category__reporting_category__name__iexact='income'
-    ).exclude(CREDIT_CATEGORY_Q)
+    # Daily cumulative spend and income come from the Month cache, computed once per month
+    # and invalidated whenever a transaction in that month changes.
+    month_data = get_month_summary(year, month)
+    income_total_amount = float(month_data.total_income)
+    days_in_month = calendar.monthrange(year, month)[1]
+    final_line_data = [
+        {"date": date(year, month, day).strftime("%Y-%m-%d"), "cumulative": float(cumulative)}
+        for day, cumulative in enumerate(month_data.daily_spend[:days_in_month], start=1)
+    ]
 
-    if income_total_amount is None:
-        income_total = base_transactions.filter(
-            Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
-        ).exclude(CREDIT_CATEGORY_Q).aggregate(total=Sum('net_amount'))
+    month_rollups = rollups_between(year, month, year, month)
 
-        income_total_amount = float(income_total['total']) if income_total['total'] else 0
-    
     # Pie chart data (by category)
-    pie_data = (
-        annotate_reporting_category(transactions)
-        .values("reporting_category_id", "reporting_category_name", "reporting_category_budget")
-        .annotate(total=Sum("net_amount") * -1)
-    )
-
-    if final_line_data is None:
-        # Line chart data (cumulative spend by date)
-        daily_totals = (
-            transactions.order_by("date")
-            .values("date")
-            .annotate(daily_total=Sum("net_amount"))
-        )
-        cumulative_total = 0
-        line_data = [{"date": datetime(year, month, 1).strftime("%Y-%m-%d"), "cumulative": 0}]
-        dates = {}
-        for item in daily_totals:
-            cumulative_total += item["daily_total"] * -1
-            line_data.append({"date": item["date"].strftime("%Y-%m-%d"), "cumulative": float(cumulative_total)})
-            dates[item["date"].isoformat()] = True
-
-        new_line_data = []
-        for data in line_data:
-            tomorrow = datetime.strptime(data['date'], '%Y-%m-%d') + timedelta(days=1)
-            first_of_next_month = datetime(year, month+1, 1) if month < 12 else datetime(year+1, 1, 1)
-            while (tomorrow.strftime('%Y-%m-%d') not in dates) and tomorrow < first_of_next_month:
-                new_line_data.append({"date": tomorrow.strftime('%Y-%m-%d'), 'cumulative': data['cumulative']})
-                dates[tomorrow.isoformat()] = True
-                tomorrow = tomorrow + timedelta(days=1)
-
-        ld_idx = nld_idx = 0
-        final_line_data = []
-        while len(final_line_data) < (len(line_data) + len(new_line_data)):
-            if nld_idx >= len(new_line_data) or (ld_idx < len(line_data) and line_data[ld_idx]['date'] < new_line_data[nld_idx]['date']):
-                final_line_data.append(line_data[ld_idx])
-                ld_idx += 1
-            else:
-                final_line_data.append(new_line_data[nld_idx])
-                nld_idx += 1
+    pie_data = reporting_category_totals(month_rollups, MonthlyRollup.KIND_SPEND, negate=True)
 
     total_spent = float(sum([x["total"] for x in pie_data]))
 
@@ -1344,23 +1100,6 @@ def reports_view(request):
     has_avg_trend = months_with_data > 0
     avg_trend = [round(v / months_with_data, 2) for v in avg_trend_values] if has_avg_trend else []
 
-    if not month_data:
-        # print(final_line_data)
-        if final_line_data[1]['date'] == final_line_data[0]['date']:
-            final_line_data = final_line_data[1:]  # Remove the first element if it's a duplicate
-        # print(final_line_data)
-        daily_totals = []
-        for element in final_line_data:
-            # Append daily spend to the list, defaulting to 0 if not present
-            daily_totals.append(float(element["cumulative"]) if element["cumulative"] else 0)
-
-        # print(len(daily_totals))
-        if len(daily_totals) < 31:
-            # Fill in the remaining days with 0 if there are less than 31 days
-            daily_totals.extend([daily_totals[-1]] * (31 - len(daily_totals)))
-        # Create a new Month entry if it doesn't exist (not saved — ArrayField requires PostgreSQL)
-        month_data = Month(name=month_name, total_spend=total_spent, total_income=income_total_amount, daily_spend=daily_totals)
-
     context = {
         "selected_month": month,
         "selected_year": year,
@@ -1371,6 +1110,8 @@ def reports_view(request):
         "avg_trend": avg_trend,
         "has_avg_trend": has_avg_trend,
         "trend_lookback": SPEND_TREND_LOOKBACK_MONTHS,
+        "projection": projected_month_spend() if is_current_month else None,
+        "anomalies": spending_anomalies() if is_current_month else [],
         "table_data": table_data,
         "months": [(i, calendar.month_name[i]) for i in range(1, 13)],
         "years": list(year_values),
@@ -1380,115 +1121,53 @@ def reports_view(request):
 
 def import_csv_preview(request):
     if request.method == "POST" and request.FILES.get("csv_file"):
-        csv_file = request.FILES["csv_file"]
-        decoded_file = TextIOWrapper(csv_file.file, encoding="utf-8")
-        reader = csv.DictReader(decoded_file)
-        # print("HEADERS:", reader.fieldnames)
-
-
-        column_aliases = {
-            "description": ["description", "desc", "details"],
-            "amount": ["amount", "amt", "value"],
-            "date": ["date", "transaction date", "timestamp"],
-            "category": ["category", "type", "label"],
-            "source": ["source", "payment method", "account", "wallet", "account/card from"],
-        }
-
-        # Map lowercase header -> original header
-        header_map = {header.lower().strip(): header for header in reader.fieldnames}
-
-        # Map desired keys to original headers
-        column_map = {}
-        for key, aliases in column_aliases.items():
-            for alias in aliases:
-                if alias.lower() in header_map:
-                    column_map[key] = header_map[alias.lower()]
-                    break
-
-
-        # Store headers + rows in session for confirmation step
-        preview_rows = []
-        rows = []
-        for i, row in enumerate(reader):
-            # print("RAW CSV ROW:", row)
-            if i < 10:  # Show only first 10 rows
-                preview_rows.append({k: row.get(v, "") for k, v in column_map.items()})
-            rows.append({k: row.get(v, "") for k, v in column_map.items()})
-
-        request.session["csv_data"] = {
-            "rows": rows,
-            "column_map": column_map,
+        # Parsed rows are staged in a temporary file; the session only keeps its token.
+        previous = request.session.pop("csv_import", None)
+        if previous:
+            discard_staged(previous["token"])
+
+        staged = stage_upload(request.FILES["csv_file"])
+        first_date, last_date = staged["date_range"]
+        request.session["csv_import"] = {
+            "token": staged["token"],
+            "date_range": [d.isoformat() if d else None for d in (first_date, last_date)],
         }
 
-        # Flag potential duplicates in preview rows
-        for row in preview_rows:
-            try:
-                date_str = row.get("date", "")
-                amount_str = row.get("amount", "")
-                if date_str and amount_str:
-                    try:
-                        parsed_date = datetime.strptime(date_str, "%m/%d/%y").date()
-                    except ValueError:
-                        parsed_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                    parsed_amount = float(amount_str.replace("$", "").replace(",", ""))
-                    if Transaction.objects.filter(date=parsed_date, amount=parsed_amount).exists():
-                        row["duplicate"] = True
-            except (ValueError, TypeError):
-                pass
-
         return render(request, "tracker/import_preview.html", {
-            "preview_rows": preview_rows,
-            "column_map": column_map,
+            "preview_rows": staged["preview_rows"],
+            "column_map": staged["column_map"],
+            "row_count": staged["row_count"],
+            "duplicate_count": staged["duplicate_count"],
+            "errors": staged["errors"][:50],
+            "error_count": len(staged["errors"]),
         })
 
     return HttpResponseRedirect("/")
 
 def import_csv_confirm(request):
-    data = request.session.get("csv_data", {})
+    if request.method != "POST":
+        return HttpResponseRedirect("/")
+    data = request.session.pop("csv_import", None)
     if not data:
         return HttpResponseRedirect("/")
 
-    column_map = data.get("column_map", {})
-    rows = data.get("rows", [])
-
-    for row in rows:
-        try:
-            category = row.get("category")
-            source = row.get("source")
-            category_obj = Category.objects.get_or_create(name=category)[0] if category else None
-            source_obj = Source.objects.get_or_create(name=source)[0] if source else None
-
-            # Clean date format from m/d/yy to YYYY-MM-DD
-            date_str = row.get("date")
-            if date_str:
-                try:
-                    date_cleaned = datetime.strptime(date_str, "%m/%d/%y").date()
-                except ValueError:
-                    # Handle invalid date format
-                    date_cleaned = datetime.strptime(date_str, "%Y-%m-%d").date()
-            else:
-                date_cleaned = None
+    date_range = [date.fromisoformat(d) if d else None for d in data["date_range"]]
+    try:
+        result = import_staged(data["token"], date_range)
+    except OSError:
+        messages.warning(request, "That import has expired. Please upload the file again.")
+        return HttpResponseRedirect("/")
 
-            # Clean amount format from $1,234.56 to 1234.56
-            amount_str = row.get("amount")
-            if amount_str:
-                amount_cleaned = float(amount_str.replace("$", "").replace(",", ""))
-            else:
-                amount_cleaned = None
-            
-            Transaction.objects.get_or_create(
-                description=row["description"],
-                amount=amount_cleaned,
-                date=date_cleaned,
-                category=category_obj,
-                source=source_obj,
-            )
-        except Exception as e:
-            print(f"Error importing row: {row} — {e}")
-
-    # Clear session after import
-    del request.session["csv_data"]
+    messages.success(request, f"Imported {result['created']} transactions.")
+    if result["skipped"]:
+        messages.info(request, f"Skipped {result['skipped']} rows that were already recorded.")
+    return HttpResponseRedirect("/")
 
+def import_csv_cancel(request):
+    if request.method == "POST":
+        data = request.session.pop("csv_import", None)
+        if data:
+            discard_staged(data["token"])
     return HttpResponseRedirect("/")
 
 from django.db.models import Sum, F
@@ -1520,13 +1199,7 @@ def ytd_report(request):
 
     if view_mode == "ttm":
         months = [shift_month(current_year, current_month, -offset) for offset in range(11, -1, -1)]
-        start_year, start_month = months[0]
-        start_date = datetime(start_year, start_month, 1).date()
-        end_date = now.date()
         months_count = 12
-        transactions = annotate_net_amount(
-            Transaction.objects.filter(date__gte=start_date, date__lte=end_date)
-        )
     else:
         if year == current_year:
             months = [(year, month) for month in range(1, current_month + 1)]
@@ -1534,30 +1207,13 @@ def ytd_report(request):
         else:
             months = [(year, month) for month in range(1, 13)]
             months_count = 12
-        transactions = annotate_net_amount(
-            Transaction.objects.filter(date__year=year)
-        )
+    # Income, spend and per-category totals for every month in one grouped query
+    totals = period_totals(months)
 
     # Total spent per reporting category (excluding income)
-    spending_data = (
-        annotate_reporting_category(
-            transactions.exclude(category__name__iexact='income').exclude(
-                category__reporting_category__name__iexact='income'
-            ).exclude(CREDIT_CATEGORY_Q)
-        )
-        .values('reporting_category_id', 'reporting_category_name', 'reporting_category_budget')
-        .annotate(total=Sum('net_amount') * -1)
-    )
+    spending_data = totals['spending_by_category']
 
-    income_data = (
-        annotate_reporting_category(
-            transactions.filter(
-                Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
-            ).exclude(CREDIT_CATEGORY_Q)
-        )
-        .values('reporting_category_id', 'reporting_category_name', 'reporting_category_budget')
-        .annotate(total=Sum('net_amount'))
-    )
+    income_data = totals['income_by_category']
 
     show_remaining = (view_mode == 'ytd' and year == current_year)
     months_remaining = 12 - current_month if show_remaining else 0
@@ -1636,40 +1292,22 @@ def ytd_report(request):
         'avg_surplus': (income_data['avg_surplus'] + (total_budget - total_spend)),
         'total_surplus': (income_data['total_surplus'] + ((total_budget - total_spend) * months_count))
     }
-    # Net savings = income - spending for each month
+    # Net savings = income - spending for each month, with a 3-month running average
     savings_chart_data = []
-    savings_history = []
+    running_averages = running_average([entry['savings'] for entry in totals['months']], window=3)
 
-    for chart_year, chart_month in months:
+    for entry, running in zip(totals['months'], running_averages):
         if view_mode == "ttm":
-            month_label = f"{calendar.month_abbr[chart_month]} '{str(chart_year)[-2:]}"
+            month_label = f"{calendar.month_abbr[entry['month']]} '{str(entry['year'])[-2:]}"
         else:
-            month_label = month_name[chart_month][:3]
-        income = transactions.filter(
-            date__year=chart_year,
-            date__month=chart_month,
-            category__name__iexact='income'
-        ).exclude(CREDIT_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total'] or 0
-
-        spend = transactions.exclude(
-            category__name__iexact='income'
-        ).exclude(CREDIT_CATEGORY_Q).filter(
-            date__year=chart_year,
-            date__month=chart_month
-        ).aggregate(total=Sum('net_amount'))['total'] or 0
-
-        savings = income + spend
-        savings_history.append(savings)
-        recent_history = savings_history[-3:]
-
-        running_average = sum(recent_history) / len(recent_history)
+            month_label = month_name[entry['month']][:3]
 
         savings_chart_data.append({
             'month': month_label,
-            'income': float(round(income, 2)),
-            'spend': float(round(spend, 2)),
-            'savings': float(round(savings, 2)),
-            'running': float(round(running_average, 2))
+            'income': float(round(entry['income'], 2)),
+            'spend': float(round(entry['spend'], 2)),
+            'savings': float(round(entry['savings'], 2)),
+            'running': float(round(running, 2))
         })
 
     if view_mode == 'ttm':
@@ -1686,7 +1324,8 @@ def ytd_report(request):
         period_label = str(year)
 
     # Determine available years from transaction data
-    min_year = Transaction.objects.aggregate(min_year=Min('date__year'))['min_year'] or current_year
+    min_date = Transaction.objects.aggregate(min_date=Min('date'))['min_date']
+    min_year = min_date.year if min_date else current_year
     prev_year = year - 1 if year > min_year else None
     next_year = year + 1 if year < current_year else None
 
@@ -1711,62 +1350,106 @@ def ytd_report(request):
     return render(request, 'tracker/ytd.html', context)
 
 def mtd_report(request):
-    month = datetime.now().month
-    year = datetime.now().year
+    """
+    Month-to-date report: daily and cumulative income/spend for the month, plus a
+    per-category table comparing spend so far against the budget's pro-rated pace.
+    Defaults to the current month; ?year=&month= shows a past month in full.
+    """
+    today = date.today()
+    try:
+        year = int(request.GET.get("year", today.year))
+        month = int(request.GET.get("month", today.month))
+        month_start, month_end = month_date_range(year, month)
+    except (ValueError, TypeError):
+        year, month = today.year, today.month
+        month_start, month_end = month_date_range(year, month)
+
+    days_in_month = calendar.monthrange(year, month)[1]
+    if (year, month) == (today.year, today.month):
+        days_elapsed = today.day
+    elif month_start > today:
+        days_elapsed = 0
+    else:
+        days_elapsed = days_in_month
+    month_fraction = days_elapsed / days_in_month
 
-    # Transactions for the current month
-    transactions = annotate_net_amount(
-        Transaction.objects.filter(date__year=year, date__month=month)
-    )
+    # Daily income and spend for the whole month in one GROUP BY date
+    by_date = daily_totals(month_start, month_end)
 
-    # Total spent per reporting category (excluding income)
-    spending_data = (
-        annotate_reporting_category(
-            transactions.exclude(category__name__iexact='income').exclude(
-                category__reporting_category__name__iexact='income'
-            ).exclude(CREDIT_CATEGORY_Q)
-        )
-        .values('reporting_category_name', 'reporting_category_budget')
-        .annotate(total=Sum('net_amount') * -1)
-    )
+    categories = list(Category.objects.filter(reporting_category__isnull=True))
+    total_budget = sum(float(c.budget) for c in categories if c.name.lower() != 'income' and c.budget)
 
-    mtd_data = []
-    for entry in spending_data:
-        avg_per_month = entry['total'] / month
-        budget = entry['reporting_category_budget'] or 0
-        avg_surplus = budget - avg_per_month
-        mtd_data.append({
-            'category__name': entry['reporting_category_name'],
-            'total': entry['total'],
-            'avg_per_month': avg_per_month,
-            'budget': budget,
-            'avg_surplus': avg_surplus,
-            'total_surplus': avg_surplus * month,
-        })
-
-    # Net savings = income - spending for each month
     savings_chart_data = []
-    for day in range(1, 31):  # Assuming 30 days in a month for simplicity
-        income = transactions.filter(
-            date__day=day,
-            category__name__iexact='income'
-        ).exclude(CREDIT_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total'] or 0
+    cumulative_income = 0.0
+    cumulative_spend = 0.0
+    for day in range(1, days_in_month + 1):
+        totals = by_date.get(date(year, month, day), {'income': 0, 'spend': 0})
+        income = float(totals['income'])
+        spend = float(totals['spend']) * -1
+        entry = {
+            'day': day,
+            'income': round(income, 2),
+            'spend': round(spend, 2),
+            'savings': round(income - spend, 2),
+            'budget_pace': round(total_budget * day / days_in_month, 2),
+        }
+        if day <= days_elapsed:
+            cumulative_income += income
+            cumulative_spend += spend
+            entry['cumulative_income'] = round(cumulative_income, 2)
+            entry['cumulative_spend'] = round(cumulative_spend, 2)
+            entry['cumulative_savings'] = round(cumulative_income - cumulative_spend, 2)
+        savings_chart_data.append(entry)
+
+    # Spend so far per reporting category vs. the budget pro-rated to today
+    spent_by_category = {
+        entry['reporting_category_id']: entry
+        for entry in reporting_category_totals(
+            rollups_between(year, month, year, month), MonthlyRollup.KIND_SPEND, negate=True
+        )
+    }
+    rows = [
+        (c.id, c.name, float(c.budget or 0), float(spent_by_category.get(c.id, {}).get('total') or 0))
+        for c in categories if c.name.lower() != 'income'
+    ]
+    known_ids = {c.id for c in categories}
+    rows += [
+        (category_id, entry['reporting_category_name'] or 'Uncategorized', float(entry['reporting_category_budget'] or 0), float(entry['total']))
+        for category_id, entry in spent_by_category.items() if category_id not in known_ids
+    ]
 
-        spend = transactions.exclude(
-            category__name__iexact='income'
-        ).exclude(CREDIT_CATEGORY_Q).filter(date__day=day).aggregate(total=Sum('net_amount'))['total'] or 0
+    def pace_row(name, budget, spent, category_id=None):
+        expected = budget * month_fraction
+        projected = spent / days_elapsed * days_in_month if days_elapsed else 0
+        return {
+            'category__name': name,
+            'category__id': category_id,
+            'total': spent,
+            'budget': budget,
+            'expected_to_date': expected,
+            'pace_percent': round(spent / expected * 100, 1) if expected > 0 else None,
+            'projected': projected,
+            'projected_surplus': budget - projected,
+            'is_over_pace': spent > expected,
+        }
 
-        savings_chart_data.append({
-            'day': day,
-            'income': float(round(income, 2)),
-            'spend': float(round(spend, 2)),
-            'savings': float(round(income + spend, 2))
-        })
+    mtd_data = [pace_row(name, budget, spent, category_id) for category_id, name, budget, spent in rows if budget or spent]
+    mtd_data.sort(key=lambda row: row['total'], reverse=True)
+    total_data = pace_row('Total Spend', sum(r['budget'] for r in mtd_data), sum(r['total'] for r in mtd_data))
 
-    print(savings_chart_data)
     context = {
         'mtd_data': mtd_data,
-        'savings_chart_data': savings_chart_data
+        'total_data': total_data,
+        'savings_chart_data': savings_chart_data,
+        'month_label': f"{calendar.month_name[month]} {year}",
+        'selected_year': year,
+        'selected_month': month,
+        'days_elapsed': days_elapsed,
+        'days_in_month': days_in_month,
+        'income_to_date': round(cumulative_income, 2),
+        'spend_to_date': round(cumulative_spend, 2),
+        'months': [(i, calendar.month_name[i]) for i in range(1, 13)],
+        'years': transaction_years() or [today.year],
     }
 
     return render(request, 'tracker/mtd.html', context)
@@ -1776,12 +1459,6 @@ def rewards_tracker(request):
     selected_year = request.GET.get('year')
     selected_year = int(selected_year) if selected_year and selected_year.isdigit() else datetime.now().year
 
-    transaction_years = (
-        Transaction.objects.annotate(year=ExtractYear("date"))
-        .values_list("year", flat=True)
-        .distinct()
-        .order_by("year")
-    )
     quarter_years = RewardCategory.objects.exclude(applicable_quarter__isnull=True).exclude(
         applicable_quarter__exact=""
     ).values_list("applicable_quarter", flat=True)
@@ -1791,7 +1468,7 @@ def rewards_tracker(request):
             year_part = label.split("Q", 1)[0]
             if year_part.isdigit():
                 quarter_year_values.append(int(year_part))
-    years = sorted(set(list(transaction_years) + quarter_year_values))
+    years = sorted(set(transaction_years() + quarter_year_values))
     if not years:
         years = [selected_year]
     if selected_year not in years and years:
@@ -1805,379 +1482,96 @@ def rewards_tracker(request):
             output_field=BooleanField(),
         )
     ).order_by('-has_rewards', 'name')
-    sources_data = []
-    total_miles_earned = 0
-    total_cashback_earned = 0
-    total_credits_earned = 0
     today = datetime.now().strftime("%Y-%m-%d")
 
-    def cashback_label(value):
-        percent = value * 100
-        if percent.is_integer():
-            return f"{int(percent)}%"
-        return f"{percent:.2f}%"
-
-    def signup_bonus_miles_for_year(source):
-        bonus_miles = float(source.signup_bonus_miles or 0)
-        min_spend = float(source.signup_bonus_min_spend or 0)
-        if bonus_miles <= 0 or min_spend <= 0:
-            return 0, None
-
-        awarded_on = source.signup_bonus_awarded_on
-        bonus_transactions = list(
-            Transaction.objects.filter(source=source)
-            .exclude(Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income'))
-            .exclude(CREDIT_CATEGORY_Q)
-            .exclude(Q(category__name__icontains='rent') | Q(category__reporting_category__name__icontains='rent'))
-            .order_by('date', 'id')
-            .values_list('date', 'amount')
-        )
-        if awarded_on:
-            total_spend = 0
-            for txn_date, txn_amount in bonus_transactions:
-                if txn_date > awarded_on:
-                    break
-                total_spend += abs(float(txn_amount))
-            if total_spend < min_spend:
-                awarded_on = None
-                source.signup_bonus_awarded_on = None
-                source.save(update_fields=['signup_bonus_awarded_on'])
-        if not awarded_on:
-            total_spend = 0
-            for txn_date, txn_amount in bonus_transactions:
-                total_spend += abs(float(txn_amount))
-                if total_spend >= min_spend:
-                    awarded_on = txn_date
-                    source.signup_bonus_awarded_on = awarded_on
-                    source.save(update_fields=['signup_bonus_awarded_on'])
-                    break
-
-        if awarded_on and awarded_on.year == selected_year:
-            return bonus_miles, awarded_on
-        return 0, awarded_on
-
-    for source in sources:
-        reward_entries = RewardCategory.objects.filter(source=source).select_related('category', 'category__reporting_category')
-        reward_rows = []
-        total_rewards = 0
-        total_rewards_miles = 0
-        total_rewards_cash = 0
-        total_spend = 0
-        covered_spend = 0
-
-        base_transactions = Transaction.objects.filter(source=source, date__year=selected_year).exclude(
-            Q(category__name__iexact='income') | Q(category__reporting_category__name__iexact='income')
-        ).exclude(CREDIT_CATEGORY_Q)
-        total_source_spend = abs(float(base_transactions.aggregate(total=Sum('amount'))['total'] or 0))
-
-        if source.reward_type == 'card_cash_miles':
-            rent_filter = Q(category__name__icontains='rent') | Q(category__reporting_category__name__icontains='rent')
-            rent_transactions = base_transactions.filter(rent_filter)
-            non_rent_transactions = base_transactions.exclude(rent_filter)
-
-            rent_spend = abs(float(rent_transactions.aggregate(total=Sum('amount'))['total'] or 0))
-            non_rent_spend = abs(float(non_rent_transactions.aggregate(total=Sum('amount'))['total'] or 0))
-
-            non_rent_miles = non_rent_spend * 2.0
-            card_cash_earned = non_rent_spend * 0.04
-            card_cash_credit_total = Transaction.objects.filter(
-                source=source,
-                category__name__istartswith='card-cash-',
-                date__year=selected_year
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            card_cash_credits = abs(float(card_cash_credit_total))
-            card_cash_pool = card_cash_earned + card_cash_credits
-            rent_coverable = card_cash_pool / 0.03 if card_cash_pool else 0
-            rent_points = min(rent_spend, rent_coverable)
-            bilt_cash_used = rent_points * 0.03
-            miles_credit_total = Transaction.objects.filter(
-                source=source,
-                category__name__istartswith='miles-credit-',
-                date__year=selected_year
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            miles_credit_amount = abs(float(miles_credit_total))
-            credit_total = Transaction.objects.filter(
-                source=source,
-                category__name__istartswith='credit-',
-                date__year=selected_year
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            credit_amount = abs(float(credit_total))
-
-            if non_rent_spend > 0:
-                reward_rows.append({
-                    'category_name': 'Non-Rent Spend (Miles)',
-                    'reporting_category_name': None,
-                    'multiplier': 2.0,
-                    'multiplier_label': None,
-                    'spend': non_rent_spend,
-                    'rewards': non_rent_miles,
-                    'rewards_format': 'miles',
-                })
-                reward_rows.append({
-                    'category_name': 'Card Cash Earned',
-                    'reporting_category_name': None,
-                    'multiplier': 0.04,
-                    'multiplier_label': cashback_label(0.04),
-                    'spend': non_rent_spend,
-                    'rewards': card_cash_earned,
-                    'rewards_format': 'cash',
-                })
-
-            if card_cash_credits > 0:
-                reward_rows.append({
-                    'category_name': 'Card Cash Credits',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Credit',
-                    'spend': 0,
-                    'rewards': card_cash_credits,
-                    'rewards_format': 'cash',
-                })
-            if miles_credit_amount > 0:
-                reward_rows.append({
-                    'category_name': 'Miles Credits',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Credit',
-                    'spend': 0,
-                    'rewards': miles_credit_amount,
-                    'rewards_format': 'miles',
-                })
-
-            if rent_spend > 0:
-                reward_rows.append({
-                    'category_name': 'Rent (Redeemed Points)',
-                    'reporting_category_name': None,
-                    'multiplier': 1.0,
-                    'multiplier_label': f'1x (${bilt_cash_used:.2f} Bilt Cash used)',
-                    'spend': rent_points,
-                    'rewards': rent_points,
-                    'rewards_format': 'miles',
-                })
-
-            card_cash_remaining = card_cash_pool - bilt_cash_used
-            reward_rows.append({
-                'category_name': 'Bilt Cash Remaining',
-                'reporting_category_name': None,
-                'multiplier': 0,
-                'multiplier_label': 'Balance',
-                'spend': 0,
-                'rewards': card_cash_remaining,
-                'rewards_format': 'cash',
-            })
-
-            if credit_amount > 0:
-                reward_rows.append({
-                    'category_name': 'Credits',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Credit',
-                    'spend': 0,
-                    'rewards': credit_amount,
-                    'rewards_format': 'cash',
-                    'is_credit': True,
-                })
-
-            bonus_miles, _ = signup_bonus_miles_for_year(source)
-            if bonus_miles > 0:
-                reward_rows.append({
-                    'category_name': 'Signup Bonus',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Bonus',
-                    'spend': 0,
-                    'rewards': bonus_miles,
-                    'rewards_format': 'miles',
-                })
-
-            total_spend = non_rent_spend + rent_spend
-            total_rewards_miles = non_rent_miles + rent_points + bonus_miles + miles_credit_amount
-            total_rewards_cash = credit_amount
-            total_rewards = total_rewards_miles + total_rewards_cash
-
-            sources_data.append({
-                'source': source,
-                'reward_rows': reward_rows,
-                'has_quarterly': False,
-                'total_spend': total_spend,
-                'total_rewards': total_rewards,
-                'total_rewards_miles': total_rewards_miles,
-                'total_rewards_cash': total_rewards_cash,
-            })
-            total_miles_earned += total_rewards_miles
-            total_credits_earned += total_rewards_cash
-            continue
-
-        for entry in reward_entries:
-            if entry.applicable_quarter:
-                quarter_start, quarter_end = quarter_date_range(entry.applicable_quarter)
-                if not quarter_start or not quarter_end or quarter_start.year != selected_year:
-                    continue
-            transaction_query = Transaction.objects.filter(
-                source=source,
-                category=entry.category
-            )
-            if entry.applicable_quarter:
-                quarter_start, quarter_end = quarter_date_range(entry.applicable_quarter)
-                if quarter_start and quarter_end:
-                    transaction_query = transaction_query.filter(
-                        date__gte=quarter_start,
-                        date__lte=quarter_end
-                    )
-            else:
-                transaction_query = transaction_query.filter(date__year=selected_year)
-            transaction_total = transaction_query.aggregate(total=Sum('amount'))['total'] or 0
-            spend = abs(float(transaction_total))
-            multiplier = float(entry.multiplier)
-            rewards = spend * multiplier
-
-            reward_rows.append({
-                'category_name': entry.category.name,
-                'reporting_category_name': entry.category.reporting_category.name if entry.category.reporting_category else None,
-                'multiplier': multiplier,
-                'multiplier_label': cashback_label(multiplier) if source.reward_type == 'cashback' else None,
-                'applicable_quarter': entry.applicable_quarter,
-                'quarter_label': f"Q{entry.applicable_quarter.split('Q', 1)[1]}" if entry.applicable_quarter and "Q" in entry.applicable_quarter else None,
-                'spend': spend,
-                'rewards': rewards,
-                'rewards_format': 'cash' if source.reward_type == 'cashback' else 'miles',
-            })
-            covered_spend += spend
-            total_spend += spend
-            total_rewards += rewards
-            if source.reward_type == 'miles':
-                total_rewards_miles += rewards
-            elif source.reward_type == 'cashback':
-                total_rewards_cash += rewards
-
-        if source.reward_type == 'miles':
-            bonus_miles, _ = signup_bonus_miles_for_year(source)
-            if bonus_miles > 0:
-                reward_rows.append({
-                    'category_name': 'Signup Bonus',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Bonus',
-                    'spend': 0,
-                    'rewards': bonus_miles,
-                    'rewards_format': 'miles',
-                    'is_bonus': True,
-                })
-                total_rewards += bonus_miles
-                total_rewards_miles += bonus_miles
-
-        if source.reward_type == 'miles':
-            miles_credit_total = Transaction.objects.filter(
-                source=source,
-                category__name__istartswith='miles-credit-',
-                date__year=selected_year
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            miles_credit_amount = abs(float(miles_credit_total))
-            if miles_credit_amount > 0:
-                reward_rows.append({
-                    'category_name': 'Miles Credits',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Credit',
-                    'spend': 0,
-                    'rewards': miles_credit_amount,
-                    'rewards_format': 'miles',
-                    'is_credit': True,
-                })
-                total_rewards += miles_credit_amount
-                total_rewards_miles += miles_credit_amount
-            credit_total = Transaction.objects.filter(
-                source=source,
-                category__name__istartswith='credit-',
-                date__year=selected_year
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            credit_amount = abs(float(credit_total))
-            if credit_amount > 0:
-                reward_rows.append({
-                    'category_name': 'Credits',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Credit',
-                    'spend': 0,
-                    'rewards': credit_amount,
-                    'rewards_format': 'cash',
-                    'is_credit': True,
-                })
-                total_rewards += credit_amount
-                total_rewards_cash += credit_amount
-        if source.reward_type == 'cashback':
-            credit_total = Transaction.objects.filter(
-                source=source,
-                category__name__istartswith='credit-',
-                date__year=selected_year
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            credit_amount = abs(float(credit_total))
-            if credit_amount > 0:
-                reward_rows.append({
-                    'category_name': 'Credits',
-                    'reporting_category_name': None,
-                    'multiplier': 0,
-                    'multiplier_label': 'Credit',
-                    'spend': 0,
-                    'rewards': credit_amount,
-                    'rewards_format': 'cash',
-                    'is_credit': True,
-                })
-                total_rewards += credit_amount
-                total_rewards_cash += credit_amount
-
-        blanket_spend = max(total_source_spend - covered_spend, 0)
-        blanket_multiplier = 0.01 if source.reward_type == 'cashback' else 1.0
-        blanket_rewards = blanket_spend * blanket_multiplier
-        if blanket_spend > 0 and source.reward_type != 'none':
-            reward_rows.append({
-                'category_name': 'All Other',
-                'reporting_category_name': None,
-                'multiplier': blanket_multiplier,
-                'multiplier_label': '1%' if source.reward_type == 'cashback' else '1.00x',
-                'spend': blanket_spend,
-                'rewards': blanket_rewards,
-                'rewards_format': 'cash' if source.reward_type == 'cashback' else 'miles',
-                'is_blanket': True,
-            })
-            total_spend += blanket_spend
-            total_rewards += blanket_rewards
-            if source.reward_type == 'miles':
-                total_rewards_miles += blanket_rewards
-            elif source.reward_type == 'cashback':
-                total_rewards_cash += blanket_rewards
-
-        reward_rows.sort(key=lambda row: (row.get('is_blanket', False), row.get('is_credit', False), row['category_name']))
-        sources_data.append({
-            'source': source,
-            'reward_rows': reward_rows,
-            'has_quarterly': any(row.get('applicable_quarter') for row in reward_rows),
-            'total_spend': total_spend,
-            'total_rewards': total_rewards,
-            'total_rewards_miles': total_rewards_miles,
-            'total_rewards_cash': total_rewards_cash,
-        })
-        if source.reward_type == 'miles':
-            total_miles_earned += total_rewards_miles
-            total_credits_earned += total_rewards_cash
-        elif source.reward_type == 'cashback':
-            total_cashback_earned += total_rewards_cash
+    summary = build_rewards_summary(sources, selected_year)
 
     context = {
-        'sources_data': sources_data,
+        'sources_data': summary['sources_data'],
         'years': years,
         'selected_year': selected_year,
-        'total_miles_earned': total_miles_earned,
-        'total_cashback_earned': total_cashback_earned,
-        'total_credits_earned': total_credits_earned,
+        'total_miles_earned': summary['total_miles_earned'],
+        'total_cashback_earned': summary['total_cashback_earned'],
+        'total_credits_earned': summary['total_credits_earned'],
         'sources': Source.objects.order_by('name'),
         'today': today,
-        'card_recommendations': build_card_recommendations(),
+        'card_recommendations': card_recommendations(),
     }
 
     return render(request, 'tracker/rewards.html', context)
 
 
+def card_recommendations_json(request):
+    """
+    The cached best-card table as JSON, optionally narrowed to one ?category= id, for pages
+    such as the add-transaction modal that only need a lookup.
+    """
+    recommendations = card_recommendations()
+    category_id = request.GET.get('category', '')
+    if category_id.isdigit():
+        recommendations = [rec for rec in recommendations if rec['category_id'] == int(category_id)]
+    return JsonResponse({'quarter': quarter_label(date.today()), 'recommendations': recommendations})
+
+
+def missed_rewards_view(request):
+    """
+    Missed-rewards audit: what using the best open card would have earned over a year or
+    an arbitrary date range, totalled by card and by category.
+    """
+    years = transaction_years() or [date.today().year]
+    selected_year = request.GET.get('year')
+    selected_year = int(selected_year) if selected_year and selected_year.isdigit() else years[-1]
+    start_date = request.GET.get('start_date', '')
+    end_date = request.GET.get('end_date', '')
+
+    if is_valid_date(start_date) and is_valid_date(end_date) and start_date <= end_date:
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date) + timedelta(days=1)
+        selected_year = None
+    else:
+        start_date = end_date = ''
+        start, end = year_date_range(selected_year)
+
+    audit = missed_rewards(start, end)
+    context = {
+        'years': years,
+        'selected_year': selected_year,
+        'start_date': start_date,
+        'end_date': end_date,
+        'by_card': audit['by_card'],
+        'by_category': audit['by_category'],
+        'total_spend': audit['total_spend'],
+        'total_missed': audit['total_missed'],
+    }
+    return render(request, 'tracker/missed_rewards.html', context)
+
+
+def range_report_view(request):
+    """
+    Income, spend and per category spend against pro-rated budget for an arbitrary
+    inclusive date range, defaulting to the year to date.
+    """
+    today = date.today()
+    start_date = request.GET.get('start_date', '')
+    end_date = request.GET.get('end_date', '')
+    if not (is_valid_date(start_date) and is_valid_date(end_date) and start_date <= end_date):
+        start_date = today.replace(month=1, day=1).isoformat()
+        end_date = today.isoformat()
+
+    report = range_report(date.fromisoformat(start_date), date.fromisoformat(end_date), today)
+    context = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'rows': report['rows'],
+        'income': report['income'],
+        'total_spend': report['total_spend'],
+        'total_budget': report['total_budget'],
+        'total_surplus': report['total_surplus'],
+        'savings': report['savings'],
+    }
+    return render(request, 'tracker/range_report.html', context)
+
+
 def category_year_view(request):
     """
     Display a bar chart of a single category's monthly totals for the selected year
@@ -2193,13 +1587,7 @@ def category_year_view(request):
 
     is_ttm = view_mode == "ttm"
 
-    year_values = (
-        Transaction.objects.annotate(year=ExtractYear("date"))
-        .values_list("year", flat=True)
-        .distinct()
-        .order_by("year")
-    )
-    years = list(year_values) or [current_year]
+    years = transaction_years() or [current_year]
     year = int(request.GET.get("year", years[-1] if years else current_year))
 
     # Default to first non-income category if none chosen
@@ -2214,8 +1602,6 @@ def category_year_view(request):
 
         ttm_months = [shift_month(current_year, now.month, -offset) for offset in range(11, -1, -1)]
         start_year, start_month = ttm_months[0]
-        start_date = datetime(start_year, start_month, 1).date()
-        end_date = now.date()
         month_labels = [f"{calendar.month_abbr[m]} '{str(y)[-2:]}" for y, m in ttm_months]
     else:
         ttm_months = None
@@ -2227,32 +1613,29 @@ def category_year_view(request):
     if category_id:
         try:
             selected_category = Category.objects.get(id=category_id)
-            base_filter = Q(category=selected_category) | Q(category__reporting_category=selected_category)
 
             if is_ttm:
-                txns = annotate_net_amount(
-                    Transaction.objects.filter(base_filter, date__gte=start_date, date__lte=end_date)
-                )
+                end_year, end_month = ttm_months[-1]
                 monthly_data = (
-                    txns.annotate(m=ExtractMonth("date"), y=ExtractYear("date"))
-                    .values("y", "m")
-                    .annotate(total=Sum("net_amount"))
+                    rollups_between(start_year, start_month, end_year, end_month)
+                    .filter(reporting_category=selected_category)
+                    .values("year", "month")
+                    .annotate(total=net_total())
+                    .order_by()
                 )
                 # Map each (year, month) to its TTM index
                 ttm_index = {(y, m): idx for idx, (y, m) in enumerate(ttm_months)}
                 for entry in monthly_data:
-                    key = (int(entry["y"]), int(entry["m"]))
+                    key = (int(entry["year"]), int(entry["month"]))
                     idx = ttm_index.get(key)
                     if idx is not None:
                         monthly_totals[idx] = abs(float(entry["total"])) if entry["total"] else 0
             else:
                 monthly_data = (
-                    annotate_net_amount(
-                        Transaction.objects.filter(base_filter, date__year=year)
-                    )
-                    .annotate(month=ExtractMonth("date"))
+                    MonthlyRollup.objects.filter(reporting_category=selected_category, year=year)
                     .values("month")
-                    .annotate(total=Sum("net_amount"))
+                    .annotate(total=net_total())
+                    .order_by()
                 )
                 for entry in monthly_data:
                     month_idx = int(entry["month"]) - 1
@@ -2281,6 +1664,12 @@ def category_year_view(request):
     return render(request, "tracker/category_year.html", context)
 
 
+def _allocate_in_order(wanted, available):
+    """Hand `available` out over the `wanted` amounts in order, each taking as much as it can."""
+    taken_before = np.cumsum(wanted) - wanted
+    return np.minimum(wanted, np.maximum(0, available - taken_before))
+
+
 def goals_view(request):
     goals = SavingsGoal.objects.filter(is_active=True)
     if not goals.exists():
@@ -2304,59 +1693,35 @@ def goals_view(request):
         else:
             current = date(current.year, current.month + 1, 1)
 
-    # Calculate monthly net savings using same pattern as ytd_report
-    transactions = annotate_net_amount(Transaction.objects.all())
-    total_positive = 0
-    total_negative = 0
-
-    for y, m in months_list:
-        income = transactions.filter(
-            date__year=y, date__month=m,
-            category__name__iexact='income'
-        ).exclude(CREDIT_CATEGORY_Q).aggregate(total=Sum('net_amount'))['total'] or 0
-
-        spend = transactions.exclude(
-            category__name__iexact='income'
-        ).exclude(CREDIT_CATEGORY_Q).filter(
-            date__year=y, date__month=m
-        ).aggregate(total=Sum('net_amount'))['total'] or 0
-
-        net = float(income) + float(spend)
-        if net > 0:
-            total_positive += net
-        else:
-            total_negative += abs(net)
+    # Monthly net savings for the whole span from one grouped rollup query
+    net_by_month = np.array([float(row['savings']) for row in period_totals(months_list)['months']])
+    total_positive = float(net_by_month[net_by_month > 0].sum())
+    total_negative = float(-net_by_month[net_by_month <= 0].sum())
 
-    num_months = len(months_list) or 1
+    num_months = net_by_month.size or 1
     avg_monthly_savings = (total_positive - total_negative) / num_months
 
-    # Gather manual contributions per goal
+    # Manual contribution totals and recent contributions for every goal, in two queries
     goal_data = []
-    for goal in goals:
-        manual_total = goal.contributions.aggregate(total=Sum('amount'))['total'] or 0
+    for goal in goals.annotate(manual_total=Sum('contributions__amount')).prefetch_related('contributions'):
         goal_data.append({
             'goal': goal,
-            'manual': float(manual_total),
+            'manual': float(goal.manual_total or 0),
             'auto_allocated': 0,
-            'contributions': goal.contributions.all()[:10],
+            'contributions': list(goal.contributions.all())[:10],
         })
 
     # Pass 1: Fill from positive months (by priority order)
-    remaining_savings = total_positive
     fill_ordered = sorted(goal_data, key=lambda g: (g['goal'].priority, g['goal'].created_at))
-    for g in fill_ordered:
-        needed = max(0, float(g['goal'].target_amount) - g['manual'])
-        auto = min(remaining_savings, needed)
-        remaining_savings -= auto
-        g['auto_allocated'] = auto
+    needed = np.array([max(0, float(g['goal'].target_amount) - g['manual']) for g in fill_ordered])
+    for g, auto in zip(fill_ordered, _allocate_in_order(needed, total_positive)):
+        g['auto_allocated'] = float(auto)
 
     # Pass 2: Withdraw from negative months (by withdrawal_priority order)
-    remaining_deficit = total_negative
     withdraw_ordered = sorted(goal_data, key=lambda g: (g['goal'].withdrawal_priority, g['goal'].created_at))
-    for g in withdraw_ordered:
-        deduction = min(remaining_deficit, g['auto_allocated'])
-        remaining_deficit -= deduction
-        g['auto_allocated'] -= deduction
+    allocated = np.array([g['auto_allocated'] for g in withdraw_ordered])
+    for g, deduction in zip(withdraw_ordered, _allocate_in_order(allocated, total_negative)):
+        g['auto_allocated'] -= float(deduction)
 
     # Compute final progress for each goal
     for g in goal_data: